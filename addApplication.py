@@ -4,27 +4,31 @@
 import sys
 import os
 import shutil
-import fileinput
-from tempfile import mkdtemp
-from string import Template
 from os.path import dirname
 
-from utils import copytree
+from utils import makedirs, loadManifestRows
+from templateRegistry import getRegistry
+from instrument import phase, runMain
 
 if sys.version_info < (2, 7):
     raise "must use python 2.7 or greater"
 import argparse
 
-def parseOptions():
+def parseOptions(argv=None):
     argParser = argparse.ArgumentParser(
         description='add a new application in current module'
     )
-    argParser.add_argument('appName',
-        help = 'application name')
+    argParser.add_argument('appNames',
+        help = 'application name (give several names to add several applications)',
+        nargs = '*',
+        metavar = 'appName')
     argParser.add_argument('-c', '--childof',
         help = 'parent Application',
         dest = 'childOf',
         default = '')
+    argParser.add_argument('-m', '--manifest',
+        help = 'also add the applications listed in this csv (with a name;childOf;shortName header) or json (list of objects with the same keys) file',
+        dest = 'manifestFile')
     argParser.add_argument('--templateDir',
         help = 'templates directory',
         dest = 'templateDir',
@@ -33,62 +37,132 @@ def parseOptions():
         help = 'target directory, where generated files will be placed',
         dest = 'targetDir',
         default = None)
-    args = argParser.parse_args()
+    args = argParser.parse_args(argv)
+    if (not args.appNames) and (not args.manifestFile):
+        argParser.error('give at least an appName or a --manifest')
     return args
 
-def addApplication(appName, childOf='', appShortName='', templateDir=None, targetDir=None):
-
+def getDefaultDirs(templateDir=None, targetDir=None):
     if targetDir is None:
         targetDir = os.path.join(dirname(dirname(__file__)), 'Apps')
 
     if templateDir is None:
         templateDir = os.path.join(dirname(__file__), 'templates')
+    return (templateDir, targetDir)
+
+def renderLines(content):
+    """strips each line of content, the way lines were printed back by fileinput"""
+    if not content:
+        return content
+    lines = content.split('\n')
+    if content.endswith('\n'):
+        lines.pop()
+    return ''.join(line.rstrip() + '\n' for line in lines)
 
-    toMoveFiles = [
+def renderApplication(appName, stagingDir, childOf='', appShortName='', templateDir=None):
+    """writes the files of appName in stagingDir, from the APP folder of templateDir"""
+    registry = getRegistry(templateDir)
+    appTemplateDir = os.path.join(registry.templateDir, 'APP')
+
+    toMoveFiles = dict([
         ( 'APP.app.template', '%s.app'%(appName.upper()) ),
         ( 'APP_init.php.in.template', '%s_init.php.in'%(appName.upper()) )
-    ]
+    ])
 
     toParseFiles = [
         '%s.app'%(appName.upper())
     ]
 
-    # create tmp dir
-    tempDir = mkdtemp()
-    #print "working in %s"%(tempDir)
-    # copy files to tmp dir
-    copytree(os.path.join(templateDir, 'APP'), tempDir, symlinks=False)
-    # rename files in tmp dir
-    for (fromFilePath, toFilePath) in toMoveFiles:
-        fromFileFullPath = os.path.join(tempDir, fromFilePath)
-        toFileFullPath = os.path.join(tempDir,toFilePath)
-        #print "move %s to %s"%(fromFileFullPath, toFileFullPath)
-        shutil.move(fromFileFullPath, toFileFullPath)
-    # parse files in tmp dir
-    for parsedFilePath in toParseFiles:
-        parsedFileFullPath = os.path.join(tempDir, parsedFilePath)
-        #print "parsing %s"%(parsedFileFullPath)
-
-        for line in fileinput.input(parsedFileFullPath, inplace=1):
-            print Template(line).safe_substitute({
-            'APPNAME': appName.upper(),
-            'CHILDOF': childOf.upper(),
-            'appShortName': appShortName,
-            'appIcon': "%s.png"%(appName.lower())
-        }).rstrip() #strip to remove EOL duplication
-
-    # move tmp dir to target dir
-    shutil.move(tempDir, os.path.join(targetDir, appName.upper()))
+    templateValues = {
+        'APPNAME': appName.upper(),
+        'CHILDOF': childOf.upper(),
+        'appShortName': appShortName,
+        'appIcon': "%s.png"%(appName.lower())
+    }
+
+    for root, dirs, files in os.walk(appTemplateDir):
+        dirs.sort()
+        relDir = os.path.relpath(root, appTemplateDir)
+        targetRoot = os.path.normpath(os.path.join(stagingDir, relDir))
+        for subDir in dirs:
+            os.mkdir(os.path.join(targetRoot, subDir))
+        for fileName in sorted(files):
+            relPath = os.path.normpath(os.path.join(relDir, fileName))
+            targetPath = os.path.join(targetRoot, toMoveFiles.get(relPath, fileName))
+            if os.path.relpath(targetPath, stagingDir) in toParseFiles:
+                with phase('generate'):
+                    content = renderLines(registry.substitute(os.path.join('APP', relPath), templateValues))
+                with phase('write'):
+                    targetFile = open(targetPath, 'w')
+                    targetFile.write(content)
+                    targetFile.close()
+                    shutil.copymode(os.path.join(root, fileName), targetPath)
+            else:
+                with phase('write'):
+                    shutil.copy2(os.path.join(root, fileName), targetPath)
+        if root != appTemplateDir:
+            shutil.copystat(root, targetRoot)
+    shutil.copystat(appTemplateDir, stagingDir)
+
+def addApplications(applications, templateDir=None, targetDir=None):
+    """adds applications, given as dicts with appName, and optional childOf and appShortName keys
+
+        each application is rendered in a staging folder created in targetDir, which is then
+        renamed, so an application folder is never seen partially written.
+        Nothing is written if one of the application folders already exists.
+    """
+    import tempfile
+    (templateDir, targetDir) = getDefaultDirs(templateDir, targetDir)
+
+    appDirs = []
+    for application in applications:
+        appDir = os.path.join(targetDir, application['appName'].upper())
+        if os.path.exists(appDir) or (appDir in appDirs):
+            raise NameError("application %s already exists in %s"%(application['appName'].upper(), targetDir))
+        appDirs.append(appDir)
+
+    makedirs(targetDir)
+    for (application, appDir) in zip(applications, appDirs):
+        # same filesystem as appDir, so that it can be renamed
+        stagingDir = tempfile.mkdtemp(dir=targetDir, prefix='.%s.'%(os.path.basename(appDir)))
+        try:
+            renderApplication(application['appName'], stagingDir,
+                childOf = application.get('childOf', ''),
+                appShortName = application.get('appShortName', ''),
+                templateDir = templateDir)
+            with phase('write'):
+                os.rename(stagingDir, appDir)
+        except:
+            shutil.rmtree(stagingDir, True)
+            raise
+    return appDirs
+
+def addApplication(appName, childOf='', appShortName='', templateDir=None, targetDir=None):
+    addApplications([{'appName': appName, 'childOf': childOf, 'appShortName': appShortName}],
+        templateDir = templateDir,
+        targetDir = targetDir)
     return
 
-def main():
-    args = parseOptions()
-    addApplication(
-        args.appName,
-        childOf = args.childOf,
-        appShortName = args.appName.capitalize(),
+def main(argv=None):
+    """returns the directories of the added applications"""
+    args = parseOptions(argv)
+    applications = [{
+        'appName': appName,
+        'childOf': args.childOf,
+        'appShortName': appName.capitalize()
+    } for appName in args.appNames]
+    if args.manifestFile:
+        for row in loadManifestRows(args.manifestFile):
+            if not row.get('name'):
+                raise NameError("%s: each application needs a name (%r)"%(args.manifestFile, row))
+            applications.append({
+                'appName': row['name'],
+                'childOf': row.get('childOf') or '',
+                'appShortName': row.get('shortName') or row['name'].capitalize()
+            })
+    return addApplications(applications,
         templateDir = args.templateDir,
         targetDir = args.targetDir)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    runMain(main)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""sqlite index of the families, workflows, attributes and method files declared in csv files
+
+the index is kept in <familiesFolder>/.cache/attributeIndex.sqlite. On update,
+only the STRUCT_, PARAM_ and WFL_ files whose mtime or size changed are parsed
+again, and the records of removed files are dropped. Queries then only read
+the index:
+
+    attributeIndex.py attribute my_attr     families declaring (or inheriting) an attribute
+    attributeIndex.py family MY_FAMILY      family, its parent, method file and csv files
+    attributeIndex.py attributes MY_FAMILY  attributes of a family
+    attributeIndex.py method Method.x.php   families using a method file
+    attributeIndex.py search 'my_%'         attributes whose id matches a sql like pattern
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import logging
+
+from instrument import phase, runMain
+from dynacaseCsv import readRecords, isMethodDeclaration
+from extractAttrProductConst import scanFamiliesFolder
+from utils import makedirs
+
+logging.basicConfig(
+    format='[%(lineno)d] %(levelname)s:%(message)s'
+)
+
+# bump it when the schema or the parsing changes, the index is then built again
+SCHEMA_VERSION = 1
+
+SCHEMA = [
+    "CREATE TABLE files (path TEXT PRIMARY KEY, kind TEXT, mtime REAL, size INTEGER)",
+    "CREATE TABLE families (name TEXT, parent TEXT, title TEXT, className TEXT, kind TEXT, file TEXT, line INTEGER)",
+    "CREATE TABLE attributes (id TEXT, family TEXT, keyword TEXT, frame TEXT, label TEXT, type TEXT, file TEXT, line INTEGER)",
+    "CREATE TABLE methods (family TEXT, method TEXT, declaration INTEGER, file TEXT, line INTEGER)",
+    "CREATE INDEX familiesName ON families (name)",
+    "CREATE INDEX familiesParent ON families (parent)",
+    "CREATE INDEX familiesFile ON families (file)",
+    "CREATE INDEX attributesId ON attributes (id)",
+    "CREATE INDEX attributesFamily ON attributes (family)",
+    "CREATE INDEX attributesFile ON attributes (file)",
+    "CREATE INDEX methodsMethod ON methods (method)",
+    "CREATE INDEX methodsFamily ON methods (family)",
+    "CREATE INDEX methodsFile ON methods (file)"
+]
+
+# kinds of scanFamiliesFolder which are indexed
+INDEXED_KINDS = ['struct', 'param', 'wfl']
+
+def parseOptions():
+    argParser = argparse.ArgumentParser(
+        description = 'queries an index of the families, attributes and method files declared in csv files (the index is updated first).',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter
+    )
+    argParser.add_argument('query',
+        help = 'what to look for',
+        choices = ['update', 'attribute', 'family', 'attributes', 'method', 'search'])
+    argParser.add_argument('value',
+        help = 'attribute id, family name, method file or pattern (not needed for update)',
+        nargs = '?',
+        default = None)
+    argParser.add_argument('-f', '--familiesFolder',
+        help = 'families folder',
+        dest = 'familiesFolder',
+        default = os.path.relpath(os.path.join(os.path.dirname(__file__), '..', 'Families')))
+    argParser.add_argument('--indexFile',
+        help = 'sqlite index file (defaults to <familiesFolder>/.cache/attributeIndex.sqlite)',
+        dest = 'indexFile',
+        default = None)
+    argParser.add_argument('--withInherited',
+        help = 'attribute: also list families inheriting the attribute; attributes: also list inherited attributes',
+        action = 'store_true',
+        dest = 'withInherited',
+        default = False)
+    argParser.add_argument('--noUpdate',
+        help = 'query the index as it is, without checking csv files',
+        action = 'store_true',
+        dest = 'noUpdate',
+        default = False)
+    argParser.add_argument('--json',
+        help = 'print results as json',
+        action = 'store_true',
+        dest = 'json',
+        default = False)
+    argParser.add_argument('--logLevel',
+        help = 'logging level',
+        dest = 'logLevel',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        default = 'WARNING')
+    args = argParser.parse_args()
+    if (args.query != 'update') and not args.value:
+        argParser.error('%s needs a value'%(args.query))
+    return args
+
+def parseCsvFile(fileName):
+    """returns (families, attributes, methods) rows declared in a csv file
+
+        records before END belong to the family opened by the last BEGIN line,
+        PARAM_ files only declare the logical name of the family they complete.
+    """
+    families = []
+    attributes = []
+    methods = []
+    familyName = ''
+    for (lineNumber, (keyword, col1, col2, col3, col4, col5, col6)) in readRecords(fileName, (0, 1, 2, 3, 4, 5, 6),
+            ['BEGIN', 'END', 'ATTR', 'PARAM', 'MODATTR', 'METHOD']):
+        if keyword == 'BEGIN':
+            familyName = col5.strip().upper()
+            parentName = col1.strip().upper()
+            if parentName == '-':
+                parentName = ''
+            if not familyName:
+                logging.warning("%s:%s has no logical name, its records are not indexed", fileName, lineNumber)
+            families.append((familyName, parentName, col2, col4.strip(), lineNumber))
+        elif keyword == 'END':
+            familyName = ''
+        elif not familyName:
+            continue
+        elif keyword == 'METHOD':
+            method = col1.strip()
+            if method:
+                methods.append((familyName, method.lstrip('*+'), int(isMethodDeclaration(method)), lineNumber))
+        else:
+            attributes.append((col1.strip().lower(), familyName, keyword, col2.strip().lower(), col3, col6.strip(), lineNumber))
+    return (families, attributes, methods)
+
+class AttributeIndex(object):
+    """sqlite index of the csv files of a families folder"""
+    def __init__(self, indexFileName):
+        self.indexFileName = indexFileName
+        if indexFileName != ':memory:':
+            makedirs(os.path.dirname(os.path.abspath(indexFileName)))
+        self.connection = sqlite3.connect(indexFileName)
+        self.connection.row_factory = sqlite3.Row
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.createSchema()
+
+    def createSchema(self):
+        with self.connection:
+            for (table, ) in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                self.connection.execute("DROP TABLE %s"%(table))
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            self.connection.execute("PRAGMA user_version = %d"%(SCHEMA_VERSION))
+
+    def close(self):
+        self.connection.close()
+
+    def removeFile(self, path):
+        for table in ['files', 'families', 'attributes', 'methods']:
+            column = 'path' if table == 'files' else 'file'
+            self.connection.execute("DELETE FROM %s WHERE %s = ?"%(table, column), (path, ))
+
+    def indexFile(self, path, kind, fileStat):
+        self.removeFile(path)
+        with phase('parse'):
+            (families, attributes, methods) = parseCsvFile(path)
+        with phase('write'):
+            self.connection.executemany("INSERT INTO families VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(name, parent, title, className, kind, path, line) for (name, parent, title, className, line) in families
+                    if name and (kind != 'param')])
+            self.connection.executemany("INSERT INTO attributes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [row[:6] + (path, row[6]) for row in attributes])
+            self.connection.executemany("INSERT INTO methods VALUES (?, ?, ?, ?, ?)",
+                [row[:3] + (path, row[3]) for row in methods])
+            self.connection.execute("INSERT INTO files VALUES (?, ?, ?, ?)", (path, kind, fileStat.st_mtime, fileStat.st_size))
+
+    def update(self, familiesFolder, scanIndexFileName=None):
+        """parses csv files of familiesFolder which changed since last update
+            returns (number of parsed files, number of removed files)
+        """
+        with phase('scan'):
+            foundFiles = scanFamiliesFolder(familiesFolder, scanIndexFileName)
+            known = dict((row['path'], (row['mtime'], row['size'])) for row in self.connection.execute("SELECT path, mtime, size FROM files"))
+        parsed = 0
+        found = set()
+        with self.connection:
+            for kind in INDEXED_KINDS:
+                for fileName in foundFiles[kind]:
+                    path = os.path.abspath(fileName)
+                    with phase('scan'):
+                        try:
+                            fileStat = os.stat(path)
+                        except OSError:
+                            continue
+                    found.add(path)
+                    if known.get(path) != (fileStat.st_mtime, fileStat.st_size):
+                        self.indexFile(path, kind, fileStat)
+                        parsed += 1
+            removed = [path for path in known if path not in found]
+            for path in removed:
+                self.removeFile(path)
+        logging.info("%s csv files parsed, %s removed", parsed, len(removed))
+        return (parsed, len(removed))
+
+    def getDescendants(self, familyName):
+        """returns the names of the families inheriting from familyName"""
+        return [row[0] for row in self.connection.execute(
+            "WITH RECURSIVE descendants(name) AS ("
+            " SELECT name FROM families WHERE parent = ?"
+            " UNION SELECT families.name FROM families JOIN descendants ON families.parent = descendants.name"
+            ") SELECT name FROM descendants ORDER BY name", (familyName.upper(), ))]
+
+    def getAncestors(self, familyName):
+        """returns the names of the ancestors of familyName found in the index, from its parent up"""
+        ancestors = []
+        family = self.getFamily(familyName)
+        while family and family['parent'] and (family['parent'] not in ancestors) and (family['parent'] != familyName.upper()):
+            ancestors.append(family['parent'])
+            family = self.getFamily(family['parent'])
+        return ancestors
+
+    def getFamily(self, familyName):
+        """returns the family (or workflow) row of familyName, with its method files, or None"""
+        row = self.connection.execute("SELECT * FROM families WHERE name = ? ORDER BY file LIMIT 1", (familyName.upper(), )).fetchone()
+        if row is None:
+            return None
+        family = dict(row)
+        family['methods'] = [dict(method) for method in self.connection.execute(
+            "SELECT method, declaration, file, line FROM methods WHERE family = ? ORDER BY declaration DESC, file, line", (family['name'], ))]
+        family['files'] = [path for (path, ) in self.connection.execute(
+            "SELECT DISTINCT file FROM attributes WHERE family = ?"
+            " UNION SELECT file FROM families WHERE name = ?"
+            " UNION SELECT file FROM methods WHERE family = ? ORDER BY 1", (family['name'], family['name'], family['name']))]
+        return family
+
+    def findAttribute(self, attributeId, withInherited=False):
+        """returns the rows declaring attributeId, with inheritedBy: the families inheriting it (when withInherited)"""
+        rows = [dict(row) for row in self.connection.execute(
+            "SELECT * FROM attributes WHERE id = ? ORDER BY family, file, line", (attributeId.lower(), ))]
+        if withInherited:
+            for row in rows:
+                row['inheritedBy'] = self.getDescendants(row['family'])
+        return rows
+
+    def getAttributes(self, familyName, withInherited=False):
+        """returns the attribute rows of familyName (and of its ancestors when withInherited), in csv order"""
+        familyNames = [familyName.upper()]
+        if withInherited:
+            familyNames += self.getAncestors(familyName)
+        rows = []
+        for name in reversed(familyNames):
+            rows.extend(dict(row) for row in self.connection.execute(
+                "SELECT * FROM attributes WHERE family = ? ORDER BY file, line", (name, )))
+        return rows
+
+    def findMethod(self, methodFile):
+        """returns the method rows of the families using methodFile"""
+        return [dict(row) for row in self.connection.execute(
+            "SELECT * FROM methods WHERE method = ? ORDER BY declaration DESC, family", (os.path.basename(methodFile), ))]
+
+    def search(self, pattern):
+        """returns the attribute rows whose id matches pattern (sql like, case insensitive)"""
+        return [dict(row) for row in self.connection.execute(
+            "SELECT * FROM attributes WHERE id LIKE ? ORDER BY id, family", (pattern.lower(), ))]
+
+def getDefaultIndexFile(familiesFolder):
+    return os.path.join(familiesFolder, '.cache', 'attributeIndex.sqlite')
+
+def openIndex(familiesFolder, indexFileName=None, update=True):
+    """returns the AttributeIndex of familiesFolder, updated unless update is False"""
+    if indexFileName is None:
+        indexFileName = getDefaultIndexFile(familiesFolder)
+    index = AttributeIndex(indexFileName)
+    if update:
+        index.update(familiesFolder, os.path.join(os.path.dirname(os.path.abspath(indexFileName)), 'attributeIndex.scan.json'))
+    return index
+
+def formatLocation(row):
+    return "%s:%s"%(os.path.relpath(row['file']), row['line'])
+
+def formatResults(query, results):
+    """returns the lines describing the results of query"""
+    lines = []
+    if query == 'family':
+        if results is None:
+            return lines
+        lines.append(u"%s (%s) %s"%(results['name'], results['kind'], formatLocation(results)))
+        lines.append(u"\tparent: %s"%(results['parent'] or '-'))
+        lines.append(u"\ttitle: %s"%(results['title']))
+        if results['className']:
+            lines.append(u"\tclass: %s"%(results['className']))
+        for method in results['methods']:
+            lines.append(u"\tmethod: %s%s %s"%(method['method'], '' if method['declaration'] else ' (added)', formatLocation(method)))
+        for path in results['files']:
+            lines.append(u"\tfile: %s"%(os.path.relpath(path)))
+    elif query == 'method':
+        for row in results:
+            lines.append(u"%s\t%s%s %s"%(row['family'], row['method'], '' if row['declaration'] else ' (added)', formatLocation(row)))
+    else:
+        for row in results:
+            line = u"%s\t%s\t%s\t%s %s"%(row['family'], row['id'], row['keyword'], row['label'], formatLocation(row))
+            if row.get('inheritedBy'):
+                line += u"\n\tinherited by: %s"%(', '.join(row['inheritedBy']))
+            lines.append(line)
+    return lines
+
+def printResults(query, results):
+    # encoded, as stdout has no encoding when it is piped
+    for line in formatResults(query, results):
+        print line.encode('utf8')
+
+def main():
+    args = parseOptions()
+    logging.getLogger().setLevel(getattr(logging, args.logLevel))
+    index = openIndex(args.familiesFolder, args.indexFile, update=not args.noUpdate)
+    try:
+        if args.query == 'update':
+            return
+        with phase('query'):
+            if args.query == 'attribute':
+                results = index.findAttribute(args.value, args.withInherited)
+            elif args.query == 'family':
+                results = index.getFamily(args.value)
+            elif args.query == 'attributes':
+                results = index.getAttributes(args.value, args.withInherited)
+            elif args.query == 'method':
+                results = index.findMethod(args.value)
+            else:
+                results = index.search(args.value)
+    finally:
+        index.close()
+    if args.json:
+        print json.dumps(results, indent=4, sort_keys=True)
+    else:
+        printResults(args.query, results)
+    if not results:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    runMain(main)
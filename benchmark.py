@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import subprocess
+from string import Template
+from tempfile import mkdtemp
+
+if sys.version_info < (2, 7):
+    raise "must use python 2.7 or greater"
+import argparse
+
+devToolsDir = os.path.dirname(os.path.abspath(__file__))
+
+PHASES = ['scan', 'parse', 'generate', 'write']
+
+# tools run against the synthetic project
+PROJECT_TOOLS = ['extract', 'infoxml', 'addapp']
+
+# tools whose import time is measured by the startup run
+STARTUP_TOOLS = ['extractAttrProductConst', 'generateInfoXml', 'generateFamily', 'generateWorkflow', 'addApplication', 'devTools']
+
+# run with python -c in a new interpreter, so that modules loaded by the benchmark do not hide the ones of the tool:
+# imports the tool given as second argument, timing every module loaded meanwhile (the way python3 -X importtime does),
+# and prints the times and the names of the modules it added to sys.modules as json
+IMPORT_TIME_SCRIPT = """
+import sys, time, json, __builtin__
+sys.path.insert(0, sys.argv[1])
+originalImport = __builtin__.__import__
+modules = []
+nestedTimes = []
+def timedImport(name, *args):
+    loadedModules = len(sys.modules)
+    nestedTimes.append(0.0)
+    start = time.time()
+    try:
+        return originalImport(name, *args)
+    finally:
+        cumulative = time.time() - start
+        nestedTime = nestedTimes.pop()
+        if nestedTimes:
+            nestedTimes[-1] += cumulative
+        if len(sys.modules) > loadedModules:
+            modules.append({'name': name, 'self': cumulative - nestedTime, 'cumulative': cumulative})
+def getLoaded():
+    # python 2 records failed relative imports as None
+    return set(name for (name, module) in sys.modules.items() if module is not None)
+__builtin__.__import__ = timedImport
+loadedBefore = getLoaded()
+start = time.time()
+__import__(sys.argv[2])
+total = time.time() - start
+__builtin__.__import__ = originalImport
+loaded = sorted(getLoaded() - loadedBefore)
+sys.stdout.write(json.dumps({'total': total, 'modules': modules, 'loaded': loaded}))
+"""
+
+def parseOptions():
+    argParser = argparse.ArgumentParser(
+        description = 'generates a synthetic Dynacase project and times devTools scripts against it.',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter
+    )
+    argParser.add_argument('-n', '--families',
+        help = 'number of families',
+        dest = 'families',
+        type = int,
+        default = 100)
+    argParser.add_argument('-m', '--attributes',
+        help = 'number of attributes per family',
+        dest = 'attributes',
+        type = int,
+        default = 30)
+    argParser.add_argument('-k', '--workflows',
+        help = 'number of workflows',
+        dest = 'workflows',
+        type = int,
+        default = 20)
+    argParser.add_argument('--familiesPerFolder',
+        help = 'number of families per sub folder of Families',
+        dest = 'familiesPerFolder',
+        type = int,
+        default = 50)
+    argParser.add_argument('-t', '--targets',
+        help = 'number of targets in targets.xml',
+        dest = 'targets',
+        type = int,
+        default = 200)
+    argParser.add_argument('--processes',
+        help = 'number of process nodes per target',
+        dest = 'processes',
+        type = int,
+        default = 5)
+    argParser.add_argument('-d', '--profileDepth',
+        help = 'nesting depth of profiles in targets.xml',
+        dest = 'profileDepth',
+        type = int,
+        default = 10)
+    argParser.add_argument('-a', '--applications',
+        help = 'number of applications created by addApplication',
+        dest = 'applications',
+        type = int,
+        default = 20)
+    argParser.add_argument('--variants',
+        help = 'number of info.xml documents generated by the separate and batch runs of generateInfoXml',
+        dest = 'variants',
+        type = int,
+        default = 10)
+    argParser.add_argument('--tools',
+        help = 'tools to benchmark',
+        dest = 'tools',
+        action = 'append',
+        choices = PROJECT_TOOLS + ['startup'])
+    argParser.add_argument('--importBudget',
+        help = 'milliseconds the import of each tool may take in the startup run (the exit code is 1 if one takes longer)',
+        dest = 'importBudget',
+        type = float,
+        default = 50.0)
+    argParser.add_argument('--moduleBudget',
+        help = 'number of modules the import of each tool may load in the startup run (the exit code is 1 if one loads more): '
+            'unlike the import time, it does not depend on the machine',
+        dest = 'moduleBudget',
+        type = int,
+        default = 60)
+    argParser.add_argument('--importRuns',
+        help = 'number of times each tool is imported in the startup run (the fastest one is kept)',
+        dest = 'importRuns',
+        type = int,
+        default = 5)
+    argParser.add_argument('--workDir',
+        help = 'directory where the synthetic project is generated (a temp dir by default, removed at the end)',
+        dest = 'workDir',
+        default = None)
+    argParser.add_argument('--json',
+        help = 'also write results as json in this file',
+        dest = 'jsonFile',
+        default = None)
+    args = argParser.parse_args()
+    if not args.tools:
+        args.tools = PROJECT_TOOLS + ['startup']
+    return args
+
+def writeFile(fileName, content):
+    targetFile = open(fileName, 'w')
+    targetFile.write(content)
+    targetFile.close()
+
+def generateSyntheticProject(projectDir, families, attributes, workflows, familiesPerFolder, targets, processes, profileDepth):
+    """creates a Dynacase project in projectDir:
+        - Families/ with STRUCT_/PARAM_/Method. files for each family, and WFL_/Class. files for workflows
+        - targets.xml with targets and profiles nested profileDepth deep
+        - info.xml.in
+        - Apps/ to receive generated applications
+    """
+    familiesDir = os.path.join(projectDir, 'Families')
+    os.makedirs(familiesDir)
+    os.makedirs(os.path.join(projectDir, 'Apps'))
+    methodTemplate = Template(open(os.path.join(devToolsDir, 'templates', 'Method.family.php.template')).read())
+    wflClassTemplate = Template(open(os.path.join(devToolsDir, 'templates', 'Class.workflow.php.template')).read())
+
+    for familyIndex in range(families):
+        familyName = "FAM%05d"%(familyIndex)
+        subDir = os.path.join(familiesDir, "group%03d"%(familyIndex // max(familiesPerFolder, 1)))
+        if not os.path.isdir(subDir):
+            os.makedirs(subDir)
+        methodName = "Method.%s.php"%(familyName.lower())
+        fromName = ''
+        if familyIndex % 4:
+            fromName = "FAM%05d"%(familyIndex - 1)
+        lines = [
+            "//;Father ;Title;Id;Classe;Logical Name;;;;;;;;;;;",
+            "BEGIN;%s;%s;;;%s;;;;;;;;;;;"%(fromName, familyName.capitalize(), familyName),
+            "METHOD;%s;;;;"%(methodName),
+            "//;idattr;idframe;label;T;A;type;ord;vis;need;link;phpfile;phpfunc;elink ;constraint ;option;Commentaires",
+            "ATTR;%s_FR;;\"Frame; %s\";N;N;frame;10;W;;;;;;;;"%(familyName, familyName)
+        ]
+        for attrIndex in range(attributes):
+            lines.append("ATTR;%s_A%03d;%s_FR;Attribute %s;N;N;text;%s;W;;;;;;;;"%(familyName, attrIndex, familyName, attrIndex, 20 + attrIndex))
+        lines.append("PARAM;%s_P;%s_FR;Parameter;N;N;text;1000;W;;;;;;;;"%(familyName, familyName))
+        lines.append("END;;;;;")
+        writeFile(os.path.join(subDir, "STRUCT_%s.csv"%(familyName.lower())), "\n".join(lines) + "\n")
+        writeFile(os.path.join(subDir, "PARAM_%s.csv"%(familyName.lower())), "BEGIN;;;;;%s\nEND;;;;;\n"%(familyName))
+        writeFile(os.path.join(familiesDir, methodName), methodTemplate.safe_substitute({
+            'familyClass': familyName,
+            'fromClass'  : fromName and ('_' + fromName) or 'Doc'
+        }))
+
+    for wflIndex in range(workflows):
+        workflowName = "WFL%05d"%(wflIndex)
+        lines = ["BEGIN;WDOC;%s;;%s;%s;;;;;;;;;;"%(workflowName, workflowName, workflowName)]
+        for attrIndex in range(attributes):
+            lines.append("ATTR;%s_A%03d;;Attribute %s;N;N;text;%s;W;;;;;;;"%(workflowName, attrIndex, attrIndex, 20 + attrIndex))
+        lines.append("END;;;;;;;;;;;;;;;")
+        writeFile(os.path.join(familiesDir, "WFL_%s.csv"%(workflowName.lower())), "\n".join(lines) + "\n")
+        writeFile(os.path.join(familiesDir, "Class.%s.php"%(workflowName)), wflClassTemplate.safe_substitute({
+            'workflowName': workflowName,
+            'familyName'  : workflowName
+        }))
+
+    # targets are spread over profiles, each profile also includes the next one
+    targetsXml = [
+        '<?xml version="1.0" ?>',
+        '<!DOCTYPE targets [',
+        '<!ELEMENT targets (target|profile)*>',
+        '<!ELEMENT target (process)*>',
+        '<!ATTLIST target id ID #REQUIRED label CDATA #IMPLIED usefor CDATA #IMPLIED>',
+        '<!ELEMENT process (label)*>',
+        '<!ATTLIST process command CDATA #REQUIRED>',
+        '<!ELEMENT label (#PCDATA)>',
+        '<!ATTLIST label lang CDATA #REQUIRED>',
+        '<!ELEMENT profile (refTarget)*>',
+        '<!ATTLIST profile id ID #REQUIRED label CDATA #IMPLIED>',
+        '<!ELEMENT refTarget (#PCDATA)>',
+        '<!ATTLIST refTarget targetId IDREF #REQUIRED>',
+        ']>',
+        '<targets>'
+    ]
+    for targetIndex in range(targets):
+        usefor = ['', ' usefor="post-install"', ' usefor="post-upgrade"'][targetIndex % 3]
+        targetsXml.append('    <target id="t%s" label="target %s"%s>'%(targetIndex, targetIndex, usefor))
+        for processIndex in range(processes):
+            targetsXml.append('        <process command="./wsh.php --api=importDocuments --file=./APP/file_%s_%s.csv">'%(targetIndex, processIndex))
+            targetsXml.append('            <label lang="en">importing file_%s_%s.csv</label>'%(targetIndex, processIndex))
+            targetsXml.append('        </process>')
+        targetsXml.append('    </target>')
+    depth = max(profileDepth, 1)
+    for profileIndex in range(depth):
+        targetsXml.append('    <profile id="p%s" label="profile %s">'%(profileIndex, profileIndex))
+        for targetIndex in range(profileIndex, targets, depth):
+            targetsXml.append('        <refTarget targetId="t%s"/>'%(targetIndex))
+        if profileIndex + 1 < depth:
+            targetsXml.append('        <refTarget targetId="p%s"/>'%(profileIndex + 1))
+        targetsXml.append('    </profile>')
+    targetsXml.append('</targets>')
+    writeFile(os.path.join(projectDir, 'targets.xml'), "\n".join(targetsXml) + "\n")
+
+    writeFile(os.path.join(projectDir, 'info.xml.in'), "\n".join([
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<module name="synthetic" version="@VERSION@" release="@RELEASE@">',
+        '    <description>synthetic module</description>',
+        '    <requires><module name="dynacase-core"/></requires>',
+        '    <post-install>',
+        '        <process command="programs/record_application @APPNAME@"/>',
+        '    </post-install>',
+        '    <post-upgrade/>',
+        '</module>'
+    ]) + "\n")
+
+def snapshotTree(directory):
+    """returns {path: (inode, mtime, size)} for every file under directory"""
+    snapshot = {}
+    for root, dirs, files in os.walk(directory):
+        for fileName in files:
+            filePath = os.path.join(root, fileName)
+            fileStat = os.stat(filePath)
+            snapshot[filePath] = (fileStat.st_ino, fileStat.st_mtime, fileStat.st_size)
+    return snapshot
+
+def countWrittenFiles(before, after):
+    return len([filePath for filePath in after if before.get(filePath) != after[filePath]])
+
+def runTool(name, tool, argvs, projectDir, cwd):
+    """runs tool main() once per argv in a child process, and returns its measures"""
+    resultFileName = os.path.join(os.path.dirname(projectDir), 'benchmark-result.json')
+    before = snapshotTree(projectDir)
+    wallStart = time.time()
+    returnCode = subprocess.call(
+        [sys.executable, os.path.abspath(__file__), '--child', tool, resultFileName, json.dumps(argvs)],
+        cwd = cwd)
+    wallTime = time.time() - wallStart
+    result = {'name': name, 'wall': wallTime, 'returnCode': returnCode, 'phases': {}, 'maxRss': None}
+    if os.path.isfile(resultFileName):
+        childResult = json.load(open(resultFileName))
+        os.unlink(resultFileName)
+        result.update(childResult)
+    result['writtenFiles'] = countWrittenFiles(before, snapshotTree(projectDir))
+    return result
+
+def runToolPerArgv(name, tool, argvs, projectDir, cwd):
+    """runs tool main() in a new child process for each argv, and returns the summed measures"""
+    result = {'name': name, 'wall': 0.0, 'returnCode': 0, 'phases': {}, 'maxRss': None, 'writtenFiles': 0}
+    for argv in argvs:
+        argvResult = runTool(name, tool, [argv], projectDir, cwd)
+        result['wall'] += argvResult['wall']
+        result['returnCode'] = result['returnCode'] or argvResult['returnCode']
+        result['maxRss'] = max(result['maxRss'], argvResult['maxRss'])
+        result['writtenFiles'] += argvResult['writtenFiles']
+        for (phaseName, measures) in argvResult['phases'].items():
+            phaseResult = result['phases'].setdefault(phaseName, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+            for key in phaseResult:
+                phaseResult[key] += measures[key]
+    return result
+
+def runChild(tool, resultFileName, argvs):
+    """entry point of the child process started by runTool"""
+    sys.path.insert(0, devToolsDir)
+    import instrument
+    module = __import__(tool)
+    # tools print their output: it is discarded at the file descriptor level
+    # since some of them replace sys.stdout
+    devNull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devNull, sys.stdout.fileno())
+    os.close(devNull)
+    for argv in argvs:
+        sys.argv = [module.__file__] + argv
+        module.main()
+    phases = {}
+    for (name, wallTime, cpuTime, calls, byteCount) in instrument.getPhases():
+        phases[name] = {'wall': wallTime, 'cpu': cpuTime, 'calls': calls}
+    resultFile = open(resultFileName, 'w')
+    json.dump({
+        'phases': phases,
+        # ru_maxrss is in kilobytes on linux
+        'maxRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }, resultFile)
+    resultFile.close()
+
+def measureImportTime(tool, runs):
+    """imports tool in runs new interpreters, and returns the measures of the fastest import"""
+    best = None
+    for runIndex in range(max(runs, 1)):
+        measures = json.loads(subprocess.check_output([sys.executable, '-c', IMPORT_TIME_SCRIPT, devToolsDir, tool]))
+        if (best is None) or (measures['total'] < best['total']):
+            best = measures
+    return {
+        'name': tool,
+        'import': best['total'],
+        'modules': len(best['loaded']),
+        'loaded': best['loaded'],
+        'slowest': sorted(best['modules'], key=lambda module: module['self'], reverse=True)[:3]
+    }
+
+def printImportTimes(importResults, budget, moduleBudget):
+    """prints the import time and loaded modules of each tool, and returns the number of tools over a budget"""
+    header = "%-28s %9s %8s  %s" % ('tool', 'import(ms)', 'modules', 'slowest modules (self ms)')
+    print(header)
+    print('-' * len(header))
+    overBudget = 0
+    for result in importResults:
+        line = "%-28s %9.1f %8d  %s" % (result['name'], result['import'] * 1000, result['modules'],
+            ', '.join('%s %.1f'%(module['name'], module['self'] * 1000) for module in result['slowest']))
+        overs = []
+        if result['import'] * 1000 > budget:
+            overs.append("the %sms budget" % (budget))
+        if result['modules'] > moduleBudget:
+            overs.append("the %s modules budget" % (moduleBudget))
+        if overs:
+            line += " (over %s)" % (' and '.join(overs))
+            overBudget += 1
+        print(line)
+    return overBudget
+
+def printResults(results):
+    header = "%-28s %9s" % ('run', 'wall (s)')
+    for phaseName in PHASES:
+        header += " %9s" % (phaseName)
+    header += " %12s %8s" % ('peak RSS(MB)', 'written')
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        line = "%-28s %9.3f" % (result['name'], result['wall'])
+        for phaseName in PHASES:
+            if phaseName in result['phases']:
+                line += " %9.3f" % (result['phases'][phaseName]['wall'])
+            else:
+                line += " %9s" % ('-')
+        if result['maxRss']:
+            line += " %12.1f" % (result['maxRss'] / 1024.0)
+        else:
+            line += " %12s" % ('-')
+        line += " %8d" % (result['writtenFiles'])
+        if result['returnCode']:
+            line += " (exit code %s)" % (result['returnCode'])
+        print(line)
+
+def main():
+    if (len(sys.argv) > 1) and (sys.argv[1] == '--child'):
+        runChild(sys.argv[2], sys.argv[3], json.loads(sys.argv[4]))
+        return
+
+    args = parseOptions()
+    # the startup run alone (--tools startup) does not need a project
+    withProject = bool(set(args.tools) & set(PROJECT_TOOLS))
+    workDir = args.workDir
+    if withProject and (workDir is None):
+        workDir = mkdtemp(prefix='devTools-benchmark-')
+    if workDir is not None:
+        workDir = os.path.abspath(workDir)
+        projectDir = os.path.join(workDir, 'project')
+    if withProject and os.path.exists(projectDir):
+        shutil.rmtree(projectDir)
+
+    try:
+        if withProject:
+            generateStart = time.time()
+            generateSyntheticProject(projectDir, args.families, args.attributes, args.workflows,
+                args.familiesPerFolder, args.targets, args.processes, args.profileDepth)
+            print("synthetic project generated in %s (%.3fs)" % (projectDir, time.time() - generateStart))
+
+        results = []
+        if 'extract' in args.tools:
+            familiesDir = os.path.join(projectDir, 'Families')
+            results.append(runTool('extract (first run)', 'extractAttrProductConst', [[familiesDir]], projectDir, projectDir))
+            # the first run changes folders mtime, so the index is only stable from the third one
+            results.append(runTool('extract (second run)', 'extractAttrProductConst', [[familiesDir]], projectDir, projectDir))
+            results.append(runTool('extract (no-op run)', 'extractAttrProductConst', [[familiesDir]], projectDir, projectDir))
+            results.append(runTool('extract (no cache)', 'extractAttrProductConst', [[familiesDir, '--noCache']], projectDir, projectDir))
+            results.append(runTool('extract (with inherited)', 'extractAttrProductConst', [[familiesDir, '--noCache', '--withInherited']], projectDir, projectDir))
+            results.append(runTool('extract (validate)', 'extractAttrProductConst', [[familiesDir, '--noCache', '--validate']], projectDir, projectDir))
+        if 'infoxml' in args.tools:
+            for engine in ['dom', 'stream']:
+                results.append(runTool('generateInfoXml (%s)'%(engine), 'generateInfoXml', [[
+                    '--targets', os.path.join(projectDir, 'targets.xml'),
+                    '--template', os.path.join(projectDir, 'info.xml.in'),
+                    '--engine', engine,
+                    'p0'
+                ]], projectDir, projectDir))
+            # one document per profile, as a build generating module variants would do
+            variants = [{
+                'targetIds': ['p%s'%(variantIndex % max(args.profileDepth, 1))],
+                'phases': [['post-install'], ['post-upgrade']][variantIndex % 2],
+                'output': os.path.join(projectDir, 'variants', 'info.%s.xml'%(variantIndex))
+            } for variantIndex in range(args.variants)]
+            results.append(runToolPerArgv('generateInfoXml (separate)', 'generateInfoXml', [[
+                '--targets', os.path.join(projectDir, 'targets.xml'),
+                '--template', os.path.join(projectDir, 'info.xml.in'),
+                '-p', variant['phases'][0],
+                variant['targetIds'][0]
+            ] for variant in variants], projectDir, projectDir))
+            batchFileName = os.path.join(workDir, 'variants.json')
+            writeFile(batchFileName, json.dumps(variants))
+            results.append(runTool('generateInfoXml (batch)', 'generateInfoXml', [[
+                '--targets', os.path.join(projectDir, 'targets.xml'),
+                '--template', os.path.join(projectDir, 'info.xml.in'),
+                '--batch', batchFileName
+            ]], projectDir, projectDir))
+        if 'addapp' in args.tools:
+            results.append(runTool('addApplication', 'addApplication', [
+                ['APP%04d'%(appIndex), '--targetDir', os.path.join(projectDir, 'Apps')]
+                for appIndex in range(args.applications)
+            ], projectDir, projectDir))
+            results.append(runTool('addApplication (bulk)', 'addApplication', [
+                ['BULK%04d'%(appIndex) for appIndex in range(args.applications)]
+                + ['--targetDir', os.path.join(projectDir, 'BulkApps')]
+            ], projectDir, projectDir))
+
+        importResults = []
+        if 'startup' in args.tools:
+            importResults = [measureImportTime(tool, args.importRuns) for tool in STARTUP_TOOLS]
+
+        overBudget = 0
+        if results:
+            print('')
+            printResults(results)
+        if importResults:
+            print('')
+            overBudget = printImportTimes(importResults, args.importBudget, args.moduleBudget)
+        if args.jsonFile:
+            jsonFile = open(args.jsonFile, 'w')
+            json.dump({'options': vars(args), 'results': results, 'imports': importResults}, jsonFile, indent=4)
+            jsonFile.close()
+    finally:
+        if withProject and (args.workDir is None):
+            shutil.rmtree(workDir)
+    if overBudget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
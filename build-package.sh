@@ -12,6 +12,8 @@ usage="${usage}\n\t-d specifies where sources are"
 usage="${usage}\n\t-p Y makes building po files"
 usage="${usage}\n\t-w Y makes building webinst files"
 usage="${usage}\n\t-q is quiet level (higher is quiter)"
+usage="${usage}\n\tset DEVTOOLS_TRACE=<file> to record times of each step in <file> (json lines)"
+usage="${usage}\n\tset DEVTOOLS_PROFILE=<directory> to profile python tools in <directory>"
 
 SCRIPT_PATH=`readlink -f $(dirname $0)`
 SOURCE_DIR=`pwd`
@@ -24,6 +26,24 @@ errors=false
 
 echo_2() { if [ ${quiet} -lt 2 ]; then echo $1; fi;}
 
+# steps are run in the build directory: trace and profile paths must be absolute
+if [ -n "${DEVTOOLS_TRACE}" ]; then export DEVTOOLS_TRACE=$(readlink -m "${DEVTOOLS_TRACE}"); fi
+if [ -n "${DEVTOOLS_PROFILE}" ]; then export DEVTOOLS_PROFILE=$(readlink -m "${DEVTOOLS_PROFILE}"); fi
+# steps of a same build share this id in the trace
+export DEVTOOLS_RUN=${DEVTOOLS_RUN:-build-package-$(date +%Y%m%d%H%M%S)-$$}
+
+# runs a step, recording its times and exit code in ${DEVTOOLS_TRACE} (if set), and returns its exit code
+# without a trace, the step options (up to --) are dropped and the command is run directly
+step() {
+    if [ -n "${DEVTOOLS_TRACE}" ]; then
+        python "${SCRIPT_PATH}/instrument.py" run --tool build-package "$@"
+    else
+        while [ $# -gt 0 -a "$1" != "--" ]; do shift; done
+        shift
+        "$@"
+    fi
+}
+
 while getopts ":o:p:q:w:d:h" opt; do
     case ${opt} in
         o)
@@ -86,7 +106,13 @@ if [ ! -w "${outputdir}" ]; then
     exit 1
 fi
 
-tar --exclude-vcs --exclude='*.webinst' -h -C ${SOURCE_DIR} -cf - . | tar -C ${TMP_DIR} -xf -
+# excluded trees are pruned during the copy (symlinks are followed, as tar -h did)
+# files are cloned on copy-on-write filesystems, and copied elsewhere
+step --name copy --measure "${TMP_DIR}" -- python "${SCRIPT_PATH}/excludeMatcher.py" --copyMode=reflink --excludeVcs --exclude='*.webinst' --excludeFile="${SCRIPT_PATH}/rsyncExclude.txt" "${SOURCE_DIR}" "${TMP_DIR}"
+if [ $? -ne 0 ]; then
+    echo -e "${RED}could not copy ${SOURCE_DIR} to ${TMP_DIR}${BLACK}"
+    exit 1
+fi
 if [ -f "${SOURCE_DIR}/info.xml.in.dev" ]; then
     cp -f "${SOURCE_DIR}/info.xml.in.dev" "${TMP_DIR}/info.xml.in"
 fi
@@ -108,19 +134,19 @@ echo '' >> ${LOG_FILE}
 echo '###########################' >> ${LOG_FILE}
 echo '' >> ${LOG_FILE}
 
-make clean &> /dev/null
+step --name 'make clean' -- make clean &> /dev/null
 
 echo '' >> ${LOG_FILE}
 echo '=== autoconf ===' >> ${LOG_FILE}
 echo '' >> ${LOG_FILE}
-autoconf &>> ${LOG_FILE}
+step -- autoconf &>> ${LOG_FILE}
 echo '' >> ${LOG_FILE}
 echo "--- autoconf exitcode: $? ---" >> ${LOG_FILE}
 
 echo '' >> ${LOG_FILE}
 echo '=== ./configure ===' >> ${LOG_FILE}
 echo '' >> ${LOG_FILE}
-./configure &>> ${LOG_FILE}
+step --name ./configure -- ./configure &>> ${LOG_FILE}
 echo '' >> ${LOG_FILE}
 echo "--- ./configure exitcode: $? ---" >> ${LOG_FILE}
 
@@ -128,7 +154,7 @@ if ${makepo}; then
     echo '' >> ${LOG_FILE}
     echo '=== make po ===' >> ${LOG_FILE}
     echo '' >> ${LOG_FILE}
-    make po &>> ${LOG_FILE}
+    step --name 'make po' -- make po &>> ${LOG_FILE}
     echo '' >> ${LOG_FILE}
     echo "--- make po exitcode: $? ---" >> ${LOG_FILE}
 
@@ -157,7 +183,7 @@ if ${makewebinst}; then
     echo '' >> ${LOG_FILE}
     echo '=== make webinst ===' >> ${LOG_FILE}
     echo '' >> ${LOG_FILE}
-    make webinst &>> ${LOG_FILE}
+    step --name 'make webinst' -- make webinst &>> ${LOG_FILE}
     makewebinstexitcode=$?
     echo '' >> ${LOG_FILE}
     echo "--- make webinst exitcode: ${makewebinstexitcode} ---" >> ${LOG_FILE}
@@ -186,6 +212,10 @@ if ${makewebinst}; then
     fi
 fi
 
+if [ -n "${DEVTOOLS_TRACE}" -a ${quiet} -lt 1 ]; then
+    python "${SCRIPT_PATH}/instrument.py" summary --run "${DEVTOOLS_RUN}" "${DEVTOOLS_TRACE}"
+fi
+
 if ${errors}; then
     echo "log file is ${LOG_FILE}"
     echo "tmp dir is ${TMP_DIR}"
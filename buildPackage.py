@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""builds po and webinst files of a module, as build-package.sh does, but incrementally
+
+sources are synced into a staging directory which is kept between builds: only
+files whose content changed are copied, and files removed from the sources are
+removed from it. Each step (autoconf, ./configure, make po, make webinst) records
+a hash of its inputs and of its outputs in the state file of the staging
+directory, and is skipped when neither changed since its last successful run.
+"""
+
+import os
+import sys
+import glob
+import stat
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+from excludeMatcher import ExcludeMatcher, VCS_PATTERNS, loadPatterns
+from utils import makedirs, loadJsonFile, writeJsonFile, getFileSignature, FileCopier
+from instrument import phase, runMain, runCommand, recordStep, addBytes
+
+RED = "\033[0;31m"
+BLACK = "\033[0;00m"
+
+STATE_FILE = '.devTools-build.json'
+
+# bump it when the content of the state file changes
+STATE_VERSION = 2
+
+def parseOptions():
+    argParser = argparse.ArgumentParser(
+        description = 'builds po and webinst files of a module, only running the steps whose inputs changed since last build.'
+    )
+    argParser.add_argument('-o',
+        help = 'output directory (default is the source directory)',
+        dest = 'outputDir',
+        default = None)
+    argParser.add_argument('-d',
+        help = 'source directory (default is the current directory)',
+        dest = 'sourceDir',
+        default = os.getcwd())
+    argParser.add_argument('-q',
+        help = 'quiet level (higher is quieter)',
+        dest = 'quiet',
+        type = int,
+        default = 0)
+    argParser.add_argument('-p',
+        help = 'Y makes building po files',
+        dest = 'makePo',
+        choices = ['Y', 'N'],
+        default = 'N')
+    argParser.add_argument('-w',
+        help = 'Y makes building webinst files',
+        dest = 'makeWebinst',
+        choices = ['Y', 'N'],
+        default = 'Y')
+    argParser.add_argument('--stagingDir',
+        help = 'directory where the module is built, kept between builds (default is a directory of the temp dir, one per user and source directory); it must belong to the user and not be writable by others',
+        dest = 'stagingDir',
+        default = None)
+    argParser.add_argument('--clean',
+        help = 'empty the staging directory first, to build everything again',
+        action = 'store_true',
+        dest = 'clean',
+        default = False)
+    args = argParser.parse_args()
+    return args
+
+def getDefaultStagingDir(sourceDir):
+    # one per user: the temp dir is shared, see checkStagingDir
+    return os.path.join(tempfile.gettempdir(), 'devTools-build-%s-%s'%(os.getuid(), hashlib.md5(sourceDir).hexdigest()[:12]))
+
+def checkStagingDir(stagingDir):
+    """raises NameError if stagingDir exists and could have been changed by another user
+        (its files are built into the webinst)
+    """
+    try:
+        dirStat = os.lstat(stagingDir)
+    except OSError:
+        return
+    if not stat.S_ISDIR(dirStat.st_mode):
+        raise NameError("staging dir %s is not a directory"%(stagingDir))
+    if dirStat.st_uid != os.getuid():
+        raise NameError("staging dir %s belongs to another user"%(stagingDir))
+    if dirStat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise NameError("staging dir %s is writable by other users"%(stagingDir))
+
+def getSourceFiles(sourceDir, excludeMatcher, skippedPaths=()):
+    """returns {path relative to staging dir: source path} of the files to build
+        symlinks are followed, as tar -h does
+    """
+    sourceFiles = {}
+    skippedPaths = set(os.path.abspath(skippedPath) for skippedPath in skippedPaths)
+    for root, dirs, files in os.walk(sourceDir, followlinks=True):
+        relRoot = os.path.relpath(root, sourceDir)
+        prefix = '' if relRoot == '.' else relRoot.replace(os.sep, '/') + '/'
+        dirs[:] = sorted(subDir for subDir in dirs
+            if (not excludeMatcher.matches(prefix + subDir, True))
+                and (os.path.abspath(os.path.join(root, subDir)) not in skippedPaths))
+        for fileName in files:
+            filePath = os.path.join(root, fileName)
+            if excludeMatcher.matches(prefix + fileName, False) or (os.path.abspath(filePath) in skippedPaths):
+                continue
+            if os.path.isfile(filePath):
+                sourceFiles[prefix + fileName] = filePath
+    if 'info.xml.in.dev' in sourceFiles:
+        sourceFiles['info.xml.in'] = sourceFiles['info.xml.in.dev']
+    return sourceFiles
+
+def getDigest(items):
+    """returns the md5 of a list of (name, value) pairs"""
+    md5 = hashlib.md5()
+    for (name, value) in sorted(items):
+        md5.update('%s\0%s\0'%(name, value))
+    return md5.hexdigest()
+
+class PackageBuilder(object):
+    """builds a module in a staging directory, remembering what was done in its state file"""
+    def __init__(self, sourceDir, stagingDir, logFile, quiet=0):
+        self.sourceDir = sourceDir
+        self.stagingDir = stagingDir
+        self.logFile = logFile
+        self.quiet = quiet
+        self.stateFile = os.path.join(stagingDir, STATE_FILE)
+        state = loadJsonFile(self.stateFile, {})
+        if state.get('version') != STATE_VERSION:
+            state = {}
+        # path relative to staging dir -> [signature of its source, signature of the staged file]
+        self.files = state.get('files', {})
+        # step name -> {'inputs': digest, 'outputs': {path: md5}}
+        self.steps = state.get('steps', {})
+
+    def saveState(self):
+        writeJsonFile(self.stateFile, {'version': STATE_VERSION, 'files': self.files, 'steps': self.steps})
+
+    def log(self, message):
+        self.logFile.write(message + '\n')
+        self.logFile.flush()
+
+    def sync(self, sourceFiles):
+        """copies changed files in the staging dir, and removes the ones which are not in sources anymore
+            returns (copied files, removed files)
+        """
+        copier = FileCopier('reflink')
+        copied = []
+        for (relPath, sourcePath) in sorted(sourceFiles.items()):
+            (previous, previousStaged) = self.files.get(relPath, (None, None))
+            signature = getFileSignature(sourcePath, previous)
+            if signature is None:
+                continue
+            stagingPath = os.path.join(self.stagingDir, relPath)
+            if previous and (previous[2] == signature[2]) and os.path.isfile(stagingPath):
+                # the staged file may also have been changed in place, by a build step or by hand
+                stagedSignature = getFileSignature(stagingPath, previousStaged)
+                if previousStaged and stagedSignature and (stagedSignature[2] == previousStaged[2]):
+                    self.files[relPath] = [signature, stagedSignature]
+                    continue
+            makedirs(os.path.dirname(stagingPath))
+            if os.path.lexists(stagingPath):
+                os.unlink(stagingPath)
+            error = copier((sourcePath, stagingPath))
+            if error:
+                raise NameError("could not copy %s to %s: %s"%error)
+            self.files[relPath] = [signature, getFileSignature(stagingPath, signature)]
+            copied.append(relPath)
+            addBytes('sync', signature[1])
+        removed = sorted(relPath for relPath in self.files if relPath not in sourceFiles)
+        for relPath in removed:
+            del self.files[relPath]
+            stagingPath = os.path.join(self.stagingDir, relPath)
+            if os.path.lexists(stagingPath):
+                os.unlink(stagingPath)
+            try:
+                os.removedirs(os.path.dirname(stagingPath))
+            except OSError:
+                # not empty, or the staging dir itself
+                pass
+        return (copied, removed)
+
+    def getSourcesDigest(self, exclude=None):
+        return getDigest((relPath, signatures[0][2]) for (relPath, signatures) in self.files.items()
+            if (exclude is None) or not exclude(relPath))
+
+    def getOutputs(self, patterns):
+        outputs = {}
+        for pattern in patterns:
+            for outputPath in glob.glob(os.path.join(self.stagingDir, pattern)):
+                signature = getFileSignature(outputPath)
+                if signature is not None:
+                    outputs[os.path.relpath(outputPath, self.stagingDir)] = signature[2]
+        return outputs
+
+    def isCached(self, name, inputs):
+        step = self.steps.get(name)
+        if (not step) or (step['inputs'] != inputs) or (not step['outputs']):
+            return False
+        for (relPath, md5) in step['outputs'].items():
+            signature = getFileSignature(os.path.join(self.stagingDir, relPath))
+            if (signature is None) or (signature[2] != md5):
+                return False
+        return True
+
+    def runStep(self, name, command, inputs, outputPatterns, staleOutputs=False):
+        """runs command in the staging dir, unless inputs and outputs did not change since its last success
+            with staleOutputs, files matching outputPatterns are removed before command runs,
+            since the ones of a previous run may not be overwritten (a webinst of another version)
+            returns the exit code of command (0 when it was not run)
+        """
+        self.log('')
+        if self.isCached(name, inputs):
+            recordStep(name, time.time(), 0.0, 0.0, 0, cached=True)
+            self.log('=== %s === (unchanged, skipped)'%(name))
+            if self.quiet < 1:
+                print "%s: unchanged, skipped"%(name)
+            return 0
+        self.log('=== %s ==='%(name))
+        self.log('')
+        # the step is invalid until it succeeds
+        self.steps.pop(name, None)
+        self.saveState()
+        if staleOutputs:
+            for pattern in outputPatterns:
+                for outputPath in glob.glob(os.path.join(self.stagingDir, pattern)):
+                    os.unlink(outputPath)
+        exitCode = runCommand(name, command, cwd=self.stagingDir, stdout=self.logFile, stderr=self.logFile)
+        self.log('')
+        self.log('--- %s exitcode: %s ---'%(name, exitCode))
+        if exitCode == 0:
+            self.steps[name] = {'inputs': inputs, 'outputs': self.getOutputs(outputPatterns)}
+            self.saveState()
+        return exitCode
+
+    def configure(self):
+        """runs autoconf and ./configure if needed, and returns the digest of their inputs"""
+        autoconfInputs = self.getSourcesDigest(lambda relPath: relPath != 'configure.ac')
+        self.runStep('autoconf', ['autoconf'], autoconfInputs, ['configure'])
+        # ./configure turns the *.in files of the module root (info.xml.in, Makefile.in...) into the files of the build
+        inFiles = [relPath for relPath in self.files if ('/' not in relPath) and relPath.endswith('.in')]
+        configureInputs = getDigest([
+            ('autoconf', autoconfInputs),
+            ('sources', self.getSourcesDigest(lambda relPath: relPath not in inFiles))
+        ])
+        self.runStep('./configure', ['./configure'], configureInputs, ['config.status'] + [inFile[:-3] for inFile in inFiles])
+        return configureInputs
+
+    def makePo(self, configureInputs):
+        inputs = getDigest([
+            ('./configure', configureInputs),
+            ('sources', self.getSourcesDigest(lambda relPath: relPath.endswith('.po')))
+        ])
+        return self.runStep('make po', ['make', 'po'], inputs, ['*.po'])
+
+    def makeWebinst(self, configureInputs):
+        inputs = getDigest([
+            ('./configure', configureInputs),
+            ('sources', self.getSourcesDigest())
+        ])
+        return self.runStep('make webinst', ['make', 'webinst'], inputs, ['*.webinst'], staleOutputs=True)
+
+    def updateSourceFiles(self, relPaths, sourceFiles):
+        """records the signatures of files copied back from the staging dir to the sources"""
+        for relPath in relPaths:
+            if relPath in sourceFiles:
+                signature = getFileSignature(sourceFiles[relPath])
+                if signature is not None:
+                    self.files[relPath] = [signature, getFileSignature(os.path.join(self.stagingDir, relPath))]
+        self.saveState()
+
+def writeLogHeader(logFile, outputDir, stagingDir, logFileName):
+    logFile.write('\n')
+    logFile.write('###########################\n')
+    logFile.write('#                                                 #\n')
+    logFile.write('#     %s     #\n'%(time.strftime('%x %X')))
+    logFile.write('#                                                 #\n')
+    logFile.write('###########################\n')
+    logFile.write('\n')
+    logFile.write('        Output directory: %s\n'%(outputDir))
+    logFile.write('        staging directory: %s\n'%(stagingDir))
+    logFile.write('        log file: %s\n'%(logFileName))
+    logFile.write('\n')
+    logFile.write('###########################\n')
+    logFile.write('\n')
+    logFile.flush()
+
+def copyOutputs(stagingDir, pattern, destinations):
+    outputs = sorted(glob.glob(os.path.join(stagingDir, pattern)))
+    for output in outputs:
+        for destination in destinations:
+            shutil.copy(output, destination)
+    return [os.path.basename(output) for output in outputs]
+
+def buildPackage(sourceDir, outputDir, stagingDir, makePo=False, makeWebinst=True, quiet=0, clean=False):
+    """builds sourceDir in stagingDir, and copies po and webinst files to outputDir
+        returns True if everything was built
+    """
+    logFileName = os.path.join(outputDir, 'buildPackage-%s.log'%(time.strftime('%Y%m%d')))
+    checkStagingDir(stagingDir)
+    if clean and os.path.isdir(stagingDir):
+        shutil.rmtree(stagingDir)
+    if not os.path.isdir(stagingDir):
+        makedirs(os.path.dirname(stagingDir))
+        os.mkdir(stagingDir, 0700)
+
+    patterns = ['*.webinst', '/' + STATE_FILE] + VCS_PATTERNS
+    excludeFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rsyncExclude.txt')
+    if os.path.isfile(excludeFile):
+        patterns.extend(loadPatterns(excludeFile))
+    sourceFiles = getSourceFiles(sourceDir, ExcludeMatcher(patterns), [logFileName, stagingDir])
+
+    errors = False
+    logFile = open(logFileName, 'a')
+    try:
+        writeLogHeader(logFile, outputDir, stagingDir, logFileName)
+        builder = PackageBuilder(sourceDir, stagingDir, logFile, quiet)
+        with phase('sync'):
+            (copied, removed) = builder.sync(sourceFiles)
+        builder.saveState()
+        builder.log('        %s files copied, %s files removed'%(len(copied), len(removed)))
+        if quiet < 1:
+            print "%s files copied, %s files removed in %s"%(len(copied), len(removed), stagingDir)
+
+        configureInputs = builder.configure()
+
+        if makePo:
+            builder.makePo(configureInputs)
+            poFiles = copyOutputs(stagingDir, '*.po', [outputDir, sourceDir])
+            # po files are sources too: they must not be seen as changed on next build
+            builder.updateSourceFiles(poFiles, getSourceFiles(sourceDir, ExcludeMatcher(patterns), [logFileName, stagingDir]))
+            if poFiles:
+                if quiet < 2:
+                    print "%s po(s): "%(len(poFiles))
+                    for poFile in poFiles:
+                        print "\t%s"%(os.path.join(outputDir, poFile))
+                    print "\tpo were copied in source dir:%s"%(sourceDir)
+            else:
+                print "no po builded"
+                errors = True
+
+        if makeWebinst:
+            if builder.makeWebinst(configureInputs) == 0:
+                webinstFiles = copyOutputs(stagingDir, '*.webinst', [outputDir])
+                if webinstFiles:
+                    if quiet < 2:
+                        print "%s webinst(s): "%(len(webinstFiles))
+                        for webinstFile in webinstFiles:
+                            print "\t%s"%(os.path.join(outputDir, webinstFile))
+                else:
+                    print "0 webinst builded"
+                    errors = True
+            else:
+                print "%s no webinst builded (error generated from make webinst)%s"%(RED, BLACK)
+                errors = True
+    finally:
+        logFile.close()
+
+    if errors:
+        print "log file is %s"%(logFileName)
+        print "staging dir is %s"%(stagingDir)
+        return False
+    os.unlink(logFileName)
+    return True
+
+def main():
+    args = parseOptions()
+    sourceDir = os.path.realpath(args.sourceDir)
+    outputDir = args.outputDir or sourceDir
+    if not os.path.isdir(outputDir):
+        print "%s n'est pas un répertoire"%(outputDir)
+        sys.exit(1)
+    if not os.access(outputDir, os.W_OK):
+        print "le répertoire %s ne possède pas les droits d'écriture"%(outputDir)
+        sys.exit(1)
+    stagingDir = os.path.abspath(args.stagingDir or getDefaultStagingDir(sourceDir))
+    try:
+        built = buildPackage(sourceDir, os.path.abspath(outputDir), stagingDir,
+            makePo = (args.makePo == 'Y'),
+            makeWebinst = (args.makeWebinst == 'Y'),
+            quiet = args.quiet,
+            clean = args.clean)
+    except NameError as e:
+        print >> sys.stderr, e
+        sys.exit(1)
+    if not built:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    runMain(main)
@@ -13,9 +13,11 @@ usage="${usage}\n\t-y answer 'yes' to questions"
 usage="${usage}\n\t-w waits before exiting"
 usage="${usage}\n\t-p Y makes building po files"
 usage="${usage}\n\t-q is quiet level (higher is quiter)"
+usage="${usage}\n\tset DEVTOOLS_TRACE=<file> to record times of each step in <file> (json lines)"
+usage="${usage}\n\tset DEVTOOLS_PROFILE=<directory> to profile python tools in <directory>"
 
 SCRIPT_PATH=`readlink -f $(dirname $0)`
-BUILD_PACKAGE_COMMAND=${SCRIPT_PATH}/build-package.sh
+BUILD_PACKAGE_COMMAND=${SCRIPT_PATH}/buildPackage.py
 SOURCE_DIR=`pwd`
 TMP_DIR=`mktemp -d`
 WRITE_CONFIG=false
@@ -30,6 +32,24 @@ makepo="N"
 
 echo_2() { if [ ${quiet} -lt 2 ]; then echo -e $1; fi;}
 
+# the build runs in another directory: trace and profile paths must be absolute
+if [ -n "${DEVTOOLS_TRACE}" ]; then export DEVTOOLS_TRACE=$(readlink -m "${DEVTOOLS_TRACE}"); fi
+if [ -n "${DEVTOOLS_PROFILE}" ]; then export DEVTOOLS_PROFILE=$(readlink -m "${DEVTOOLS_PROFILE}"); fi
+# steps of the build and of the deployment share this id in the trace
+export DEVTOOLS_RUN=${DEVTOOLS_RUN:-deploy-package-$(date +%Y%m%d%H%M%S)-$$}
+
+# runs a step, recording its times and exit code in ${DEVTOOLS_TRACE} (if set), and returns its exit code
+# without a trace, the step options (up to --) are dropped and the command is run directly
+step() {
+    if [ -n "${DEVTOOLS_TRACE}" ]; then
+        python "${SCRIPT_PATH}/instrument.py" run --tool deploy-package "$@"
+    else
+        while [ $# -gt 0 -a "$1" != "--" ]; do shift; done
+        shift
+        "$@"
+    fi
+}
+
 validate_wiff_dir(){
     if [ -z "${wiff_dir_path_input}" ]; then
         seems_valid_wiff_dir=false
@@ -115,55 +135,6 @@ askcontext(){
     seems_valid_context=true
 }
 
-install_webinst(){
-    if [ -z "$1" ]; then
-        return 1
-    fi
-    if [ -z "${target_context}" ]; then
-        return 1
-    fi
-    sudo "${wiff_dir_path}/wiff" context "${target_context}" module install --force "$1" 2> /dev/null
-    return $?
-}
-
-upgrade_webinst(){
-    if [ -z "$1" ]; then
-        return 1
-    fi
-    if [ -z "${target_context}" ]; then
-        return 1
-    fi
-    sudo "${wiff_dir_path}/wiff" context "${target_context}" module upgrade --force "$1" 2> /dev/null
-    return $?
-}
-
-deploy_webinst(){
-    if [ -z "$1" ]; then
-        return 1
-    fi
-    basewebinst=$(basename $1 .webinst)
-    modulename=`expr match "${basewebinst}" '^\(.*\)-[0-9][0-9.]*-[0-9][0-9]*$'`
-    if [ -z ${modulename} ]; then
-        modulename=`expr match "${basewebinst}" '^\(.*\)-[0-9][0-9.]*'`
-    fi
-    echo "searching if ${modulename} is installed (from ${basewebinst})"
-    installedmodule=`sudo "${wiff_dir_path}/wiff" context "${target_context}" module list installed 2>/dev/null | grep "${modulename}"`
-    grepstatus=$?
-    if [ ${grepstatus} -eq 0 ]; then
-        echo -e "${installedmodule} detected.\n\t${BLUE} UPGRADE with $1 ${BLACK}"
-        upgrade_webinst "$1"
-    elif [ ${grepstatus} -eq 1 ]; then
-        echo -e "${modulename} not detected.\n\t${BLUE} INSTALLATION with $1 ${BLACK}"
-        install_webinst "$1"
-    else
-        echo "an error occured when detecting if ${modulename} is installed. Installed modules are:"
-        sudo "${wiff_dir_path}/wiff" context "${target_context}" module list installed 2>/dev/null
-        errors=true
-    fi
-    
-    return $?
-}
-
 while getopts ":c:d:p:q:wyh" opt; do
     case ${opt} in
         c)
@@ -277,7 +248,7 @@ echo "deploying in context ${target_context}"
 
 if [ -f "${BUILD_PACKAGE_COMMAND}" ]; then
     if  [ -x "${BUILD_PACKAGE_COMMAND}" ]; then
-        "${BUILD_PACKAGE_COMMAND}" -d ${SOURCE_DIR} -o ${TMP_DIR} -q 2 -p ${makepo}
+        step --name build -- "${BUILD_PACKAGE_COMMAND}" -d ${SOURCE_DIR} -o ${TMP_DIR} -q 2 -p ${makepo}
         buildstatus=$?
         if [ ${buildstatus} -gt 0 ]; then
             echo "an error occured in webinst generation"
@@ -294,9 +265,8 @@ else
     exit 1
 fi
 
-for webinst in ${TMP_DIR}/*.webinst; do
-    deploy_webinst ${webinst}
-done
+# installed modules are listed once, and webinsts are deployed in the order of their requirements
+python "${SCRIPT_PATH}/deployWebinst.py" --sudo --wiff "${wiff_dir_path}/wiff" -c "${target_context}" ${TMP_DIR}/*.webinst
 
 deploystatus=$?
 if [ ${deploystatus} -gt 0 ]; then
@@ -311,6 +281,10 @@ else
     fi
 fi
 
+if [ -n "${DEVTOOLS_TRACE}" -a ${quiet} -lt 1 ]; then
+    python "${SCRIPT_PATH}/instrument.py" summary --run "${DEVTOOLS_RUN}" "${DEVTOOLS_TRACE}"
+fi
+
 if ${errors}; then
     echo -e "${RED} The script ended with errors.${BLACK}"
 else
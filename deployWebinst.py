@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""installs or upgrades webinst files in a dynacase context with wiff
+
+installed modules are listed once, then each webinst is installed (or upgraded
+if its module is already installed) after the webinsts of the modules it
+requires. With --jobs, webinsts which do not depend on each other are deployed
+concurrently. Any executable accepting the same arguments as wiff can be given
+with --wiff, which allows to run deployments without a dynacase context.
+"""
+
+import os
+import re
+import sys
+import tarfile
+import argparse
+import tempfile
+import threading
+import traceback
+from xml.etree import ElementTree
+
+from instrument import runMain, runCommand
+
+BLUE = "\033[0;34m"
+RED = "\033[0;31m"
+BLACK = "\033[0;00m"
+
+def parseOptions():
+    argParser = argparse.ArgumentParser(
+        description = 'installs or upgrades webinst files in a context, in the order of their requirements.'
+    )
+    argParser.add_argument('webinstFiles',
+        help = 'webinst files to deploy',
+        nargs = '+',
+        metavar = 'webinst')
+    argParser.add_argument('-c', '--context',
+        help = 'context where webinsts are deployed',
+        dest = 'context',
+        required = True)
+    argParser.add_argument('--wiff',
+        help = 'wiff executable',
+        dest = 'wiff',
+        default = 'wiff')
+    argParser.add_argument('--sudo',
+        help = 'run wiff with sudo',
+        action = 'store_true',
+        dest = 'sudo',
+        default = False)
+    argParser.add_argument('-j', '--jobs',
+        help = 'number of webinsts deployed at the same time (only use it if wiff accepts concurrent operations on the context)',
+        dest = 'jobs',
+        type = int,
+        default = 1)
+    argParser.add_argument('-n', '--dryRun',
+        help = 'only print what would be done',
+        action = 'store_true',
+        dest = 'dryRun',
+        default = False)
+    args = argParser.parse_args()
+    return args
+
+def getModuleNameFromFileName(webinstFile):
+    """returns the module name of a webinst file named <module>-<version>[-<release>].webinst"""
+    baseName = os.path.basename(webinstFile)
+    if baseName.endswith('.webinst'):
+        baseName = baseName[:-len('.webinst')]
+    for pattern in [r'^(.*)-[0-9][0-9.]*-[0-9][0-9]*$', r'^(.*)-[0-9][0-9.]*']:
+        match = re.match(pattern, baseName)
+        if match:
+            return match.group(1)
+    return baseName
+
+def readInfoXml(webinstFile):
+    """returns the info.xml content of a webinst file, or None if it has none"""
+    try:
+        webinst = tarfile.open(webinstFile)
+    except (tarfile.TarError, IOError):
+        return None
+    try:
+        for member in webinst.getmembers():
+            if member.isfile() and (os.path.normpath(member.name) == 'info.xml'):
+                return webinst.extractfile(member).read()
+    finally:
+        webinst.close()
+    return None
+
+class Webinst(object):
+    """module name, version and required modules of a webinst file"""
+    def __init__(self, path):
+        self.path = path
+        self.name = None
+        self.version = None
+        self.requires = []
+        infoXml = readInfoXml(path)
+        if infoXml is not None:
+            try:
+                module = ElementTree.fromstring(infoXml)
+            except ElementTree.ParseError as e:
+                raise NameError("%s: info.xml is not valid (%s)"%(path, e))
+            self.name = module.get('name')
+            self.version = '-'.join(part for part in [module.get('version'), module.get('release')] if part)
+            self.requires = [required.get('name') for required in module.findall('requires/module') if required.get('name')]
+        if not self.name:
+            self.name = getModuleNameFromFileName(path)
+
+    def __repr__(self):
+        return "%s (%s)"%(self.name, os.path.basename(self.path))
+
+def parseModuleList(output):
+    """returns {module name: version} from the output of wiff module list
+        each line starts with a module name, and may give its version
+    """
+    modules = {}
+    for line in output.splitlines():
+        words = line.split()
+        if not words:
+            continue
+        name = words[0].strip(':,')
+        version = ''
+        for word in words[1:]:
+            match = re.match(r'^\(?v?([0-9][0-9A-Za-z.~+]*(?:-[0-9]+)?)\)?,?$', word)
+            if match:
+                version = match.group(1)
+                break
+        modules[name] = version
+    return modules
+
+class Deployer(object):
+    """runs wiff on a context, and remembers the installed modules"""
+    def __init__(self, wiff, context, sudo=False, dryRun=False):
+        self.wiff = wiff
+        self.context = context
+        self.sudo = sudo
+        self.dryRun = dryRun
+        self.lock = threading.Lock()
+        self.devNull = open(os.devnull, 'w')
+        # module name -> version
+        self.installed = None
+
+    def echo(self, message):
+        # lines of concurrent deployments must not be mixed
+        with self.lock:
+            sys.stdout.write(message + '\n')
+            sys.stdout.flush()
+
+    def getCommand(self, *args):
+        command = [self.wiff, 'context', self.context, 'module'] + list(args)
+        if self.sudo:
+            command = ['sudo'] + command
+        return command
+
+    def loadInventory(self):
+        """lists installed modules, once"""
+        if self.installed is not None:
+            return self.installed
+        output = tempfile.TemporaryFile()
+        try:
+            exitCode = runCommand('wiff module list', self.getCommand('list', 'installed'),
+                stdout=output, stderr=self.devNull)
+            output.seek(0)
+            content = output.read()
+        finally:
+            output.close()
+        if exitCode:
+            raise NameError("could not list modules installed in context %s (exit code %s)"%(self.context, exitCode))
+        self.installed = parseModuleList(content)
+        return self.installed
+
+    def deploy(self, webinst):
+        """installs or upgrades webinst, and returns True if it succeeded"""
+        with self.lock:
+            installedVersion = self.loadInventory().get(webinst.name)
+        if installedVersion is not None:
+            self.echo("%s %s detected.\n\t%s UPGRADE with %s %s"%(webinst.name, installedVersion, BLUE, webinst.path, BLACK))
+            operation = 'upgrade'
+        else:
+            self.echo("%s not detected.\n\t%s INSTALLATION with %s %s"%(webinst.name, BLUE, webinst.path, BLACK))
+            operation = 'install'
+        command = self.getCommand(operation, '--force', webinst.path)
+        if self.dryRun:
+            self.echo("\t%s"%(' '.join(command)))
+            exitCode = 0
+        else:
+            exitCode = runCommand('wiff module %s'%(operation), command, stderr=self.devNull)
+        if exitCode:
+            self.echo("%s%s of %s failed (exit code %s)%s"%(RED, operation, webinst.path, exitCode, BLACK))
+            return False
+        with self.lock:
+            self.installed[webinst.name] = webinst.version or ''
+        return True
+
+def getRequirements(webinsts):
+    """returns {webinst: [webinsts it requires]}, among the given webinsts, checking there is no cycle"""
+    byName = {}
+    for webinst in webinsts:
+        if webinst.name in byName:
+            raise NameError("module %s is given twice: %s and %s"%(webinst.name, byName[webinst.name].path, webinst.path))
+        byName[webinst.name] = webinst
+    requirements = dict((webinst, [byName[name] for name in webinst.requires if (name in byName) and (name != webinst.name)])
+        for webinst in webinsts)
+    def checkCycle(webinst, path):
+        if webinst in path:
+            cycle = path[path.index(webinst):] + [webinst]
+            raise NameError("There is a cycle in module requirements: %s"%(' -> '.join(item.name for item in cycle)))
+        for required in requirements[webinst]:
+            checkCycle(required, path + [webinst])
+    for webinst in webinsts:
+        checkCycle(webinst, [])
+    return requirements
+
+def deployWebinsts(webinsts, deploy, jobs=1):
+    """calls deploy(webinst) for each webinst once the webinsts it requires were deployed,
+        up to jobs at the same time
+        returns {webinst: True (deployed), False (failed) or None (skipped: a required webinst was not deployed)}
+    """
+    requirements = getRequirements(webinsts)
+    pending = list(webinsts)
+    results = {}
+    condition = threading.Condition()
+
+    def getNext():
+        """returns the next webinst to deploy, or None when there is none left (called with condition held)"""
+        while pending:
+            for webinst in pending:
+                if [required for required in requirements[webinst] if required not in results]:
+                    continue
+                pending.remove(webinst)
+                if [required for required in requirements[webinst] if results[required] is not True]:
+                    print "%s skipped, since a module it requires was not deployed"%(webinst.path)
+                    results[webinst] = None
+                    condition.notify_all()
+                    break
+                return webinst
+            else:
+                # webinsts left wait for running ones
+                condition.wait()
+        return None
+
+    def work():
+        while True:
+            with condition:
+                webinst = getNext()
+            if webinst is None:
+                return
+            deployed = False
+            try:
+                deployed = bool(deploy(webinst))
+            except (NameError, OSError) as e:
+                print >> sys.stderr, "%s: %s"%(webinst.path, e)
+            except Exception:
+                # the other deployments go on, the unexpected error is reported as a failure
+                print >> sys.stderr, "%s: unexpected error"%(webinst.path)
+                traceback.print_exc()
+            finally:
+                with condition:
+                    results[webinst] = deployed
+                    condition.notify_all()
+
+    threads = [threading.Thread(target=work) for threadIndex in range(max(1, min(jobs, len(webinsts))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def main():
+    args = parseOptions()
+    try:
+        webinsts = [Webinst(webinstFile) for webinstFile in args.webinstFiles]
+        deployer = Deployer(args.wiff, args.context, sudo=args.sudo, dryRun=args.dryRun)
+        deployer.loadInventory()
+        results = deployWebinsts(webinsts, deployer.deploy, args.jobs)
+    except NameError as e:
+        print >> sys.stderr, e
+        sys.exit(1)
+    if [webinst for webinst in webinsts if not results.get(webinst)]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    runMain(main)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""runs the devTools commands from python, from a single entry point, or in a long-lived server
+
+    devTools.py <command> [arguments]       same as <command>.py [arguments]
+    devTools.py serve --socket <path>       handles the commands sent on a unix socket
+    devTools.py --socket <path> <command> [arguments]
+                                            sends the command to a server, and prints its output
+
+from python, run(command, argv) runs a command in the current process and returns
+a Result (exit code, output, errors and the value returned by the command), and
+Client(socketPath).run(command, argv) does the same in a server. A server keeps
+the modules loaded, and the parsed csv files, templates and targets of previous
+commands, as long as their files do not change.
+
+the protocol is one json object per line: a request is {"command", "args", "cwd"}
+and its response is the result, as returned by Result.toJson. Requests are handled
+one at a time, in the working directory they give.
+"""
+
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+import traceback
+import threading
+
+from instrument import runMain, resetPhases
+
+SOCKET_ENV = 'DEVTOOLS_SOCKET'
+
+# command -> module, whose main(argv) runs the command
+COMMANDS = {
+    'addApplication': 'addApplication',
+    'extractAttrProductConst': 'extractAttrProductConst',
+    'generateFamily': 'generateFamily',
+    'generateInfoXml': 'generateInfoXml',
+    'generateWorkflow': 'generateWorkflow'
+}
+
+class DevToolsError(NameError):
+    """error of a command, or of the communication with a server"""
+    pass
+
+class Result(object):
+    """outcome of a command: its exit code, standard output and error, and the value returned by its main"""
+    def __init__(self, command, args, exitCode, output='', errors='', value=None, wall=0.0):
+        self.command = command
+        self.args = list(args)
+        self.exitCode = exitCode
+        self.output = output
+        self.errors = errors
+        self.value = value
+        self.wall = wall
+
+    @property
+    def ok(self):
+        return self.exitCode == 0
+
+    def check(self):
+        """returns self, or raises DevToolsError if the command failed"""
+        if not self.ok:
+            raise DevToolsError("%s failed (exit code %s): %s"%(self.command, self.exitCode, self.errors.strip()))
+        return self
+
+    def toJson(self):
+        value = self.value
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            value = repr(value)
+        return {
+            'command': self.command,
+            'args': self.args,
+            'exitCode': self.exitCode,
+            'output': self.output.decode('utf-8', 'replace'),
+            'errors': self.errors.decode('utf-8', 'replace'),
+            'value': value,
+            'wall': self.wall
+        }
+
+    @classmethod
+    def fromJson(cls, data):
+        return cls(data['command'], data['args'], data['exitCode'],
+            data['output'].encode('utf-8'), data['errors'].encode('utf-8'), data.get('value'), data.get('wall', 0.0))
+
+    def __repr__(self):
+        return "<Result %s %s: %s>"%(self.command, ' '.join(self.args), self.exitCode)
+
+class Capture(object):
+    """file object keeping what is written, as utf-8"""
+    encoding = 'utf-8'
+    softspace = 0
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+class EmptyInput(object):
+    """standard input of captured commands: prompts get an EOFError"""
+    def read(self, size=-1):
+        return ''
+    def readline(self, size=-1):
+        return ''
+    def isatty(self):
+        return False
+    def close(self):
+        # called by multiprocessing in its worker processes
+        pass
+
+def getMain(command):
+    """returns the main function of command, importing its module"""
+    if command not in COMMANDS:
+        raise DevToolsError("unknown command %s (known commands are %s)"%(command, ', '.join(sorted(COMMANDS))))
+    module = __import__(COMMANDS[command])
+    return module.main
+
+# commands change the process streams and working directory, they are run one at a time
+runLock = threading.Lock()
+
+def redirectLogging(stream):
+    """points the root logger handlers writing on the standard error to stream
+        returns the handlers and their previous streams, for restoreLogging
+    """
+    redirected = []
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler) and (handler.stream in (sys.stderr, sys.__stderr__)):
+            redirected.append((handler, handler.stream))
+            handler.stream = stream
+    return redirected
+
+def restoreLogging(redirected):
+    for (handler, stream) in redirected:
+        handler.stream = stream
+
+def run(command, argv=(), cwd=None, capture=True):
+    """runs command with argv in this process, and returns its Result
+        with capture, its standard output, error and log messages are kept in the result rather than printed
+    """
+    argv = list(argv)
+    main = getMain(command)
+    output = Capture()
+    errors = Capture()
+    value = None
+    exitCode = 1
+    with runLock:
+        savedStreams = (sys.stdin, sys.stdout, sys.stderr)
+        savedArgv = sys.argv
+        savedCwd = os.getcwd()
+        redirected = []
+        start = time.time()
+        try:
+            if capture:
+                redirected = redirectLogging(errors)
+                (sys.stdin, sys.stdout, sys.stderr) = (EmptyInput(), output, errors)
+            sys.argv = [command + '.py'] + argv
+            if cwd:
+                os.chdir(cwd)
+            # phases of a previous command must not be recorded again
+            resetPhases()
+            value = runMain(lambda: main(argv), command)
+            exitCode = 0
+        except SystemExit as e:
+            if e.code is None:
+                exitCode = 0
+            elif isinstance(e.code, int):
+                exitCode = e.code
+            else:
+                print >> sys.stderr, e.code
+        except KeyboardInterrupt:
+            raise
+        except:
+            traceback.print_exc()
+        finally:
+            (sys.stdin, sys.stdout, sys.stderr) = savedStreams
+            sys.argv = savedArgv
+            restoreLogging(redirected)
+            os.chdir(savedCwd)
+    return Result(command, argv, exitCode, output.getvalue(), errors.getvalue(), value, time.time() - start)
+
+def handleRequest(request):
+    """returns the response to a request of a client"""
+    if (not isinstance(request, dict)) or (not isinstance(request.get('command'), basestring)):
+        raise DevToolsError("a request needs a command")
+    argv = [arg.encode('utf-8') if isinstance(arg, unicode) else arg for arg in request.get('args') or []]
+    cwd = request.get('cwd')
+    if cwd is not None:
+        cwd = cwd.encode('utf-8')
+    return run(request['command'].encode('utf-8'), argv, cwd).toJson()
+
+def handleConnection(connection):
+    """answers the requests sent on connection, until it is closed
+        returns False if a client asked the server to stop
+    """
+    requests = connection.makefile('rb')
+    try:
+        for line in requests:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if isinstance(request, dict) and (request.get('command') == 'stop'):
+                    connection.sendall(json.dumps({'stopped': True}) + '\n')
+                    return False
+                response = handleRequest(request)
+            except (ValueError, DevToolsError) as e:
+                response = {'error': str(e)}
+            connection.sendall(json.dumps(response) + '\n')
+    finally:
+        requests.close()
+        connection.close()
+    return True
+
+def isListening(socketPath):
+    import socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socketPath)
+        return True
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+def serve(socketPath):
+    """handles the commands sent on the unix socket socketPath, until stopped or interrupted"""
+    import errno
+    import signal
+    import socket
+    if os.path.exists(socketPath):
+        if isListening(socketPath):
+            raise DevToolsError("a server is already listening on %s"%(socketPath))
+        # left by a server which did not stop cleanly
+        os.unlink(socketPath)
+    for command in COMMANDS:
+        getMain(command)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the user running the server can send it commands
+    oldUmask = os.umask(0077)
+    try:
+        server.bind(socketPath)
+    finally:
+        os.umask(oldUmask)
+    server.listen(5)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print >> sys.stderr, "devTools server listening on %s"%(socketPath)
+    try:
+        while True:
+            try:
+                (connection, address) = server.accept()
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not handleConnection(connection):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socketPath):
+            os.unlink(socketPath)
+
+class Client(object):
+    """sends commands to a server (see serve)"""
+    def __init__(self, socketPath):
+        import socket
+        self.socketPath = socketPath
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.connection.connect(socketPath)
+        except socket.error as e:
+            self.connection.close()
+            raise DevToolsError("could not connect to a server on %s: %s"%(socketPath, e))
+        self.responses = self.connection.makefile('rb')
+
+    def request(self, request):
+        self.connection.sendall(json.dumps(request) + '\n')
+        line = self.responses.readline()
+        if not line:
+            raise DevToolsError("the server on %s closed the connection"%(self.socketPath))
+        response = json.loads(line)
+        if 'error' in response:
+            raise DevToolsError(response['error'])
+        return response
+
+    def run(self, command, argv=(), cwd=None):
+        """runs command with argv in the server, from cwd (default is the current directory), and returns its Result"""
+        return Result.fromJson(self.request({
+            'command': command,
+            'args': list(argv),
+            'cwd': os.path.abspath(cwd or os.getcwd())
+        }))
+
+    def stop(self):
+        self.request({'command': 'stop'})
+
+    def close(self):
+        self.responses.close()
+        self.connection.close()
+
+def parseOptions(argv=None):
+    argParser = argparse.ArgumentParser(
+        description = 'runs devTools commands, directly or in a server which keeps their parsed files between commands.'
+    )
+    argParser.add_argument('--socket',
+        help = 'unix socket of the server (default is $%s): commands are sent to it, and serve and stop apply to it'%(SOCKET_ENV),
+        dest = 'socketPath',
+        default = os.environ.get(SOCKET_ENV))
+    argParser.add_argument('command',
+        help = 'command to run, or serve to start a server, or stop to stop it',
+        choices = sorted(COMMANDS) + ['serve', 'stop'])
+    argParser.add_argument('args',
+        help = 'arguments of the command',
+        nargs = argparse.REMAINDER)
+    args = argParser.parse_args(argv)
+    if args.command in ('serve', 'stop'):
+        # --socket may also be given after serve or stop
+        serverParser = argparse.ArgumentParser(prog = '%s %s'%(argParser.prog, args.command))
+        serverParser.add_argument('--socket',
+            dest = 'socketPath',
+            default = args.socketPath)
+        serverParser.parse_args(args.args, namespace = args)
+        if not args.socketPath:
+            argParser.error('%s needs a --socket'%(args.command))
+    return args
+
+def main(argv=None):
+    args = parseOptions(argv)
+    try:
+        if args.command == 'serve':
+            return serve(args.socketPath)
+        if not args.socketPath:
+            # the command prints its output, its main records it in the trace
+            result = run(args.command, args.args, capture=False)
+            sys.exit(result.exitCode)
+        client = Client(args.socketPath)
+        try:
+            if args.command == 'stop':
+                return client.stop()
+            result = client.run(args.command, args.args)
+        finally:
+            client.close()
+    except DevToolsError as e:
+        print >> sys.stderr, e
+        sys.exit(1)
+    sys.stdout.write(result.output)
+    sys.stderr.write(result.errors)
+    sys.exit(result.exitCode)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""streaming reader for Dynacase csv files (STRUCT_, PARAM_, WFL_ ...)
+
+records are read one at a time with the csv module, so quoted fields
+containing ';' or newlines are handled, and only requested columns are
+decoded.
+"""
+
+import csv
+
+class DynacaseDialect(csv.Dialect):
+    delimiter = ';'
+    quotechar = '"'
+    doublequote = True
+    skipinitialspace = False
+    lineterminator = '\n'
+    quoting = csv.QUOTE_MINIMAL
+    strict = False
+
+UTF8_BOM = '\xef\xbb\xbf'
+
+def readRecords(csvFileName, columns=(0, 1, 3), keywords=None, stopKeywords=None, encoding='utf8', withColumnCount=False):
+    """yields (lineNumber, fields) for each record of csvFileName
+
+        - lineNumber is the line where the record starts
+        - fields is a tuple of the decoded columns listed in columns
+          (missing columns are returned as empty strings)
+        - when keywords is given, only records whose first column is in it are yielded
+        - reading stops after the first record whose first column is in stopKeywords
+        - when withColumnCount is True, the number of columns of the record is appended to fields
+    """
+    csvFile = open(csvFileName, 'rb')
+    try:
+        reader = csv.reader(csvFile, DynacaseDialect)
+        lineNumber = 1
+        for row in reader:
+            recordLineNumber = lineNumber
+            lineNumber = reader.line_num + 1
+            if not row:
+                continue
+            if (recordLineNumber == 1) and row[0].startswith(UTF8_BOM):
+                row[0] = row[0][len(UTF8_BOM):]
+            keyword = row[0]
+            if (keywords is None) or (keyword in keywords):
+                rowLength = len(row)
+                fields = tuple(
+                    (row[column].decode(encoding) if column < rowLength else u'')
+                    for column in columns
+                )
+                if withColumnCount:
+                    fields += (rowLength, )
+                yield (recordLineNumber, fields)
+            if stopKeywords and (keyword in stopKeywords):
+                break
+    finally:
+        csvFile.close()
+
+def isMethodDeclaration(methodName):
+    """tells if the value of a METHOD line declares the method file of the family
+        ('*' and '+' prefixed values only add methods to it)
+    """
+    return bool(methodName) and (methodName[0] not in '*+')
+
+# attribute types known by dynacase (the format given in parenthesis is ignored)
+KNOWN_TYPES = set([
+    'account', 'action', 'array', 'color', 'date', 'docid', 'double', 'enum',
+    'file', 'frame', 'htmltext', 'idoc', 'image', 'int', 'longtext', 'menu',
+    'money', 'password', 'tab', 'text', 'thesaurus', 'time', 'timestamp'
+])
+
+# ATTR and PARAM lines must give columns up to the visibility
+MIN_ATTR_COLUMNS = 9
+
+# columns read by the validator: keyword, id, frame, label, type (and the number of columns)
+VALIDATED_COLUMNS = (0, 1, 2, 3, 6)
+
+class CsvValidator(object):
+    """checks the ATTR, PARAM and MODATTR records of a family (or workflow) csv file
+
+        records are given to check() as they are read, and frames are checked by
+        finish(), once all attributes of the family are known. Errors are kept as
+        (fileName, lineNumber, message).
+        inheritedIds are the attribute ids of the ancestors of the family; when it
+        is None and the family has a parent, frames declared by the parent cannot be
+        told apart from undeclared ones, so frames are not checked.
+    """
+    def __init__(self, fileName, inheritedIds=None):
+        self.fileName = fileName
+        self.inheritedIds = inheritedIds
+        self.errors = []
+        self.parentName = ''
+        # attribute id -> line of its declaration
+        self.declared = {}
+        # (line, attribute id, frame id) of attributes in a frame
+        self.frameReferences = []
+
+    def addError(self, lineNumber, message):
+        self.errors.append((self.fileName, lineNumber, message))
+
+    def check(self, lineNumber, fields):
+        """checks a record read with VALIDATED_COLUMNS and withColumnCount"""
+        (keyword, attributeId, frameId, label, attributeType, columnCount) = fields
+        if keyword == 'BEGIN':
+            self.parentName = attributeId.strip()
+            if self.parentName == '-':
+                self.parentName = ''
+            return
+        if keyword not in ('ATTR', 'PARAM', 'MODATTR'):
+            return
+        attributeId = attributeId.strip().lower()
+        if not attributeId:
+            self.addError(lineNumber, "%s has no attribute id"%(keyword))
+            return
+        if keyword != 'MODATTR':
+            if columnCount < MIN_ATTR_COLUMNS:
+                self.addError(lineNumber, "%s %s has %s columns, at least %s are expected"%(keyword, attributeId, columnCount, MIN_ATTR_COLUMNS))
+            if attributeId in self.declared:
+                self.addError(lineNumber, "attribute %s is already declared line %s"%(attributeId, self.declared[attributeId]))
+            elif self.inheritedIds and (attributeId in self.inheritedIds):
+                self.addError(lineNumber, "attribute %s is inherited, it must be changed with MODATTR"%(attributeId))
+            else:
+                self.declared[attributeId] = lineNumber
+        baseType = attributeType.split('(', 1)[0].strip().lower()
+        if baseType:
+            if baseType not in KNOWN_TYPES:
+                self.addError(lineNumber, "attribute %s has an unknown type %s"%(attributeId, attributeType.strip()))
+        elif keyword != 'MODATTR':
+            self.addError(lineNumber, "attribute %s has no type"%(attributeId))
+        frameId = frameId.strip().lower()
+        if frameId:
+            self.frameReferences.append((lineNumber, attributeId, frameId))
+
+    def finish(self):
+        """checks frames, and returns the errors"""
+        if (self.inheritedIds is not None) or (not self.parentName):
+            knownIds = set(self.declared)
+            if self.inheritedIds:
+                knownIds.update(self.inheritedIds)
+            for (lineNumber, attributeId, frameId) in self.frameReferences:
+                if frameId not in knownIds:
+                    self.addError(lineNumber, "attribute %s is in frame %s, which is not declared"%(attributeId, frameId))
+        self.errors.sort(key=lambda error: error[1])
+        return self.errors
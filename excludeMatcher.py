@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""rsync exclude patterns (as in rsyncExclude.txt) compiled into a single matcher
+
+patterns follow rsync rules:
+    - a pattern starting with '/' is anchored at the root of the transfer
+    - a pattern containing '/' (or '**') is matched against the end of the whole relative path
+    - other patterns are matched against the name of the file or directory
+    - a pattern ending with '/' only matches directories
+    - '*' does not match '/', '**' does ('**/' also matches zero directories), '?' matches any character but '/'
+    - 'dir/***' matches dir and everything inside it
+    - '- ' prefixes are accepted, '+ ' (include) rules and '!' are not supported and are skipped
+"""
+
+import os
+import re
+import argparse
+
+from utils import copytree, COPY_MODES
+from instrument import runMain
+
+# what tar --exclude-vcs skips
+VCS_PATTERNS = [
+    'CVS/', 'RCS/', 'SCCS/', '.git', '.gitignore', '.gitmodules', '.gitattributes',
+    '.cvsignore', '.svn/', '.arch-ids/', '{arch}/', '=RELEASE-ID', '=meta-update', '=update',
+    '.bzr', '.bzrignore', '.bzrtags', '.hg', '.hgignore', '.hgtags', '_darcs/'
+]
+
+def translatePattern(pattern):
+    """returns the regular expression matching a pattern without its anchor and trailing '/'"""
+    regex = []
+    index = 0
+    length = len(pattern)
+    if pattern.endswith('/***'):
+        return translatePattern(pattern[:-4]) + '(?:/.*)?'
+    while index < length:
+        char = pattern[index]
+        index += 1
+        if char == '*':
+            if (index < length) and (pattern[index] == '*'):
+                while (index < length) and (pattern[index] == '*'):
+                    index += 1
+                if (index < length) and (pattern[index] == '/'):
+                    # '**/' also matches no directory at all
+                    index += 1
+                    regex.append('(?:.*/)?')
+                else:
+                    regex.append('.*')
+            else:
+                regex.append('[^/]*')
+        elif char == '?':
+            regex.append('[^/]')
+        elif char == '[':
+            end = index
+            if (end < length) and (pattern[end] in '!^'):
+                end += 1
+            if (end < length) and (pattern[end] == ']'):
+                end += 1
+            end = pattern.find(']', end)
+            if end < 0:
+                regex.append('\\[')
+            else:
+                charClass = pattern[index:end].replace('\\', '\\\\')
+                if charClass[0] in '!^':
+                    charClass = '^' + charClass[1:]
+                regex.append('[%s]'%(charClass))
+                index = end + 1
+        elif (char == '\\') and (index < length):
+            regex.append(re.escape(pattern[index]))
+            index += 1
+        else:
+            regex.append(re.escape(char))
+    return ''.join(regex)
+
+def compilePattern(pattern):
+    """returns (regex, dirOnly) for an rsync pattern, or None if the pattern is not supported"""
+    if pattern.startswith('- '):
+        pattern = pattern[2:]
+    elif pattern.startswith('+ ') or (pattern == '!'):
+        return None
+    dirOnly = pattern.endswith('/') and (pattern.strip('/') != '')
+    pattern = pattern.rstrip('/') if dirOnly else pattern
+    if pattern.startswith('/'):
+        regex = '^' + translatePattern(pattern[1:])
+    else:
+        # names and unanchored paths match after a '/' (or at the start of the path)
+        regex = '(?:^|/)' + translatePattern(pattern)
+    return (regex + '$', dirOnly)
+
+class ExcludeMatcher(object):
+    """tells if a path relative to the root of a tree is excluded by rsync patterns
+
+        all patterns are compiled in one regular expression for files, and one for directories
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        fileRegexes = []
+        dirRegexes = []
+        for pattern in self.patterns:
+            compiled = compilePattern(pattern)
+            if compiled is None:
+                continue
+            (regex, dirOnly) = compiled
+            dirRegexes.append(regex)
+            if not dirOnly:
+                fileRegexes.append(regex)
+        self.fileRegex = self.compile(fileRegexes)
+        self.dirRegex = self.compile(dirRegexes)
+
+    def compile(self, regexes):
+        if not regexes:
+            return None
+        return re.compile('|'.join('(?:%s)'%(regex) for regex in regexes), re.DOTALL)
+
+    def matches(self, relPath, isDir=False):
+        """tells if relPath itself is excluded (its parent directories are not checked)"""
+        regex = self.dirRegex if isDir else self.fileRegex
+        return (regex is not None) and (regex.search(relPath.replace(os.sep, '/')) is not None)
+
+    def isExcluded(self, relPath, isDir=False):
+        """tells if relPath, or one of its parent directories, is excluded"""
+        parts = relPath.replace(os.sep, '/').split('/')
+        for index in range(1, len(parts)):
+            if self.matches('/'.join(parts[:index]), True):
+                return True
+        return self.matches(relPath, isDir)
+
+    def getIgnoreCallback(self, root):
+        """returns an ignore callback for utils.copytree (or shutil.copytree) copying root
+            excluded directories are not walked
+        """
+        root = os.path.abspath(root)
+        def ignore(directory, names):
+            relDir = os.path.relpath(os.path.abspath(directory), root)
+            prefix = '' if relDir == '.' else relDir.replace(os.sep, '/') + '/'
+            return set(name for name in names
+                if self.matches(prefix + name, os.path.isdir(os.path.join(directory, name))))
+        return ignore
+
+def loadPatterns(excludeFile):
+    """returns the patterns of an rsync exclude file (comments and blank lines are skipped)"""
+    patterns = []
+    for line in open(excludeFile):
+        line = line.rstrip('\r\n')
+        if line and (line[0] not in '#;'):
+            patterns.append(line)
+    return patterns
+
+def loadExcludeFile(excludeFile):
+    """returns the matcher of an rsync exclude file, or a matcher excluding nothing if the file does not exist"""
+    if (not excludeFile) or (not os.path.isfile(excludeFile)):
+        return ExcludeMatcher([])
+    return ExcludeMatcher(loadPatterns(excludeFile))
+
+def parseOptions():
+    argParser = argparse.ArgumentParser(
+        description = 'copies a tree, skipping files excluded by rsync patterns (symlinks are followed, as tar -h does).'
+    )
+    argParser.add_argument('source',
+        help = 'directory to copy')
+    argParser.add_argument('destination',
+        help = 'directory receiving the copy (it may already exist)')
+    argParser.add_argument('--excludeFile',
+        help = 'rsync exclude file (use it several times to read several files)',
+        action = 'append',
+        dest = 'excludeFiles',
+        default = [])
+    argParser.add_argument('--exclude',
+        help = 'rsync exclude pattern (use it several times to add several patterns)',
+        action = 'append',
+        dest = 'patterns',
+        default = [])
+    argParser.add_argument('--excludeVcs',
+        help = 'also exclude version control files, as tar --exclude-vcs does',
+        action = 'store_true',
+        dest = 'excludeVcs',
+        default = False)
+    argParser.add_argument('--copyMode',
+        help = 'how files are copied: hardlink and reflink fall back to copy when they are not possible (hardlinked files must not be modified in place)',
+        choices = COPY_MODES,
+        dest = 'copyMode',
+        default = 'copy')
+    argParser.add_argument('-j', '--jobs',
+        help = 'number of threads copying files',
+        dest = 'jobs',
+        type = int,
+        default = 4)
+    args = argParser.parse_args()
+    return args
+
+def main():
+    args = parseOptions()
+    patterns = list(args.patterns)
+    for excludeFile in args.excludeFiles:
+        if os.path.isfile(excludeFile):
+            patterns.extend(loadPatterns(excludeFile))
+    if args.excludeVcs:
+        patterns.extend(VCS_PATTERNS)
+    matcher = ExcludeMatcher(patterns)
+    destination = os.path.abspath(args.destination)
+    ignoreExcluded = matcher.getIgnoreCallback(args.source)
+    def ignore(directory, names):
+        ignored = ignoreExcluded(directory, names)
+        # the destination may be inside the source
+        ignored.update(name for name in names if os.path.abspath(os.path.join(directory, name)) == destination)
+        return ignored
+    copytree(args.source, args.destination, symlinks=False, ignore=ignore, mode=args.copyMode, jobs=args.jobs)
+
+if __name__ == "__main__":
+    runMain(main)
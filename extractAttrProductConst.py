@@ -2,22 +2,33 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import time
 import codecs
 import string
 import argparse
 import logging
 
+from collections import OrderedDict
+
+from instrument import phase, runMain
+from dynacaseCsv import readRecords, isMethodDeclaration, CsvValidator, VALIDATED_COLUMNS
+from utils import makedirs, loadJsonFile, writeJsonFile, getFileSignature, createTempFileFor, commitTempFile, discardTempFile, getDiff, FileCache
+
 logging.basicConfig(
     format='[%(lineno)d] %(levelname)s:%(message)s'
 )
 
+# errors found by --validate are logged here, so that they can be counted
+validationLogger = logging.getLogger('validation')
+
 class MethodStructException(Exception):
     def __init__(self, value):
         self.value = value
     def __str__(self):
         return repr(self.value)
 
-def parseOptions():
+def parseOptions(argv=None):
     argParser = argparse.ArgumentParser(
         description = 'inserts constants for attributes and parameters in Method files.',
         formatter_class = argparse.ArgumentDefaultsHelpFormatter
@@ -50,29 +61,163 @@ def parseOptions():
         help = 'keyword closing attributes area',
         dest = 'endKwNew',
         default = '//endregion'),
+    argParser.add_argument('--writeMode',
+        help = 'region only rewrites the constants region, streaming the rest of the file; full rebuilds the whole file in memory',
+        dest = 'writeMode',
+        choices = ['region', 'full'],
+        default = 'region')
+    argParser.add_argument('--cacheDir',
+        help = 'directory where scan index and manifest are kept (defaults to <familiesFolder>/.cache)',
+        dest = 'cacheDir',
+        default = None)
+    argParser.add_argument('--noCache',
+        help = 'do not use nor update the scan index and manifest (every file is processed)',
+        action = 'store_true',
+        dest = 'noCache',
+        default = False)
+    argParser.add_argument('-j', '--jobs',
+        help = 'number of processes used to handle csv files (0 uses all available cores)',
+        dest = 'jobs',
+        type = int,
+        default = 1)
+    argParser.add_argument('--withInherited',
+        help = 'also insert constants for attributes inherited from parent families (found in familiesFolder or given with --familyFile)',
+        action = 'store_true',
+        dest = 'withInherited',
+        default = False)
+    argParser.add_argument('--validate',
+        help = 'while parsing, check csv files for duplicate attribute ids, undeclared frames, unknown types and missing columns (all files are parsed, and the exit code is 1 if errors are found)',
+        action = 'store_true',
+        dest = 'validate',
+        default = False)
+    argParser.add_argument('--diff',
+        help = 'do not write anything, but print a unified diff of the method and class files which would change (the exit code is 1 if one would)',
+        action = 'store_true',
+        dest = 'diff',
+        default = False)
+    argParser.add_argument('--watch',
+        help = 'after processing, keep watching familiesFolder and process csv files again as soon as they change '
+            '(with inotify when pyinotify is installed, otherwise by checking the mtime of every csv file twice a second)',
+        action = 'store_true',
+        dest = 'watch',
+        default = False)
+    argParser.add_argument('--watchDelay',
+        help = 'with --watch, seconds without change to wait before processing (defaults to inosync_conf.edelay)',
+        dest = 'watchDelay',
+        type = float,
+        default = None)
     argParser.add_argument('--logLevel',
         help = 'logging level',
         dest = 'logLevel',
         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
         default = 'WARNING')
-    args = argParser.parse_args()
+    args = argParser.parse_args(argv)
+    if args.diff and args.watch:
+        argParser.error('--diff cannot be used with --watch')
+    if args.jobs < 0:
+        argParser.error('--jobs must be 0 (all available cores) or a number of processes')
     return args
 
-def getFamilyFiles(familiesFolder):
-    familyFiles = []
-    for root, dirs, files in os.walk(familiesFolder):
-        for fileName in files:
-            if (string.lower(os.path.splitext(fileName)[1]) in ['.csv']) and (fileName[:7] == "STRUCT_") :
-                familyFiles.append(os.path.join(root, fileName))
+# (kind, file name prefix, file extension) of the files found in families folder
+FILE_KINDS = [
+    ('struct', 'STRUCT_', '.csv'),
+    ('param', 'PARAM_', '.csv'),
+    ('wfl', 'WFL_', '.csv'),
+    ('method', 'Method.', '.php'),
+    ('class', 'Class.', '.php')
+]
+
+INDEX_VERSION = 1
+# 2: constants are written in the order of the csv files
+# 3: the options key includes the write mode
+MANIFEST_VERSION = 3
+
+def classifyFile(fileName):
+    extension = string.lower(os.path.splitext(fileName)[1])
+    for (kind, prefix, kindExtension) in FILE_KINDS:
+        if (extension == kindExtension) and fileName.startswith(prefix):
+            return kind
+    return None
+
+def getCacheFile(args, name):
+    if args.noCache:
+        return None
+    cacheDir = args.cacheDir
+    if not cacheDir:
+        cacheDir = os.path.join(args.familiesFolder, '.cache')
+    return os.path.join(cacheDir, 'extractAttrProductConst.%s.json'%(name))
+
+def scanFamiliesFolder(familiesFolder, indexFileName=None, saveIndex=True):
+    """walks familiesFolder once and returns found files by kind (see FILE_KINDS)
+
+        when indexFileName is given, the content of each directory is saved there
+        along with its mtime, so that directories which did not change since last
+        scan are not listed again. With saveIndex=False, the index is only read.
+    """
+    oldIndex = {}
+    if indexFileName:
+        index = loadJsonFile(indexFileName, {})
+        if (index.get('version') == INDEX_VERSION) and (index.get('root') == os.path.abspath(familiesFolder)):
+            oldIndex = index.get('dirs', {})
+    # the cache folder changes on every save, it must not invalidate the index
+    cacheDir = None
+    if indexFileName:
+        cacheDir = os.path.abspath(os.path.dirname(indexFileName))
+    if indexFileName and saveIndex:
+        try:
+            makedirs(cacheDir)
+        except OSError as e:
+            logging.warning("could not create cache folder %s: %s", cacheDir, e)
+    newIndex = {}
+    foundFiles = dict((kind, []) for (kind, prefix, extension) in FILE_KINDS)
+    listedDirs = 0
+    toScan = ['']
+    while toScan:
+        relDir = toScan.pop()
+        directory = os.path.join(familiesFolder, relDir)
+        try:
+            dirMtime = os.stat(directory).st_mtime
+        except OSError:
+            continue
+        dirEntry = oldIndex.get(relDir)
+        if (not dirEntry) or (dirEntry['mtime'] != dirMtime):
+            listedDirs += 1
+            dirEntry = {'mtime': dirMtime, 'dirs': [], 'files': {}}
+            for fileName in sorted(os.listdir(directory)):
+                filePath = os.path.join(directory, fileName)
+                if os.path.isdir(filePath):
+                    # same as os.walk: symlinked dirs are not followed
+                    if (not os.path.islink(filePath)) and (os.path.abspath(filePath) != cacheDir):
+                        dirEntry['dirs'].append(fileName)
+                else:
+                    kind = classifyFile(fileName)
+                    if kind:
+                        dirEntry['files'].setdefault(kind, []).append(fileName)
+        newIndex[relDir] = dirEntry
+        for kind in dirEntry['files']:
+            for fileName in dirEntry['files'][kind]:
+                foundFiles[kind].append(os.path.join(directory, fileName))
+        for subDir in reversed(dirEntry['dirs']):
+            toScan.append(os.path.join(relDir, subDir))
+    logging.info("scanned %s folders (%s listed) in %s", len(newIndex), listedDirs, familiesFolder)
+    if indexFileName and saveIndex and (newIndex != oldIndex):
+        try:
+            writeJsonFile(indexFileName, {
+                'version': INDEX_VERSION,
+                'root': os.path.abspath(familiesFolder),
+                'dirs': newIndex
+            })
+        except (IOError, OSError) as e:
+            logging.warning("could not save folder index %s: %s", indexFileName, e)
+    return foundFiles
+
+def getFamilyFiles(familiesFolder, indexFileName=None):
+    familyFiles = scanFamiliesFolder(familiesFolder, indexFileName)['struct']
     logging.info("found %s family files", len(familyFiles))
     return familyFiles
 
-def getWflFiles(familiesFolder):
-    wflFiles = []
-    for root, dirs, files in os.walk(familiesFolder):
-        for fileName in files:
-            if (string.lower(os.path.splitext(fileName)[1]) in ['.csv']) and (fileName[:4] == "WFL_") :
-                wflFiles.append(os.path.join(root, fileName))
+def getWflFiles(familiesFolder, indexFileName=None):
+    wflFiles = scanFamiliesFolder(familiesFolder, indexFileName)['wfl']
     logging.info("found %s workflow files", len(wflFiles))
     return wflFiles
 
@@ -89,14 +234,8 @@ def buildFileContent(methodFileName, attributes, args):
                     logging.warning("%s found multiple times", args.beginKw)
                 else:
                     modeInAttr = True
-                    if(args.beginKw != args.beginKwNew):
-                        currentContent = currentContent.replace(args.beginKw, args.beginKwNew)
-                    methodContent.append(currentContent)
-                    indent = ' '*beginKwPosition
-                    for currentAttrId in attributes:
-                        #TODO: are \n required?
-                        methodContent.append("%s/** %s */\n"%(indent, attributes[currentAttrId]))
-                        methodContent.append("%sconst %s = '%s';\n"%(indent, currentAttrId, currentAttrId))
+                    # the end keyword line is appended when it is found
+                    methodContent.extend(buildRegionContent(currentContent, '', attributes, args)[:-1])
                     #prevent injection from happening twice
                     attributesInjected = True
             else:
@@ -115,38 +254,441 @@ def buildFileContent(methodFileName, attributes, args):
     else:
         return methodContent
 
-def extractFamilyAttr(directory, structFileName, args):
+def getOptionsKey(args):
+    """returns a key of the options changing the content of written files: when it changes, every file is processed again"""
+    options = [args.beginKw, args.beginKwNew, args.endKw, args.endKwNew, 'writeMode=' + args.writeMode]
+    if args.withInherited:
+        options.append('withInherited')
+    return "\n".join(options)
+
+def makeManifestEntry(inputFileNames, outputFileName, args):
+    return {
+        'options': getOptionsKey(args),
+        'inputs' : [[os.path.abspath(fileName), getFileSignature(fileName)] for fileName in inputFileNames],
+        'output' : [os.path.abspath(outputFileName), getFileSignature(outputFileName)]
+    }
+
+def isUpToDate(manifestEntry, args):
+    """tells if the inputs and output recorded in manifestEntry still have the same content"""
+    if args.validate:
+        # files must be parsed to be validated
+        return False
+    if (not manifestEntry) or (manifestEntry.get('options') != getOptionsKey(args)):
+        return False
+    for (fileName, signature) in manifestEntry['inputs'] + [manifestEntry['output']]:
+        currentSignature = getFileSignature(fileName, signature)
+        if (currentSignature is None) or (signature is None):
+            if currentSignature != signature:
+                return False
+        elif currentSignature[2] != signature[2]:
+            return False
+    return True
+
+def buildRegionContent(beginLine, endLine, attributes, args):
+    """returns the lines of the constants region, from the begin keyword line to the end keyword line"""
+    beginKwPosition = beginLine.find(args.beginKw)
+    if(args.beginKw != args.beginKwNew):
+        beginLine = beginLine.replace(args.beginKw, args.beginKwNew)
+    regionContent = [beginLine]
+    indent = ' '*beginKwPosition
+    for currentAttrId in attributes:
+        regionContent.append("%s/** %s */\n"%(indent, attributes[currentAttrId]))
+        regionContent.append("%sconst %s = '%s';\n"%(indent, currentAttrId, currentAttrId))
+    if(args.endKw != args.endKwNew):
+        endLine = endLine.replace(args.endKw, args.endKwNew)
+    regionContent.append(endLine)
+    return regionContent
+
+def findRegion(methodFile, args):
+    """returns (regionStart, regionEnd, regionLines) of the first constants region of methodFile
+        offsets are in bytes, and regionLines are the utf8 decoded lines of the region
+    """
+    beginKw = args.beginKw.encode('utf8')
+    endKw = args.endKw.encode('utf8')
+    regionStart = None
+    regionLines = []
+    offset = 0
+    for line in iter(methodFile.readline, ''):
+        if regionStart is None:
+            if line.find(beginKw) >= 0:
+                regionStart = offset
+                regionLines.append(line.decode('utf8'))
+        else:
+            regionLines.append(line.decode('utf8'))
+            if endKw in line:
+                return (regionStart, offset + len(line), regionLines)
+        offset += len(line)
+    if regionStart is None:
+        raise MethodStructException("%s not written: %s not found"%(methodFile.name, args.beginKw))
+    raise MethodStructException("%s not written: %s not found"%(methodFile.name, args.endKw))
+
+def copySplicedContent(methodFile, tmpFile, regionStart, regionEnd, regionContent, args):
+    """copies methodFile to tmpFile, replacing bytes from regionStart to regionEnd by regionContent"""
+    methodFile.seek(0)
+    toCopy = regionStart
+    while toCopy > 0:
+        chunk = methodFile.read(min(toCopy, 65536))
+        if not chunk:
+            break
+        tmpFile.write(chunk)
+        toCopy -= len(chunk)
+    tmpFile.write(regionContent)
+    methodFile.seek(regionEnd)
+    beginKw = args.beginKw.encode('utf8')
+    for line in iter(methodFile.readline, ''):
+        if line.find(beginKw) >= 0:
+            logging.warning("%s found multiple times", args.beginKw)
+        tmpFile.write(line)
+
+def spliceRegion(methodFileName, attributes, args):
+    """replaces the constants region of methodFileName, and returns True if the file has been written
+
+        only the region is held in memory: the head and tail of the file are streamed
+        to a temp file which is then renamed over methodFileName.
+    """
+    methodFile = open(methodFileName, 'rb')
+    try:
+        with phase('generate'):
+            (regionStart, regionEnd, regionLines) = findRegion(methodFile, args)
+            regionContent = u''.join(buildRegionContent(regionLines[0], regionLines[-1], attributes, args)).encode('utf8')
+        if regionContent == u''.join(regionLines).encode('utf8'):
+            return False
+        with phase('write'):
+            (tmpFile, tmpFileName) = createTempFileFor(methodFileName)
+            try:
+                copySplicedContent(methodFile, tmpFile, regionStart, regionEnd, regionContent, args)
+            except:
+                discardTempFile(tmpFile, tmpFileName)
+                raise
+    finally:
+        methodFile.close()
+    with phase('write'):
+        commitTempFile(tmpFile, tmpFileName, methodFileName)
+    return True
+
+def rewriteFile(methodFileName, attributes, args):
+    """rebuilds the whole content of methodFileName, and returns True if the file has been written"""
+    with phase('generate'):
+        methodContent = buildFileContent(methodFileName, attributes, args)
+    if(len(methodContent) == 0):
+        logging.warning("Nothing to write in %s", methodFileName)
+        return False
+    methodContent = u''.join(methodContent)
+    methodFile = codecs.open(methodFileName, 'r', 'utf8')
+    currentContent = methodFile.read()
+    methodFile.close()
+    if(methodContent == currentContent):
+        return False
+    with phase('write'):
+        (tmpFile, tmpFileName) = createTempFileFor(methodFileName)
+        try:
+            tmpFile.write(methodContent.encode('utf8'))
+        except:
+            discardTempFile(tmpFile, tmpFileName)
+            raise
+        commitTempFile(tmpFile, tmpFileName, methodFileName)
+    return True
+
+def getNewContent(methodFileName, attributes, args):
+    """returns the content methodFileName would have once attributes are injected, as utf8 bytes"""
+    if args.writeMode == 'full':
+        return u''.join(buildFileContent(methodFileName, attributes, args)).encode('utf8')
+    methodFile = open(methodFileName, 'rb')
+    try:
+        (regionStart, regionEnd, regionLines) = findRegion(methodFile, args)
+        regionContent = u''.join(buildRegionContent(regionLines[0], regionLines[-1], attributes, args)).encode('utf8')
+        methodFile.seek(0)
+        content = methodFile.read()
+    finally:
+        methodFile.close()
+    return content[:regionStart] + regionContent + content[regionEnd:]
+
+# diffs of the files which would change (--diff), in processing order
+methodDiffs = []
+
+def writeMethodFile(methodFileName, attributes, args, sourceFileName):
+    """injects attributes in methodFileName, and returns True if the file has been written
+        the file is left untouched when its content would not change
+        with args.diff, nothing is written: the diff is kept in methodDiffs, and True is returned if there is one
+    """
+    if args.diff:
+        with phase('generate'):
+            diff = getDiff(methodFileName, getNewContent(methodFileName, attributes, args))
+        if diff:
+            methodDiffs.append(diff)
+            logging.info("%s would change for %s", os.path.basename(methodFileName), os.path.basename(sourceFileName))
+        else:
+            logging.info("%s is up to date for %s", os.path.basename(methodFileName), os.path.basename(sourceFileName))
+        return bool(diff)
+    if args.writeMode == 'full':
+        written = rewriteFile(methodFileName, attributes, args)
+    else:
+        written = spliceRegion(methodFileName, attributes, args)
+    if written:
+        logging.info("%s attributes written in %s for %s", len(attributes), os.path.basename(methodFileName), os.path.basename(sourceFileName))
+    else:
+        logging.info("%s is up to date for %s", os.path.basename(methodFileName), os.path.basename(sourceFileName))
+    return written
+
+def parseFamilyFiles(structFileName, paramFileName, validator=None):
+    """returns (methodFileName, attributes) declared by a family STRUCT_ and PARAM_ files
+        methodFileName is '' if the method declaration is missing or eroneous
+        records of the STRUCT_ file are also given to validator, when there is one
+    """
     methodFileName = ''
-    paramFileName = os.path.join(os.path.dirname(structFileName), "PARAM_" + os.path.basename(structFileName)[7:])
+    # in declaration order, so are the constants
+    attributes = OrderedDict()
     if(not os.path.isfile(paramFileName)):
         logging.info("skipping %s since it does not exists", paramFileName)
     else:
-        paramReader = codecs.open(paramFileName, 'r', 'utf8').readlines()
-        for currentLine in paramReader:
-            currentLine = currentLine.split(";")
-            if currentLine[0] == "METHOD":
-                if( (currentLine[1][0] != '*') and (currentLine[1][0] != '+') ):
-                    methodFileName = currentLine[1]
-                    break
+        for (lineNumber, (keyword, value)) in readRecords(paramFileName, (0, 1), ['METHOD']):
+            if isMethodDeclaration(value):
+                methodFileName = value
+                break
     if(not os.path.isfile(structFileName)):
         logging.info("skipping %s since it does not exists", structFileName)
     else:
-        structReader = codecs.open(structFileName, 'r', 'utf8').readlines()
-        attributes = {}
-        for currentLine in structReader:
-            currentLine = currentLine.split(";")
-            if currentLine[0] == "ATTR":
-                attributes[currentLine[1].lower()] = currentLine[3]
-            if currentLine[0] == "PARAM":
-                attributes[currentLine[1].lower()] = '<PARAMETER> ' + currentLine[3]
-            if currentLine[0] == "METHOD":
-                if( (currentLine[1][0] != '*') and (currentLine[1][0] != '+') ):
-                    if( (methodFileName != '') and (methodFileName != currentLine[1]) ):
+        (columns, keywords) = ((0, 1, 3), ['ATTR', 'PARAM', 'METHOD', 'END'])
+        if validator is not None:
+            (columns, keywords) = (VALIDATED_COLUMNS, keywords + ['BEGIN', 'MODATTR'])
+        for (lineNumber, fields) in readRecords(structFileName, columns, keywords, ['END'], withColumnCount=(validator is not None)):
+            if validator is not None:
+                validator.check(lineNumber, fields)
+                (keyword, value, label) = (fields[0], fields[1], fields[3])
+            else:
+                (keyword, value, label) = fields
+            if keyword == "ATTR":
+                attributes[value.lower()] = label
+            elif keyword == "PARAM":
+                attributes[value.lower()] = '<PARAMETER> ' + label
+            elif keyword == "METHOD":
+                if isMethodDeclaration(value):
+                    if( (methodFileName != '') and (methodFileName != value) ):
                         # revert to empty string so that this csv is not parsed
                         methodFileName = ''
                         logging.error("duplicate method declaration for %s | %s", structFileName, paramFileName)
                         break
-                    methodFileName = currentLine[1]
+                    methodFileName = value
+    return (methodFileName, attributes)
+
+# results of parseFamilyFiles and parseWflFile, and BEGIN lines of STRUCT_ files,
+# kept while the files do not change (only useful to a long-lived process)
+parsedFiles = FileCache()
+
+def parseFamilyFilesCached(structFileName, paramFileName):
+    """same as parseFamilyFiles, without validation
+        a result with an eroneous method declaration is not kept, so that its error is logged again
+    """
+    result = parsedFiles.get([structFileName, paramFileName], lambda: parseFamilyFiles(structFileName, paramFileName), 'family')
+    if not result[0]:
+        parsedFiles.discard([structFileName, paramFileName], 'family')
+    return result
+
+def parseWflFileCached(wflFileName):
+    """same as parseWflFile, without validation (a result without class is not kept)"""
+    result = parsedFiles.get([wflFileName], lambda: parseWflFile(wflFileName), 'wfl')
+    if not result[0]:
+        parsedFiles.discard([wflFileName], 'wfl')
+    return result
+
+def getParamFileName(structFileName):
+    return os.path.join(os.path.dirname(structFileName), "PARAM_" + os.path.basename(structFileName)[7:])
+
+class FamilyGraph(object):
+    """families and their parent, as declared on the BEGIN line of STRUCT_ files
+
+        the attributes of each family (its own and the inherited ones) are parsed
+        and merged once, so families sharing ancestors do not parse them again.
+    """
+    def __init__(self, structFileNames):
+        # family name -> (structFileName, parentName)
+        self.families = {}
+        # abspath of STRUCT_ file -> family name
+        self.familyNames = {}
+        # family name -> (methodFileName, own attributes)
+        self.parsed = {}
+        # family name -> own and inherited attributes
+        self.attributes = {}
+        for structFileName in structFileNames:
+            self.addFamily(structFileName)
+
+    def addFamily(self, structFileName):
+        if os.path.abspath(structFileName) in self.familyNames:
+            return
+        beginRecords = parsedFiles.get([structFileName], lambda: list(readRecords(structFileName, (1, 5), ['BEGIN'], ['BEGIN'])), 'begin')
+        for (lineNumber, (parentName, familyName)) in beginRecords:
+            familyName = familyName.strip().upper()
+            parentName = parentName.strip().upper()
+            if parentName == '-':
+                parentName = ''
+            if not familyName:
+                logging.warning("%s:%s has no logical name, its children will not inherit its attributes", structFileName, lineNumber)
+            elif familyName in self.families:
+                logging.warning("family %s is declared by %s and %s, using the first one", familyName, self.families[familyName][0], structFileName)
+            else:
+                self.families[familyName] = (structFileName, parentName)
+                self.familyNames[os.path.abspath(structFileName)] = familyName
+
+    def getDescendants(self, familyName):
+        descendants = []
+        toVisit = [familyName]
+        while toVisit:
+            parentName = toVisit.pop()
+            for (childName, (structFileName, childParentName)) in self.families.items():
+                if (childParentName == parentName) and (childName not in descendants) and (childName != familyName):
+                    descendants.append(childName)
+                    toVisit.append(childName)
+        return descendants
+
+    def updateFamily(self, structFileName):
+        """reads structFileName (and its PARAM_ file) again, if it still exists
+            returns the STRUCT_ files of the families whose attributes may have changed
+        """
+        affectedNames = []
+        familyName = self.getFamilyName(structFileName)
+        if familyName:
+            affectedNames = [familyName] + self.getDescendants(familyName)
+            del self.families[familyName]
+            del self.familyNames[os.path.abspath(structFileName)]
+            self.parsed.pop(familyName, None)
+        if os.path.isfile(structFileName):
+            self.addFamily(structFileName)
+            familyName = self.getFamilyName(structFileName)
+            if familyName:
+                affectedNames += [familyName] + self.getDescendants(familyName)
+                self.parsed.pop(familyName, None)
+        for name in affectedNames:
+            self.attributes.pop(name, None)
+        return sorted(set(self.families[name][0] for name in affectedNames if name in self.families))
+
+    def getFamilyName(self, structFileName):
+        return self.familyNames.get(os.path.abspath(structFileName))
+
+    def getAncestors(self, familyName):
+        """returns the names of the ancestors of familyName found in the graph, from its parent up"""
+        ancestors = []
+        parentName = self.families[familyName][1]
+        while parentName in self.families:
+            if (parentName == familyName) or (parentName in ancestors):
+                cycle = [familyName] + ancestors
+                cycle = cycle[cycle.index(parentName):] + [parentName]
+                raise MethodStructException("inheritance cycle: %s"%(' -> '.join(cycle)))
+            ancestors.append(parentName)
+            parentName = self.families[parentName][1]
+        return ancestors
+
+    def getInputFiles(self, familyName):
+        """returns the csv files the attributes of familyName depend on"""
+        inputFiles = []
+        for name in [familyName] + self.getAncestors(familyName):
+            structFileName = self.families[name][0]
+            inputFiles.extend([structFileName, getParamFileName(structFileName)])
+        return inputFiles
+
+    def parseFamily(self, familyName, validator=None):
+        """returns (methodFileName, own attributes) of familyName
+            files are parsed again when a validator is given, so that it sees their records
+        """
+        if (familyName not in self.parsed) or (validator is not None):
+            structFileName = self.families[familyName][0]
+            if validator is None:
+                self.parsed[familyName] = parseFamilyFilesCached(structFileName, getParamFileName(structFileName))
+            else:
+                self.parsed[familyName] = parseFamilyFiles(structFileName, getParamFileName(structFileName), validator)
+        return self.parsed[familyName]
+
+    def getAttributes(self, familyName):
+        """returns the attributes of familyName, including the ones inherited from its ancestors
+            inherited attributes come first, then the family's own ones in declaration order
+        """
+        if familyName not in self.attributes:
+            ancestors = self.getAncestors(familyName)
+            attributes = OrderedDict()
+            if ancestors:
+                attributes.update(self.getAttributes(ancestors[0]))
+            attributes.update(self.parseFamily(familyName)[1])
+            self.attributes[familyName] = attributes
+        return self.attributes[familyName]
+
+def parseWflFile(wflFileName, validator=None):
+    """returns (className, attributes) declared by a workflow WFL_ file
+        className is '' if it is not declared
+        records are also given to validator, when there is one
+    """
+    attributes = OrderedDict()
+    classFileName = ''
+    (columns, keywords) = ((0, 1, 3, 4), ['ATTR', 'PARAM', 'BEGIN', 'END'])
+    if validator is not None:
+        (columns, keywords) = (VALIDATED_COLUMNS + (4, ), keywords + ['MODATTR'])
+    for (lineNumber, fields) in readRecords(wflFileName, columns, keywords, ['END'], withColumnCount=(validator is not None)):
+        if validator is not None:
+            validator.check(lineNumber, fields[:5] + fields[6:])
+            (keyword, value, label, className) = (fields[0], fields[1], fields[3], fields[5])
+        else:
+            (keyword, value, label, className) = fields
+        if keyword == "ATTR" or keyword == "PARAM":
+            attributes[value.lower()] = label
+        elif keyword == "BEGIN":
+            if(className != ''):
+                classFileName = className
+            else:
+                classFileName = ''
+                logging.error("no className for %s", wflFileName)
+                break
+    return (classFileName, attributes)
+
+def reportErrors(errors):
+    for (fileName, lineNumber, message) in errors:
+        validationLogger.error("%s:%s: %s", fileName, lineNumber, message)
+
+class ErrorCounter(logging.Handler):
+    """counts the errors logged by validationLogger (also the ones sent back by worker processes)"""
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.count = 0
+    def emit(self, record):
+        if record.name == validationLogger.name:
+            self.count += 1
+
+def extractFamilyAttr(directory, structFileName, args, manifestEntry=None):
+    """injects attributes of structFileName in its method file
+        returns the manifest entry describing the processed files, or None if nothing was done
+    """
+    if isUpToDate(manifestEntry, args):
+        logging.info("skipping %s since it did not change", structFileName)
+        return manifestEntry
+    paramFileName = getParamFileName(structFileName)
+    inputFileNames = [structFileName, paramFileName]
+    familyGraph = getattr(args, 'familyGraph', None)
+    familyName = familyGraph and familyGraph.getFamilyName(structFileName)
+    with phase('parse'):
+        if familyName:
+            try:
+                inputFileNames = familyGraph.getInputFiles(familyName)
+                validator = None
+                if args.validate:
+                    ancestors = familyGraph.getAncestors(familyName)
+                    inheritedIds = None
+                    if ancestors:
+                        inheritedIds = set(familyGraph.getAttributes(ancestors[0]))
+                        if familyGraph.families[ancestors[-1]][1]:
+                            # the root family found has a parent out of the families folder
+                            inheritedIds = None
+                    validator = CsvValidator(structFileName, inheritedIds)
+                methodFileName = familyGraph.parseFamily(familyName, validator)[0]
+                attributes = familyGraph.getAttributes(familyName)
+            except MethodStructException as e:
+                logging.error("skipping %s: %s", structFileName, e.value)
+                return None
+        else:
+            validator = None
+            if args.validate:
+                validator = CsvValidator(structFileName)
+                (methodFileName, attributes) = parseFamilyFiles(structFileName, paramFileName, validator)
+            else:
+                (methodFileName, attributes) = parseFamilyFilesCached(structFileName, paramFileName)
+    if validator is not None:
+        reportErrors(validator.finish())
 
     if(not methodFileName):
         logging.warning("skipping %s | %s since their method declaration is eroneous", paramFileName, structFileName)
@@ -157,33 +699,28 @@ def extractFamilyAttr(directory, structFileName, args):
         else:
             logging.info("working on %s for %s | %s", methodFileName, structFileName, paramFileName)
             try:
-                methodContent = buildFileContent(methodFileName, attributes, args)
-                if(len(methodContent) > 0):
-                    methodFile = codecs.open(methodFileName, 'w', 'utf8')
-                    methodFile.writelines(methodContent)
-                    methodFile.close()
-                    logging.info("%s attributes written in %s for %s", len(attributes), os.path.basename(methodFileName), os.path.basename(structFileName))
-                else:
-                    logging.warning("Nothing to write in ", methodFileName)
+                writeMethodFile(methodFileName, attributes, args, structFileName)
+                return makeManifestEntry(inputFileNames, methodFileName, args)
             except MethodStructException as e:
                 logging.error(e.value)
+    return None
 
-def extractWflAttr(directory, wflFileName, args):
-    structReader = codecs.open(wflFileName, 'r', 'utf8').readlines()
-    attributes = {}
-    for currentLine in structReader:
-        currentLine = currentLine.split(";")
-        if currentLine[0] == "ATTR":
-            attributes[currentLine[1].lower()] = currentLine[3]
-        if currentLine[0] == "PARAM":
-            attributes[currentLine[1].lower()] = currentLine[3]
-        if currentLine[0] == "BEGIN":
-            if(currentLine[4] != ''):
-                classFileName = currentLine[4]
-            else:
-                classFileName = ''
-                logging.error("no className for %s", wflFileName)
-                break
+def extractWflAttr(directory, wflFileName, args, manifestEntry=None):
+    """injects attributes of wflFileName in its class file
+        returns the manifest entry describing the processed files, or None if nothing was done
+    """
+    if isUpToDate(manifestEntry, args):
+        logging.info("skipping %s since it did not change", wflFileName)
+        return manifestEntry
+    with phase('parse'):
+        validator = None
+        if args.validate:
+            validator = CsvValidator(wflFileName)
+            (classFileName, attributes) = parseWflFile(wflFileName, validator)
+        else:
+            (classFileName, attributes) = parseWflFileCached(wflFileName)
+    if validator is not None:
+        reportErrors(validator.finish())
 
     if(classFileName == ''):
         logging.info("skipping %s", wflFileName)
@@ -194,19 +731,131 @@ def extractWflAttr(directory, wflFileName, args):
         else:
             logging.info("working on %s for %s", classFileName, wflFileName)
             try:
-                methodContent = buildFileContent(classFileName, attributes, args)
-                if(len(methodContent) > 0):
-                    methodFile = codecs.open(classFileName, 'w', 'utf8')
-                    methodFile.writelines(methodContent)
-                    methodFile.close()
-                    logging.info("%s attributes written in %s for %s", len(attributes), os.path.basename(classFileName), os.path.basename(wflFileName))
-                else:
-                    logging.warning("Nothing to write in ", classFileName)
+                writeMethodFile(classFileName, attributes, args, wflFileName)
+                return makeManifestEntry([wflFileName], classFileName, args)
             except MethodStructException as e:
                 logging.error(e.value)
+    return None
+
+def getTargetFileName(directory, kind, csvFileName):
+    """returns the method (or class) file a csv file will write to, without parsing the whole csv
+        this is only used to detect csv files sharing the same target
+    """
+    if kind == 'family':
+        paramFileName = getParamFileName(csvFileName)
+        candidates = [(paramFileName, 'METHOD'), (csvFileName, 'METHOD')]
+    else:
+        candidates = [(csvFileName, 'BEGIN')]
+    for (fileName, keyword) in candidates:
+        if not os.path.isfile(fileName):
+            continue
+        for (lineNumber, (value, className)) in readRecords(fileName, (1, 4), [keyword]):
+            if (keyword == 'METHOD') and isMethodDeclaration(value):
+                return os.path.normpath(os.path.join(directory, value))
+            if (keyword == 'BEGIN') and className:
+                return os.path.normpath(os.path.join(directory, "Class." + className + ".php"))
+    return None
+
+def processTask(task, args, manifestEntry):
+    (kind, fileName) = task
+    if kind == 'family':
+        return extractFamilyAttr(args.familiesFolder, fileName, args, manifestEntry)
+    else:
+        return extractWflAttr(args.familiesFolder, fileName, args, manifestEntry)
+
+def groupTasks(tasks, directory):
+    """groups tasks targeting the same method file, so that they are handled by the same process
+        groups are returned in order of their first task
+    """
+    groups = []
+    groupByTarget = {}
+    for task in tasks:
+        target = getTargetFileName(directory, task[0], task[1])
+        if target is None:
+            groups.append([task])
+        elif target in groupByTarget:
+            group = groupByTarget[target]
+            logging.warning("%s is targeted by %s and %s, they will be processed sequentially", target, group[0][1], task[1])
+            group.append(task)
+        else:
+            groupByTarget[target] = [task]
+            groups.append(groupByTarget[target])
+    return groups
+
+class RecordCollector(logging.Handler):
+    """keeps log records so that they can be sent back to the parent process"""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+    def emit(self, record):
+        # args are merged in msg so that the record can be pickled
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+# options of the worker processes, given once to each of them (they hold the family graph with --withInherited)
+workerArgs = None
+
+def initWorker(logLevel, args):
+    global workerArgs
+    workerArgs = args
+    rootLogger = logging.getLogger()
+    for handler in rootLogger.handlers[:]:
+        rootLogger.removeHandler(handler)
+    rootLogger.setLevel(logLevel)
+
+def processGroup(tasks):
+    collector = RecordCollector()
+    logging.getLogger().addHandler(collector)
+    try:
+        entries = []
+        for (task, manifestEntry) in tasks:
+            entries.append((task[1], processTask(task, workerArgs, manifestEntry)))
+    finally:
+        logging.getLogger().removeHandler(collector)
+    diffs = methodDiffs[:]
+    del methodDiffs[:]
+    return (entries, collector.records, diffs)
+
+def processTasks(tasks, args, oldEntries):
+    """processes tasks, in args.jobs processes, and returns their new manifest entries
+        log records of each group are emitted in tasks order
+    """
+    newEntries = {}
+    if args.jobs == 1:
+        for task in tasks:
+            key = os.path.abspath(task[1])
+            entry = processTask(task, args, oldEntries.get(key))
+            if entry:
+                newEntries[key] = entry
+        return newEntries
+
+    import multiprocessing
+    jobs = args.jobs or multiprocessing.cpu_count()
+    groups = groupTasks(tasks, args.familiesFolder)
+    logging.info("processing %s csv files in %s groups with %s processes", len(tasks), len(groups), jobs)
+    pool = multiprocessing.Pool(jobs, initWorker, (logging.getLogger().getEffectiveLevel(), args))
+    try:
+        jobTasks = [[(task, oldEntries.get(os.path.abspath(task[1]))) for task in group] for group in groups]
+        for (entries, records, diffs) in pool.imap(processGroup, jobTasks):
+            for record in records:
+                logging.getLogger().handle(record)
+            methodDiffs.extend(diffs)
+            for (fileName, entry) in entries:
+                if entry:
+                    newEntries[os.path.abspath(fileName)] = entry
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return newEntries
 
-def main():
-    args = parseOptions()
+def main(argv=None):
+    """returns the manifest entries of the processed csv files (abspath -> {inputs, output}), once they are processed"""
+    args = parseOptions(argv)
 
     try:
         logLevel = eval("logging."+args.logLevel)
@@ -217,16 +866,141 @@ def main():
         logging.error("log level fallback to INFO")
 
 
-    if(not args.familyCsvFiles and not args.wflCsvFiles):
-        args.familyCsvFiles = getFamilyFiles(args.familiesFolder)
-        args.wflCsvFiles = getWflFiles(args.familiesFolder)
+    foundFiles = None
+    explicitFiles = bool(args.familyCsvFiles or args.wflCsvFiles)
+    if(not explicitFiles):
+        with phase('scan'):
+            foundFiles = scanFamiliesFolder(args.familiesFolder, getCacheFile(args, 'index'), not args.diff)
+        args.familyCsvFiles = foundFiles['struct']
+        args.wflCsvFiles = foundFiles['wfl']
+        logging.info("found %s family files", len(args.familyCsvFiles))
+        logging.info("found %s workflow files", len(args.wflCsvFiles))
 
-    if(args.familyCsvFiles):
-        for fileName in args.familyCsvFiles:
-            extractFamilyAttr(args.familiesFolder, fileName, args)
-    if(args.wflCsvFiles):
-        for fileName in args.wflCsvFiles:
-            extractWflAttr(args.familiesFolder, fileName, args)
+    args.familyGraph = None
+    if args.withInherited:
+        if foundFiles is None:
+            # parents of the given families are looked for in the families folder
+            with phase('scan'):
+                foundFiles = scanFamiliesFolder(args.familiesFolder, getCacheFile(args, 'index'), not args.diff)
+        with phase('parse'):
+            args.familyGraph = FamilyGraph((args.familyCsvFiles or []) + foundFiles['struct'])
+
+    errorCounter = ErrorCounter()
+    logging.getLogger().addHandler(errorCounter)
+    try:
+        return processCsvFiles(args, explicitFiles, errorCounter)
+    finally:
+        logging.getLogger().removeHandler(errorCounter)
+
+def processCsvFiles(args, explicitFiles, errorCounter):
+    """processes args.familyCsvFiles and args.wflCsvFiles, and returns the saved manifest entries"""
+    manifestFileName = getCacheFile(args, 'manifest')
+    oldEntries = loadManifestEntries(manifestFileName)
+
+    tasks = [('family', fileName) for fileName in (args.familyCsvFiles or [])]
+    tasks += [('wfl', fileName) for fileName in (args.wflCsvFiles or [])]
+    del methodDiffs[:]
+    newEntries = processTasks(tasks, args, oldEntries)
+    if args.diff:
+        # the manifest describes written files, files are only compared to what they would be
+        sys.stdout.write(''.join(methodDiffs))
+        if errorCounter.count:
+            logging.error("%s errors found in csv files", errorCounter.count)
+        if methodDiffs or errorCounter.count:
+            sys.exit(1)
+        return
+    entries = updateManifest(manifestFileName, oldEntries, newEntries, [task[1] for task in tasks])
+    if errorCounter.count:
+        logging.error("%s errors found in csv files", errorCounter.count)
+        if not args.watch:
+            sys.exit(1)
+
+    if args.watch:
+        watchedFiles = None
+        if explicitFiles:
+            # only the files given on the command line are processed again
+            watchedFiles = set(os.path.abspath(task[1]) for task in tasks)
+        watchFamiliesFolder(args, manifestFileName, entries, watchedFiles)
+    return entries
+
+def loadManifestEntries(manifestFileName):
+    if not manifestFileName:
+        return {}
+    manifest = loadJsonFile(manifestFileName, {})
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('entries', {})
+
+def updateManifest(manifestFileName, oldEntries, newEntries, processedFileNames):
+    """saves newEntries, along with the old entries of existing files which were not processed
+        returns the saved entries
+    """
+    entries = dict(newEntries)
+    processedKeys = set(os.path.abspath(fileName) for fileName in processedFileNames)
+    for key in oldEntries:
+        if (key not in processedKeys) and os.path.exists(key):
+            entries[key] = oldEntries[key]
+    if manifestFileName and (entries != oldEntries):
+        try:
+            writeJsonFile(manifestFileName, {'version': MANIFEST_VERSION, 'entries': entries})
+        except (IOError, OSError) as e:
+            logging.warning("could not save manifest %s: %s", manifestFileName, e)
+    return entries
+
+def isWatchedFile(fileName):
+    return classifyFile(os.path.basename(fileName)) in ('struct', 'param', 'wfl')
+
+def getChangedTasks(changedFileNames, args, watchedFiles=None):
+    """returns the tasks to process after changedFileNames changed
+        when args.familyGraph is set, it is updated, and families inheriting from changed ones are processed too
+    """
+    structFileNames = set()
+    wflFileNames = set()
+    for fileName in changedFileNames:
+        kind = classifyFile(os.path.basename(fileName))
+        if kind == 'param':
+            fileName = os.path.join(os.path.dirname(fileName), "STRUCT_" + os.path.basename(fileName)[6:])
+            kind = 'struct'
+        if kind == 'struct':
+            if args.familyGraph:
+                structFileNames.update(os.path.abspath(structFileName) for structFileName in args.familyGraph.updateFamily(fileName))
+            if os.path.isfile(fileName):
+                structFileNames.add(os.path.abspath(fileName))
+        elif (kind == 'wfl') and os.path.isfile(fileName):
+            wflFileNames.add(os.path.abspath(fileName))
+    if watchedFiles is not None:
+        structFileNames &= watchedFiles
+        wflFileNames &= watchedFiles
+    tasks = [('family', fileName) for fileName in sorted(structFileNames)]
+    tasks += [('wfl', fileName) for fileName in sorted(wflFileNames)]
+    return tasks
+
+def watchFamiliesFolder(args, manifestFileName, entries, watchedFiles=None):
+    """processes csv files of args.familiesFolder each time they change, until interrupted
+
+        only STRUCT_, PARAM_ and WFL_ files are watched: written method and class
+        files, as well as the cache folder, never trigger a new run.
+    """
+    import fsWatch
+    excludeDirs = []
+    if manifestFileName:
+        excludeDirs.append(os.path.dirname(manifestFileName))
+    watcher = fsWatch.getWatcher(args.familiesFolder, isWatchedFile, args.watchDelay, excludeDirs)
+    logging.info("watching %s (%s, %ss delay)", args.familiesFolder, watcher.__class__.__name__, watcher.delay)
+    try:
+        while True:
+            changedFileNames = watcher.waitChanges()
+            start = time.time()
+            logging.info("%s csv files changed", len(changedFileNames))
+            with phase('parse'):
+                tasks = getChangedTasks(changedFileNames, args, watchedFiles)
+            newEntries = processTasks(tasks, args, entries)
+            entries = updateManifest(manifestFileName, entries, newEntries, [task[1] for task in tasks])
+            logging.info("%s csv files processed in %.3fs", len(tasks), time.time() - start)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
 if __name__ == "__main__":
-    main()
+    runMain(main)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""waits for changes in a directory tree
+
+changes are read with inotify when pyinotify is available, and by comparing
+mtimes of files otherwise. Both report the paths which changed once no new
+change happened for delay seconds, the same way inosync handles edelay.
+"""
+
+import os
+import abc
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# same default as inosync_conf.emask
+DEFAULT_EVENTS = [
+    "IN_CLOSE_WRITE",
+    "IN_CREATE",
+    "IN_DELETE",
+    "IN_MOVED_FROM",
+    "IN_MOVED_TO",
+]
+
+def getInosyncSetting(name, default):
+    """returns a setting of inosync_conf.py, or default if it is not set"""
+    try:
+        import inosync_conf
+    except ImportError:
+        return default
+    return getattr(inosync_conf, name, default)
+
+class Watcher(object):
+    """base class of watchers: readChanges(timeout) is implemented by each backend
+
+        - accept(path) tells if a changed file (or directory, with inotify) must be reported
+        - excludeDirs are absolute paths of directories whose content is ignored
+        - acceptDir(path), when given, tells if the content of a directory is watched
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, path, accept=None, delay=1, excludeDirs=(), acceptDir=None):
+        self.path = os.path.abspath(path)
+        self.accept = accept
+        self.delay = delay
+        self.excludeDirs = set(os.path.abspath(excludeDir) for excludeDir in excludeDirs)
+        self.acceptDir = acceptDir
+
+    def isExcluded(self, path):
+        for excludeDir in self.excludeDirs:
+            if (path == excludeDir) or path.startswith(excludeDir + os.sep):
+                return True
+        if (self.acceptDir is not None) and (path != self.path) and os.path.isdir(path):
+            return not self.acceptDir(path)
+        return False
+
+    def isAccepted(self, path):
+        return (not self.isExcluded(path)) and ((self.accept is None) or self.accept(path))
+
+    @abc.abstractmethod
+    def readChanges(self, timeout):
+        """returns the accepted paths changed since last call, waiting at most timeout seconds (None waits forever)"""
+
+    def waitChanges(self):
+        """waits for changes, and returns the changed paths once none happened for delay seconds"""
+        changes = set()
+        while not changes:
+            changes.update(self.readChanges(None))
+        while True:
+            newChanges = self.readChanges(self.delay)
+            if not newChanges:
+                return changes
+            changes.update(newChanges)
+
+    def close(self):
+        pass
+
+class PollingWatcher(Watcher):
+    """finds changes by comparing (mtime, size) of accepted files every interval seconds
+
+        every poll stats each watched directory and accepted file, but only lists
+        the directories whose mtime changed (a file was added, removed or renamed)
+    """
+    def __init__(self, path, accept=None, delay=1, excludeDirs=(), acceptDir=None, interval=0.5):
+        Watcher.__init__(self, path, accept, delay, excludeDirs, acceptDir)
+        self.interval = interval
+        # directory -> (mtime, time of the listing, watched sub directories, accepted files)
+        self.directories = {}
+        self.snapshot = self.takeSnapshot()
+
+    def listDirectory(self, directory, mtime):
+        """returns the listing of directory, as kept in self.directories, or None if it cannot be listed"""
+        listedAt = time.time()
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return None
+        (subDirs, files) = ([], [])
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                # same as os.walk: links to directories are not followed
+                if (not os.path.islink(path)) and (not self.isExcluded(path)):
+                    subDirs.append(path)
+            elif self.isAccepted(path):
+                files.append(path)
+        return (mtime, listedAt, subDirs, files)
+
+    def takeSnapshot(self):
+        snapshot = {}
+        directories = {}
+        pending = [self.path]
+        while pending:
+            directory = pending.pop()
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+            listing = self.directories.get(directory)
+            # a directory changed in the second it was listed may have the same mtime again
+            if (listing is None) or (listing[0] != mtime) or (mtime >= listing[1] - 1):
+                listing = self.listDirectory(directory, mtime)
+                if listing is None:
+                    continue
+            directories[directory] = listing
+            pending.extend(listing[2])
+            for filePath in listing[3]:
+                try:
+                    fileStat = os.stat(filePath)
+                except OSError:
+                    continue
+                snapshot[filePath] = (fileStat.st_mtime, fileStat.st_size)
+        self.directories = directories
+        return snapshot
+
+    def readChanges(self, timeout):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            snapshot = self.takeSnapshot()
+            changes = set(filePath for filePath in set(snapshot) | set(self.snapshot)
+                if snapshot.get(filePath) != self.snapshot.get(filePath))
+            self.snapshot = snapshot
+            if changes:
+                return changes
+            if deadline is None:
+                time.sleep(self.interval)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return changes
+                time.sleep(min(self.interval, remaining))
+
+class InotifyWatcher(Watcher):
+    """reads changes from inotify events (see inosync_conf.emask)"""
+    def __init__(self, path, accept=None, delay=1, excludeDirs=(), acceptDir=None, events=None):
+        Watcher.__init__(self, path, accept, delay, excludeDirs, acceptDir)
+        if events is None:
+            events = getInosyncSetting('emask', DEFAULT_EVENTS)
+        mask = 0
+        for event in events:
+            mask |= pyinotify.EventsCodes.ALL_FLAGS[event]
+        # new directories must be seen to be watched
+        mask |= pyinotify.IN_CREATE
+        self.changes = set()
+        watcher = self
+        class EventHandler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                # directories are reported too, since files moved with them do not have events
+                if watcher.isAccepted(event.pathname):
+                    watcher.changes.add(event.pathname)
+        self.watchManager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.watchManager, EventHandler())
+        self.watchManager.add_watch(self.path, mask, rec=True, auto_add=True, exclude_filter=self.isExcluded)
+
+    def readChanges(self, timeout):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        # events of files which are not accepted must not end the wait
+        while not self.changes:
+            remaining = None
+            if deadline is not None:
+                remaining = int((deadline - time.time()) * 1000)
+                if remaining <= 0:
+                    break
+            if self.notifier.check_events(remaining):
+                self.notifier.read_events()
+                self.notifier.process_events()
+        changes = self.changes
+        self.changes = set()
+        return changes
+
+    def close(self):
+        self.notifier.stop()
+
+def getWatcher(path, accept=None, delay=None, excludeDirs=(), acceptDir=None):
+    """returns an inotify watcher if pyinotify is available, a polling one otherwise
+        delay defaults to inosync_conf.edelay
+    """
+    if delay is None:
+        delay = getInosyncSetting('edelay', 1)
+    if pyinotify is not None:
+        return InotifyWatcher(path, accept, delay, excludeDirs, acceptDir)
+    return PollingWatcher(path, accept, delay, excludeDirs, acceptDir)
@@ -5,18 +5,21 @@ from string import Template
 import sys
 import os.path
 
-from generateWorkflow import generateWorkflow,getWflMemo
-
 if sys.version_info < (2, 7):
     raise "must use python 2.7 or greater"
 import argparse
 
-def parseOptions():
+from templateRegistry import getRegistry
+from utils import checkOverwrittenFiles, loadManifestRows, printDiff
+from instrument import runMain
+
+def parseOptions(argv=None):
     argParser = argparse.ArgumentParser(
         description='Generate Family files. (requires python >= 2.7)'
     )
     argParser.add_argument('familyName',
-        help = 'family logical name')
+        help = 'family logical name',
+        nargs = '?')
     argParser.add_argument('-f', '--fromName',
         help = 'family parent name',
         dest = 'fromName',
@@ -42,92 +45,220 @@ def parseOptions():
         action = 'store_true',
         dest = 'withWorkflow',
         default = False)
-    args = argParser.parse_args()
-    if(not args.familyTitle):
-        args.familyTitle = "title for %s"%(args.familyName.upper())
+    argParser.add_argument('--diff',
+        help = 'do not write anything, but print a unified diff of the files which would be generated (the exit code is 1 if one would change)',
+        action = 'store_true',
+        dest = 'diff',
+        default = False)
+    argParser.add_argument('-m', '--manifest',
+        help = 'generate all the families listed in this csv (with a name;parent;title;withWorkflow header) or json (list of objects with the same keys) file',
+        dest = 'manifestFile')
+    argParser.add_argument('--memoFile',
+        help = 'with --manifest, write the info.xml processes importing the generated families in this file rather than on the standard output',
+        dest = 'memoFile')
+    args = argParser.parse_args(argv)
+    if(bool(args.familyName) == bool(args.manifestFile)):
+        argParser.error('give either a familyName or a --manifest')
+    if(args.familyName and not args.familyTitle):
+        args.familyTitle = getDefaultTitle(args.familyName)
     return args
 
-def getStructMemo(templateValues):
-    importStr = """
+def getDefaultTitle(familyName):
+    return "title for %s"%(familyName.upper())
+
+structMemoTemplate = Template("""
     <process command="./wsh.php --api=importDocuments --file=./@APPNAME@/${familyName}_STRUCT.csv">
         <label lang="en">importing ${familyName}_STRUCT.csv</label>
-    </process>"""
-    return Template(importStr).safe_substitute(familyName = templateValues['familyName'].lower())
+    </process>""")
 
-def getParamMemo(templateValues):
-    importStr = """
+def getStructMemo(templateValues):
+    return structMemoTemplate.safe_substitute(familyName = templateValues['familyName'].lower())
+
+paramMemoTemplate = Template("""
     <process command="./wsh.php --api=importDocuments --file=./@APPNAME@/${familyName}_PARAM.csv">
         <label lang="en">importing ${familyName}_PARAM.csv</label>
-    </process>"""
-    return Template(importStr).safe_substitute(familyName = templateValues['familyName'].lower())
+    </process>""")
 
-def generateFamily(templateValues, args):
-    targetsPath ={
-        'csvStruct': os.path.join(args.targetDir, "%s_STRUCT.csv"%(args.familyName.lower())),
-        'csvParam' : os.path.join(args.targetDir, "%s_PARAM.csv"%(args.familyName.lower())),
-        'phpMethod': os.path.join(args.targetDir, templateValues['familyMethod'])
-    }
+def getParamMemo(templateValues):
+    return paramMemoTemplate.safe_substitute(familyName = templateValues['familyName'].lower())
 
-    if(not args.force):
-        overwrittenFiles = 0
-        for targetPath in targetsPath:
-            if(os.path.exists(targetsPath[targetPath])):
-                overwrittenFiles += 1
-                print "existingt file %s would be overwritten. please use --force to allow this"%(targetsPath[targetPath])
-        if(overwrittenFiles > 0):
-            raise NameError("overwriting %s files"%(overwrittenFiles))
-
-    templateFilesPath ={
-        'csvStruct': os.path.join(args.templateDir, "STRUCT_family.csv.template"),
-        'csvParam' : os.path.join(args.templateDir, "PARAM_family.csv.template"),
-        'phpMethod': os.path.join(args.templateDir, "Method.family.php.template")
+def getFamilyTargets(templateValues, targetDir):
+    return {
+        'csvStruct': os.path.join(targetDir, "%s_STRUCT.csv"%(templateValues['familyName'].lower())),
+        'csvParam' : os.path.join(targetDir, "%s_PARAM.csv"%(templateValues['familyName'].lower())),
+        'phpMethod': os.path.join(targetDir, templateValues['familyMethod'])
     }
 
-    templates = {}
-    for fileDesignation in templateFilesPath:
-        templates[fileDesignation] = Template(open(templateFilesPath[fileDesignation]).read())
+def generateFamily(templateValues, args):
+    """writes the family files, or prints their diff with args.diff
+        returns the number of files which changed (or would change)
+    """
+    targetsPath = getFamilyTargets(templateValues, args.targetDir)
 
+    if(not (args.force or args.diff)):
+        checkOverwrittenFiles(targetsPath.values())
+
+    templateNames ={
+        'csvStruct': "STRUCT_family.csv.template",
+        'csvParam' : "PARAM_family.csv.template",
+        'phpMethod': "Method.family.php.template"
+    }
+
+    changedFiles = 0
+    registry = getRegistry(args.templateDir)
     for target in targetsPath:
-        if templateFilesPath.has_key(target):
-            template = Template(open(templateFilesPath[target]).read())
-            targetString = template.safe_substitute(templateValues)
+        if templateNames.has_key(target):
+            targetString = registry.substitute(templateNames[target], templateValues)
+            if(args.diff):
+                changedFiles += printDiff(targetsPath[target], targetString)
+                continue
             targetFile = open(targetsPath[target], 'w')
             targetFile.write(targetString)
             targetFile.close()
+            changedFiles += 1
         else:
             print "no template found for %s"%(target)
+    return changedFiles
 
-def main():
-    args = parseOptions()
-
+def getTemplateValues(familyName, fromName, familyTitle):
     templateValues = {
-        'familyTitle'    : args.familyTitle,
-        'familyIcon'     : "%s.png"%(args.familyName.lower()),
-        'familyMethod'   : "Method.%s.php"%(args.familyName.lower()),
-        'familyDFLID'    : "FLD_%s"%(args.familyName.upper()),
-        'familyName'     : args.familyName.upper(),
-        'familyClass'    : args.familyName.upper(),
-        'fromName'       : args.fromName.upper(),
-        'fromClass'      : args.fromName
+        'familyTitle'    : familyTitle,
+        'familyIcon'     : "%s.png"%(familyName.lower()),
+        'familyMethod'   : "Method.%s.php"%(familyName.lower()),
+        'familyDFLID'    : "FLD_%s"%(familyName.upper()),
+        'familyName'     : familyName.upper(),
+        'familyClass'    : familyName.upper(),
+        'fromName'       : fromName.upper(),
+        'fromClass'      : fromName
     }
-    if(args.fromName):
-        templateValues['fromName'] = args.fromName.upper()
-        templateValues['fromClass'] = '_' + args.fromName
+    if(fromName):
+        templateValues['fromName'] = fromName.upper()
+        templateValues['fromClass'] = '_' + fromName
     else:
         templateValues['fromName'] = ''
-        templateValues['fromClass'] = Doc
+        templateValues['fromClass'] = 'Doc'
+    return templateValues
+
+def getMemo(templateValues, withWorkflow):
+    """returns the info.xml processes importing the files of a family"""
+    memo = getStructMemo(templateValues)
+    if(withWorkflow):
+        from generateWorkflow import getWflMemo
+        memo += getWflMemo(templateValues)
+    return memo + getParamMemo(templateValues)
+
+def isTrue(value):
+    if isinstance(value, basestring):
+        return value.strip().lower() in ('1', 'y', 'yes', 'true', 'x')
+    return bool(value)
+
+def loadManifest(manifestFile):
+    """returns the families ({name, parent, title, withWorkflow}) listed in a csv or json manifest"""
+    families = []
+    for entry in loadManifestRows(manifestFile):
+        if not entry.get('name'):
+            raise NameError("%s: each family needs a name (%r)"%(manifestFile, entry))
+        families.append({
+            'name'        : entry['name'],
+            'parent'      : entry.get('parent') or '',
+            'title'       : entry.get('title') or getDefaultTitle(entry['name']),
+            'withWorkflow': isTrue(entry.get('withWorkflow', False))
+        })
+    return families
+
+def sortByInheritance(families):
+    """returns families ordered so that a family comes after its parent when the parent is also listed
+        (manifest order is kept otherwise)
+    """
+    familiesByName = {}
+    for family in families:
+        familyName = family['name'].upper()
+        if familyName in familiesByName:
+            raise NameError("family %s is listed twice"%(familyName))
+        familiesByName[familyName] = family
+    sortedFamilies = []
+    # family name -> True once sorted, False while its parents are being sorted
+    visited = {}
+    for family in families:
+        path = []
+        while family is not None:
+            familyName = family['name'].upper()
+            if visited.get(familyName) is False:
+                raise NameError("inheritance cycle: %s"%(' -> '.join(path[path.index(familyName):] + [familyName])))
+            if familyName in visited:
+                break
+            visited[familyName] = False
+            path.append(familyName)
+            family = familiesByName.get(family['parent'].upper())
+        for familyName in reversed(path):
+            visited[familyName] = True
+            sortedFamilies.append(familiesByName[familyName])
+    return sortedFamilies
+
+def generateFamilies(families, args):
+    """generates all families, after checking that none of their files would be overwritten
+        returns (the info.xml processes importing them in inheritance order, the number of files which changed)
+    """
+    families = sortByInheritance(families)
+    generated = []
+    targetsPaths = []
+    for family in families:
+        templateValues = getTemplateValues(family['name'], family['parent'], family['title'])
+        generated.append((family, templateValues))
+        targetsPaths.extend(getFamilyTargets(templateValues, args.targetDir).values())
+        if(family['withWorkflow']):
+            from generateWorkflow import getWorkflowTargets
+            targetsPaths.extend(getWorkflowTargets(dict(templateValues), args.targetDir).values())
+    if(not (args.force or args.diff)):
+        checkOverwrittenFiles(targetsPaths)
+
+    # pre-checks are done, generated files would not be checked again
+    familyArgs = argparse.Namespace(**vars(args))
+    familyArgs.force = True
+    memos = []
+    changedFiles = 0
+    for (family, templateValues) in generated:
+        changedFiles += generateFamily(templateValues, familyArgs)
+        if(family['withWorkflow']):
+            from generateWorkflow import generateWorkflow
+            changedFiles += generateWorkflow(templateValues, familyArgs)
+        memos.append(getMemo(templateValues, family['withWorkflow']))
+    return (''.join(memos), changedFiles)
+
+def main(argv=None):
+    """returns the info.xml processes importing the generated families"""
+    args = parseOptions(argv)
 
     try:
-        generateFamily(templateValues, args)
+        if(args.manifestFile):
+            (memo, changedFiles) = generateFamilies(loadManifest(args.manifestFile), args)
+            if(args.diff):
+                sys.exit(1 if changedFiles else 0)
+            if(args.memoFile):
+                memoFile = open(args.memoFile, 'w')
+                memoFile.write(memo + "\n")
+                memoFile.close()
+            else:
+                print(memo)
+            return memo
+
+        templateValues = getTemplateValues(args.familyName, args.fromName, args.familyTitle)
+        changedFiles = generateFamily(templateValues, args)
         if(args.withWorkflow):
-            generateWorkflow(templateValues, args)
+            # the workflow module is only loaded when a workflow is generated
+            from generateWorkflow import generateWorkflow, getWflMemo
+            changedFiles += generateWorkflow(templateValues, args)
+        if(args.diff):
+            sys.exit(1 if changedFiles else 0)
         print(getStructMemo(templateValues))
         if(args.withWorkflow):
             print(getWflMemo(templateValues))
         print(getParamMemo(templateValues))
-    except NameError:
-        return
+        return getMemo(templateValues, args.withWorkflow)
+    except NameError, error:
+        print >> sys.stderr, error
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    runMain(main)
     print ""
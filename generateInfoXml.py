@@ -1,17 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
-import codecs
-import xml.dom, xml.dom.minidom
 import os
-from StringIO import StringIO
 import sys
 
+from instrument import phase, runMain
+from utils import makedirs, loadJsonFile, createTempFileFor, commitTempFile, printDiff, FileCache
+import infoXmlEngine
+
 if sys.version_info < (2, 7):
     raise "must use python 2.7 or greater"
 import argparse
 
 def toprettyxml_fixed (node, encoding='utf-8'):
+    from StringIO import StringIO
     tmpStream = StringIO()
     tmpStream.write(node.toxml())
     return tmpStream.getvalue()
@@ -27,7 +29,7 @@ def addTarget(node, targetNode):
     localNode = node.ownerDocument.importNode(targetNode, True)
     node.appendChild(localNode.cloneNode(True))
 
-def parseOptions():
+def parseOptions(argv=None):
     argParser = argparse.ArgumentParser(description='Generate info.xml file from targets. (requires PyXML and python >= 2.7)')
     argParser.add_argument('--template',
         help = 'info.xml template',
@@ -44,11 +46,33 @@ def parseOptions():
         action = 'append',
         dest = 'phases',
         metavar = 'phases')
+    argParser.add_argument('--engine',
+        help = 'stream uses a single indexed parse of targets and a streamed output, dom uses xml.dom.minidom (both produce the same document)',
+        choices = ['stream', 'dom'],
+        default = 'stream',
+        dest = 'engine')
+    argParser.add_argument('--batch',
+        help = 'json manifest listing the documents to generate, as objects with "targetIds" and "output" keys, and optional "template", "targets" and "phases" keys (defaulting to the options); relative paths are relative to the manifest',
+        dest = 'batchFile',
+        metavar = 'manifest.json')
+    argParser.add_argument('-o', '--output',
+        help = 'write the document in this file rather than on the standard output',
+        dest = 'outputFile',
+        metavar = 'info.xml')
+    argParser.add_argument('--diff',
+        help = 'do not write anything, but print a unified diff of the --output file or of the --batch documents which would change (the exit code is 1 if one would)',
+        action = 'store_true',
+        dest = 'diff',
+        default = False)
     argParser.add_argument('targetIds',
         help = 'target to include in produced file (use several times to add multiple targets',
         nargs = '*',
         metavar = 'targetId')
-    args = argParser.parse_args()
+    args = argParser.parse_args(argv)
+    if(args.diff and not (args.outputFile or args.batchFile)):
+        argParser.error('--diff needs an --output file or a --batch manifest')
+    if(args.outputFile and not (args.targetIds or args.batchFile)):
+        argParser.error('--output needs targetIds')
     if(not args.phases):
         #args.phases = ['pre-install', 'post-install', 'pre-upgrade', 'post-upgrade']
         args.phases = ['post-install', 'post-upgrade']
@@ -67,6 +91,19 @@ def listTargets(targetsDom):
 
     return(0)
 
+def listIndexedTargets(targets):
+    print 'available targets are :'
+    for target in targets.iterTargets():
+        print("\t- %s (%s)"%(target.get('id', ''), target.get('label', '')))
+
+    print 'available profiles are :'
+    for profile in targets.iterProfiles():
+        print("\t- %s (%s)"%(profile.get('id', ''), profile.get('label', '')))
+        for refTarget in profile.iter('refTarget'):
+            print("\t\t- %s"%(refTarget.get('targetId', '')))
+
+    return(0)
+
 def getNodes(document, phases):
     nodes = {}
     for phase in phases:
@@ -78,63 +115,193 @@ def getNodes(document, phases):
             nodes[phase] = document.documentElement.appendChild(document.createElement(phase))
     return nodes
 
-def appendTarget(nodes, targetNode, phases, targetsFile, visitedProfileIds):
-    if(targetNode.nodeName == 'profile'):
-        currentProfileId = targetNode.getAttribute('id')
-        if(currentProfileId in visitedProfileIds):
-            print >> sys.stderr, "profile %s#%s skipped because it is already inserted"%(targetsFile,currentProfileId)
-        else:
-            visitedProfileIds.append(currentProfileId)
-            for refTarget in targetNode.getElementsByTagName('refTarget'):
-                refTargetId = refTarget.getAttribute('targetId')
-                refTargetNode = targetNode.ownerDocument.getElementById(refTargetId)
-                if(not refTargetNode):
-                    raise NameError('There is no target with this id: %s#%s'%(targetsFile,refTargetId))
-                appendTarget(nodes, refTargetNode, phases, targetsFile, visitedProfileIds)
-    else:
-        useFor = targetNode.getAttribute('usefor')
-        if(not useFor):
-            useFor = phases
-        for phase in phases:
-            if(phase in useFor):
-                commentNode = nodes[phase].ownerDocument.createComment('generated from target %s#%s (%s)'%(targetsFile, targetNode.getAttribute('id'), targetNode.getAttribute('label')))
-                nodes[phase].appendChild(commentNode)
-                for process in targetNode.childNodes:
-                    localNode = nodes[phase].ownerDocument.importNode(process, True)
-                    nodes[phase].appendChild(localNode)
-
-def generateInfoXml(targetsFile, infoXmlFile, targetIds, phases):
-    targetsDom = xml.dom.minidom.parse(targetsFile)
+def getDomResolver(targetsDom, targetsFile):
+    return infoXmlEngine.TargetsResolver(targetsFile,
+        lambda targetId: targetsDom.getElementById(targetId) or None,
+        lambda node: node.nodeName == 'profile',
+        lambda node: [refTarget.getAttribute('targetId') for refTarget in node.getElementsByTagName('refTarget')])
+
+# parsed targets and templates, kept while their files do not change (only useful to a long-lived process)
+parsedFiles = FileCache()
+
+def loadTargets(targetsFile, engine='stream'):
+    """returns the targets of targetsFile, as an infoXmlEngine.Targets or a resolver of its dom"""
+    if engine == 'stream':
+        return parsedFiles.get([targetsFile], lambda: infoXmlEngine.Targets(targetsFile), 'stream')
+    import xml.dom.minidom
+    targetsDom = parsedFiles.get([targetsFile], lambda: xml.dom.minidom.parse(targetsFile), 'dom')
+    return getDomResolver(targetsDom, targetsFile)
+
+def loadTemplate(infoXmlFile):
+    """returns the infoXmlEngine.Template of infoXmlFile (the dom engine modifies its template, which is not kept)"""
+    return parsedFiles.get([infoXmlFile], lambda: infoXmlEngine.Template(infoXmlFile), 'stream')
+
+def appendTarget(nodes, targetNode, phases, targetsFile):
+    useFor = targetNode.getAttribute('usefor')
+    if(not useFor):
+        useFor = phases
+    for phase in phases:
+        if(phase in useFor):
+            commentNode = nodes[phase].ownerDocument.createComment('generated from target %s#%s (%s)'%(targetsFile, targetNode.getAttribute('id'), targetNode.getAttribute('label')))
+            nodes[phase].appendChild(commentNode)
+            for process in targetNode.childNodes:
+                localNode = nodes[phase].ownerDocument.importNode(process, True)
+                nodes[phase].appendChild(localNode)
+
+def generateInfoXml(targetsFile, infoXmlFile, targetIds, phases, engine='stream'):
+    if engine == 'stream':
+        return generateInfoXmlStream(targetsFile, infoXmlFile, targetIds, phases)
+
+    # only the dom engine needs minidom
+    import xml.dom.minidom
+
+    with phase('parse'):
+        targetsDom = parsedFiles.get([targetsFile], lambda: xml.dom.minidom.parse(targetsFile), 'dom')
 
     if(len(targetIds) == 0):
         return listTargets(targetsDom)
 
-    infoXmlDom = xml.dom.minidom.parse(infoXmlFile)
+    with phase('parse'):
+        infoXmlDom = xml.dom.minidom.parse(infoXmlFile)
 
-    nodes = getNodes(infoXmlDom, phases)
+    return renderInfoXmlDom(infoXmlDom, getDomResolver(targetsDom, targetsFile), targetsFile, targetIds, phases)
 
-    for targetId in targetIds:
-        visitedProfileIds = [] #avoid infinite loops
-        targetNode = targetsDom.getElementById(targetId)
-        if(not targetNode):
-            raise NameError('There is no target with this id: %s#%s'%(targetsFile,targetId))
+def renderInfoXmlDom(infoXmlDom, resolver, targetsFile, targetIds, phases):
+    with phase('generate'):
+        nodes = getNodes(infoXmlDom, phases)
 
-        appendTarget(nodes, targetNode, phases, targetsFile, visitedProfileIds)
+        for targetId in targetIds:
+            for targetNode in resolver.resolve(targetId):
+                appendTarget(nodes, targetNode, phases, targetsFile)
+
+    with phase('write'):
+        return toprettyxml_fixed(infoXmlDom)
+
+def generateInfoXmlStream(targetsFile, infoXmlFile, targetIds, phases):
+    with phase('parse'):
+        targets = loadTargets(targetsFile)
+
+    if(len(targetIds) == 0):
+        return listIndexedTargets(targets)
+
+    with phase('parse'):
+        template = loadTemplate(infoXmlFile)
+
+    with phase('generate'):
+        return infoXmlEngine.renderInfoXml(template, targets, targetIds, phases)
+
+def loadBatch(batchFile, args):
+    """returns the list of documents described in batchFile, with their paths and defaults resolved"""
+    entries = loadJsonFile(batchFile)
+    if not isinstance(entries, list):
+        raise NameError('%s is not a json list of documents'%(batchFile))
+    baseDir = os.path.dirname(os.path.abspath(batchFile))
+    documents = []
+    for entry in entries:
+        if (not isinstance(entry, dict)) or (not entry.get('targetIds')) or (not entry.get('output')):
+            raise NameError('%s: each document needs "targetIds" and "output" (%r)'%(batchFile, entry))
+        targetIds = entry['targetIds']
+        if isinstance(targetIds, basestring):
+            targetIds = [targetIds]
+        phases = entry.get('phases') or args.phases
+        if isinstance(phases, basestring):
+            phases = [phases]
+        documents.append({
+            'template': os.path.normpath(os.path.join(baseDir, entry.get('template', args.infoXmlFile))),
+            'targets': os.path.normpath(os.path.join(baseDir, entry.get('targets', args.targetsFile))),
+            'targetIds': targetIds,
+            'phases': phases,
+            'output': os.path.normpath(os.path.join(baseDir, entry['output']))
+        })
+    return documents
+
+def getInfoXmlContent(xmlString):
+    """returns the content of an info.xml file, the way main prints it"""
+    return xmlString.encode('utf-8') + '\n'
+
+def writeInfoXml(outputFile, xmlString):
+    """writes xmlString the way main prints it, through a temp file renamed into place"""
+    with phase('write'):
+        makedirs(os.path.dirname(outputFile))
+        (tmpFile, tmpFileName) = createTempFileFor(outputFile)
+        tmpFile.write(getInfoXmlContent(xmlString))
+        commitTempFile(tmpFile, tmpFileName, outputFile)
+
+def diffInfoXml(outputFile, xmlString):
+    """prints the diff from outputFile to xmlString, and returns True if there is one"""
+    with phase('diff'):
+        return printDiff(outputFile, getInfoXmlContent(xmlString))
+
+def generateBatch(documents, engine='stream', diff=False):
+    """generates every document, parsing each targets and template file only once
+        with diff, documents are not written but compared to their output, and the number of documents which would change is returned
+    """
+    changedDocuments = 0
+    if engine != 'stream':
+        import xml.dom.minidom
+    targetsCache = {}
+    templatesCache = {}
+    for document in documents:
+        targetsFile = document['targets']
+        infoXmlFile = document['template']
+        if targetsFile not in targetsCache:
+            with phase('parse'):
+                targetsCache[targetsFile] = loadTargets(targetsFile, engine)
+        if infoXmlFile not in templatesCache:
+            with phase('parse'):
+                if engine == 'stream':
+                    templatesCache[infoXmlFile] = loadTemplate(infoXmlFile)
+                else:
+                    # the dom is modified by the rendering, only its source is kept
+                    templatesCache[infoXmlFile] = open(infoXmlFile, 'rb').read()
+        if engine == 'stream':
+            with phase('generate'):
+                xmlString = infoXmlEngine.renderInfoXml(templatesCache[infoXmlFile], targetsCache[targetsFile], document['targetIds'], document['phases'])
+        else:
+            with phase('parse'):
+                infoXmlDom = xml.dom.minidom.parseString(templatesCache[infoXmlFile])
+            xmlString = renderInfoXmlDom(infoXmlDom, targetsCache[targetsFile], targetsFile, document['targetIds'], document['phases'])
+        if diff:
+            changedDocuments += diffInfoXml(document['output'], xmlString)
+            continue
+        writeInfoXml(document['output'], xmlString)
+        print >> sys.stderr, "%s generated"%(document['output'])
+    return changedDocuments
+
+def main(argv=None):
+    """returns the generated document, or the output files of the --batch documents"""
+    args = parseOptions(argv)
+    # unknown targets, profile cycles and invalid batch files are reported without a traceback
+    try:
+        if args.batchFile:
+            documents = loadBatch(args.batchFile, args)
+            changedDocuments = generateBatch(documents, args.engine, args.diff)
+        else:
+            xmlString =  generateInfoXml(args.targetsFile, args.infoXmlFile, args.targetIds, args.phases, args.engine)
+    except NameError as e:
+        print >> sys.stderr, e
+        sys.exit(1)
 
-    return toprettyxml_fixed(infoXmlDom)
+    if args.batchFile:
+        if args.diff:
+            sys.exit(1 if changedDocuments else 0)
+        return [document['output'] for document in documents]
 
-def main():
-    args = parseOptions()
-    xmlString =  generateInfoXml(args.targetsFile, args.infoXmlFile, args.targetIds, args.phases)
 
-    # Console setting to handle UTF-8 characters
-    reload(sys)
-    sys.setdefaultencoding('utf-8')
-    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
-    sys.stderr = codecs.getwriter('utf8')(sys.stderr)
+    if args.diff:
+        sys.exit(1 if diffInfoXml(args.outputFile, xmlString) else 0)
+    if args.outputFile:
+        writeInfoXml(args.outputFile, xmlString)
+        return xmlString
 
-    print xmlString
+    # utf-8 is written whatever the console encoding is
+    # (without reloading sys, which would reset the streams of a caller capturing them, see devTools.py)
+    output = xmlString
+    if isinstance(output, unicode):
+        output = output.encode('utf-8')
+    print output
+    return xmlString
 
 
 if __name__ == "__main__":
-    main()
+    runMain(main)
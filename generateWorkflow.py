@@ -9,7 +9,11 @@ if sys.version_info < (2, 7):
     raise "must use python 2.7 or greater"
 import argparse
 
-def parseOptions():
+from templateRegistry import getRegistry
+from utils import checkOverwrittenFiles, printDiff
+from instrument import runMain
+
+def parseOptions(argv=None):
     argParser = argparse.ArgumentParser(
         description='Generate workflow. (requires python >= 2.7)'
     )
@@ -29,66 +33,79 @@ def parseOptions():
         action = 'store_true',
         dest = 'force',
         default = False)
-    args = argParser.parse_args()
+    argParser.add_argument('--diff',
+        help = 'do not write anything, but print a unified diff of the files which would be generated (the exit code is 1 if one would change)',
+        action = 'store_true',
+        dest = 'diff',
+        default = False)
+    args = argParser.parse_args(argv)
     if(not args.familyName):
         args.familyName = raw_input("Give me your logical Name : ")
     return args
 
-def getWflMemo(templateValues):
-    importStr = """
+wflMemoTemplate = Template("""
     <process command="./wsh.php --api=importDocuments --file=./@APPNAME@/${familyName}_WFL.csv">
         <label lang="en">importing ${familyName}_WFL.csv</label>
-    </process>"""
-    return Template(importStr).safe_substitute(familyName = templateValues['familyName'].lower())
+    </process>""")
 
-def generateWorkflow(templateValues, args):
+def getWflMemo(templateValues):
+    return wflMemoTemplate.safe_substitute(familyName = templateValues['familyName'].lower())
+
+def getWorkflowTargets(templateValues, targetDir):
     templateValues['workflowName'] = "%s_WFL"%(templateValues['familyName'].upper())
-    targetsPath ={
-        'wflCsv': os.path.join(args.targetDir, "%s_WFL.csv"%(args.familyName.lower())),
-        'wflPhp': os.path.join(args.targetDir, "Class.%s.php"%(templateValues['workflowName']))
+    return {
+        'wflCsv': os.path.join(targetDir, "%s_WFL.csv"%(templateValues['familyName'].lower())),
+        'wflPhp': os.path.join(targetDir, "Class.%s.php"%(templateValues['workflowName']))
     }
 
-    if(not args.force):
-        overwrittenFiles = 0
-        for targetPath in targetsPath:
-            if(os.path.exists(targetsPath[targetPath])):
-                overwrittenFiles += 1
-                print "existingt file %s would be overwritten. please use --force to allow this"%(targetsPath[targetPath])
-        if(overwrittenFiles > 0):
-            raise NameError("overwriting %s files"%(overwrittenFiles))
+def generateWorkflow(templateValues, args):
+    """writes the workflow files, or prints their diff with args.diff
+        returns the number of files which changed (or would change)
+    """
+    targetsPath = getWorkflowTargets(templateValues, args.targetDir)
 
-    templateFilesPath ={
-        'wflCsv': os.path.join(args.templateDir, "WFL_workflow.csv.template"),
-        'wflPhp' : os.path.join(args.templateDir, "Class.workflow.php.template")
-    }
+    if(not (args.force or args.diff)):
+        checkOverwrittenFiles(targetsPath.values())
 
-    templates = {}
-    for fileDesignation in templateFilesPath:
-        templates[fileDesignation] = Template(open(templateFilesPath[fileDesignation]).read())
+    templateNames ={
+        'wflCsv': "WFL_workflow.csv.template",
+        'wflPhp' : "Class.workflow.php.template"
+    }
 
+    changedFiles = 0
+    registry = getRegistry(args.templateDir)
     for target in targetsPath:
-        if templateFilesPath.has_key(target):
-            template = Template(open(templateFilesPath[target]).read())
-            targetString = template.safe_substitute(templateValues)
+        if templateNames.has_key(target):
+            targetString = registry.substitute(templateNames[target], templateValues)
+            if(args.diff):
+                changedFiles += printDiff(targetsPath[target], targetString)
+                continue
             targetFile = open(targetsPath[target], 'w')
             targetFile.write(targetString)
             targetFile.close()
+            changedFiles += 1
         else:
             print "no template found for %s"%(target)
+    return changedFiles
 
-def main():
-    args = parseOptions()
+def main(argv=None):
+    """returns the info.xml process importing the workflow"""
+    args = parseOptions(argv)
 
     templateValues = {
         'familyName' : args.familyName.upper()
     }
 
     try:
-        generateWorkflow(templateValues, args)
+        changedFiles = generateWorkflow(templateValues, args)
+        if(args.diff):
+            sys.exit(1 if changedFiles else 0)
         print(getWflMemo(templateValues))
-    except NameError:
-        return
+        return getWflMemo(templateValues)
+    except NameError, error:
+        print >> sys.stderr, error
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    runMain(main)
     print ""
\ No newline at end of file
@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""streaming engine for generateInfoXml
+
+targets.xml is parsed once into an ElementTree indexed by id, and info.xml.in
+is parsed once into a list of serialized tokens. The output document is then
+written token by token, with target contents spliced in the phase elements.
+Serialization follows xml.dom.minidom toxml() so that the output is the same
+as the dom engine of generateInfoXml.
+"""
+
+import sys
+import xml.parsers.expat
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+# tags of the special nodes kept in the tree
+def Comment():
+    pass
+
+def ProcessingInstruction():
+    pass
+
+def CData():
+    pass
+
+def escapeData(data):
+    """same escaping as xml.dom.minidom, for text and attribute values"""
+    return data.replace(u"&", u"&amp;").replace(u"<", u"&lt;").replace(u"\"", u"&quot;").replace(u">", u"&gt;")
+
+def serializeStartTag(tag, attributes):
+    """returns the start tag, without its closing '>' or '/>'"""
+    startTag = [u"<", tag]
+    for name in sorted(attributes.keys()):
+        startTag.append(u" %s=\"%s\""%(name, escapeData(attributes[name])))
+    return u''.join(startTag)
+
+def serializeComment(data):
+    if u"--" in data:
+        raise ValueError("'--' is not allowed in a comment node")
+    return u"<!--%s-->"%(data)
+
+def serializeNode(node, write):
+    if node.tag is Comment:
+        write(serializeComment(node.text))
+    elif node.tag is ProcessingInstruction:
+        write(u"<?%s?>"%(node.text))
+    elif node.tag is CData:
+        write(u"<![CDATA[%s]]>"%(node.text))
+    else:
+        write(serializeStartTag(node.tag, node.attrib))
+        if node.text or len(node):
+            write(u">")
+            serializeChildren(node, write)
+            write(u"</%s>"%(node.tag))
+        else:
+            write(u"/>")
+
+def serializeChildren(node, write):
+    """writes the child nodes of node (texts included)"""
+    if node.text:
+        write(escapeData(node.text))
+    for child in node:
+        serializeNode(child, write)
+        if child.tail:
+            write(escapeData(child.tail))
+
+class TreeBuilder(object):
+    """builds an ElementTree from expat events, keeping comments, processing instructions and cdata sections
+
+        elements with an ID attribute (as declared in the DTD, or 'id' when there is no DTD declaration)
+        are indexed in self.ids
+    """
+    def __init__(self):
+        self.root = None
+        self.stack = []
+        self.data = []
+        self.last = None
+        self.tail = False
+        self.idAttributes = {}
+        self.ids = {}
+
+    def parse(self, fileName):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.characters
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.processingInstruction
+        parser.StartCdataSectionHandler = self.startCData
+        parser.EndCdataSectionHandler = self.endCData
+        parser.AttlistDeclHandler = self.attlistDecl
+        sourceFile = open(fileName, 'rb')
+        try:
+            parser.ParseFile(sourceFile)
+        finally:
+            sourceFile.close()
+        return self.root
+
+    def flush(self):
+        if self.data:
+            if self.last is not None:
+                text = u''.join(self.data)
+                if self.tail:
+                    self.last.tail = text
+                else:
+                    self.last.text = text
+            self.data = []
+
+    def append(self, node):
+        if self.stack:
+            self.stack[-1].append(node)
+        self.last = node
+
+    def start(self, tag, attributes):
+        self.flush()
+        node = ElementTree.Element(tag, attributes)
+        if self.root is None:
+            self.root = node
+        self.append(node)
+        self.stack.append(node)
+        self.tail = False
+        idAttribute = self.idAttributes.get(tag, 'id')
+        if idAttribute in attributes:
+            self.ids.setdefault(attributes[idAttribute], node)
+
+    def end(self, tag):
+        self.flush()
+        self.last = self.stack.pop()
+        self.tail = True
+
+    def characters(self, data):
+        self.data.append(data)
+
+    def leaf(self, tag, text):
+        if not self.stack:
+            # outside of the root element
+            return
+        self.flush()
+        node = ElementTree.Element(tag)
+        node.text = text
+        self.append(node)
+        self.tail = True
+
+    def comment(self, data):
+        self.leaf(Comment, data)
+
+    def processingInstruction(self, target, data):
+        self.leaf(ProcessingInstruction, u"%s %s"%(target, data))
+
+    def startCData(self):
+        self.flush()
+
+    def endCData(self):
+        data = u''.join(self.data)
+        self.data = []
+        if data:
+            self.leaf(CData, data)
+
+    def attlistDecl(self, elementName, attributeName, attributeType, default, required):
+        if attributeType == u'ID':
+            self.idAttributes[elementName] = attributeName
+
+class Targets(object):
+    """targets.xml, parsed once and indexed by id"""
+    def __init__(self, targetsFile):
+        self.fileName = targetsFile
+        builder = TreeBuilder()
+        self.root = builder.parse(targetsFile)
+        self.ids = builder.ids
+        self.contents = {}
+        self.resolver = None
+
+    def getById(self, targetId):
+        return self.ids.get(targetId)
+
+    def iterTargets(self):
+        return self.root.iter('target')
+
+    def iterProfiles(self):
+        return self.root.iter('profile')
+
+    def getContent(self, targetNode):
+        """returns the serialized child nodes of targetNode"""
+        if targetNode not in self.contents:
+            content = []
+            serializeChildren(targetNode, content.append)
+            self.contents[targetNode] = u''.join(content)
+        return self.contents[targetNode]
+
+    def getResolver(self):
+        if self.resolver is None:
+            self.resolver = TargetsResolver(self.fileName, self.getById,
+                lambda node: node.tag == 'profile',
+                lambda node: [refTarget.get('targetId', u'') for refTarget in node.iter('refTarget')])
+        return self.resolver
+
+# template token kinds
+TEXT = 0
+START = 1
+END = 2
+
+class TemplateTokenizer(object):
+    """turns info.xml.in into a list of tokens:
+        - (TEXT, chunk): serialized node (text, comment...)
+        - (START, tag, startTag, endIndex): start tag without its closing '>' or '/>'
+        - (END, tag)
+    """
+    def __init__(self):
+        self.tokens = [(TEXT, u'<?xml version="1.0" ?>')]
+        self.stack = []
+        self.data = []
+        self.encoding = 'utf-8'
+        self.doctype = None
+
+    def tokenize(self, fileName):
+        sourceFile = open(fileName, 'rb')
+        try:
+            self.source = sourceFile.read()
+        finally:
+            sourceFile.close()
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.XmlDeclHandler = self.xmlDecl
+        self.parser.StartDoctypeDeclHandler = self.startDoctype
+        self.parser.EndDoctypeDeclHandler = self.endDoctype
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.characters
+        self.parser.CommentHandler = self.comment
+        self.parser.ProcessingInstructionHandler = self.processingInstruction
+        self.parser.StartCdataSectionHandler = self.startCData
+        self.parser.EndCdataSectionHandler = self.endCData
+        self.parser.Parse(self.source, True)
+        self.source = None
+        self.parser = None
+        return self.tokens
+
+    def flush(self):
+        if self.data:
+            if self.stack:
+                self.tokens.append((TEXT, escapeData(u''.join(self.data))))
+            self.data = []
+
+    def xmlDecl(self, version, encoding, standalone):
+        if encoding:
+            self.encoding = encoding
+
+    def startDoctype(self, name, systemId, publicId, hasInternalSubset):
+        doctype = [u"<!DOCTYPE ", name]
+        if publicId:
+            doctype.append(u"  PUBLIC '%s'  '%s'"%(publicId, systemId))
+        elif systemId:
+            doctype.append(u"  SYSTEM '%s'"%(systemId))
+        self.doctype = doctype
+        # the internal subset is kept as is, its start is the position of '['
+        self.internalSubsetStart = None
+        if hasInternalSubset:
+            self.internalSubsetStart = self.parser.CurrentByteIndex + 1
+
+    def endDoctype(self):
+        if self.internalSubsetStart is not None:
+            # the parser is now after the closing ']'
+            internalSubsetEnd = self.source.rindex(']', self.internalSubsetStart, self.parser.CurrentByteIndex)
+            internalSubset = self.source[self.internalSubsetStart:internalSubsetEnd]
+            self.doctype.append(u" [%s]"%(internalSubset.decode(self.encoding)))
+        self.doctype.append(u">")
+        self.tokens.append((TEXT, u''.join(self.doctype)))
+
+    def start(self, tag, attributes):
+        self.flush()
+        self.stack.append(len(self.tokens))
+        self.tokens.append([START, tag, serializeStartTag(tag, attributes), None])
+
+    def end(self, tag):
+        self.flush()
+        startIndex = self.stack.pop()
+        self.tokens[startIndex][3] = len(self.tokens)
+        self.tokens[startIndex] = tuple(self.tokens[startIndex])
+        self.tokens.append((END, tag))
+
+    def characters(self, data):
+        self.data.append(data)
+
+    def comment(self, data):
+        self.flush()
+        self.tokens.append((TEXT, serializeComment(data)))
+
+    def processingInstruction(self, target, data):
+        self.flush()
+        self.tokens.append((TEXT, u"<?%s %s?>"%(target, data)))
+
+    def startCData(self):
+        self.flush()
+
+    def endCData(self):
+        data = u''.join(self.data)
+        self.data = []
+        if data and self.stack:
+            self.tokens.append((TEXT, u"<![CDATA[%s]]>"%(data)))
+
+class Template(object):
+    """info.xml.in, tokenized once"""
+    def __init__(self, infoXmlFile):
+        self.fileName = infoXmlFile
+        self.tokens = TemplateTokenizer().tokenize(infoXmlFile)
+        self.rootIndex = None
+        self.startsByTag = {}
+        for (index, token) in enumerate(self.tokens):
+            if token[0] == START:
+                if self.rootIndex is None:
+                    self.rootIndex = index
+                self.startsByTag.setdefault(token[1], []).append(index)
+
+    def findPhaseNodes(self, phases):
+        """finds the element receiving each phase, the same way generateInfoXml.getNodes does
+
+            returns (nodes, removed, appended):
+            - nodes maps each phase to a start token index, or to a key of appended
+            - removed is the list of (start, end) token ranges whose content is dropped
+            - appended lists the phase elements created at the end of the root element
+        """
+        nodes = {}
+        removed = []
+        appended = []
+        def isRemoved(index):
+            for (start, end) in removed:
+                if start < index < end:
+                    return True
+            return False
+        for phase in phases:
+            found = None
+            for index in self.startsByTag.get(phase, []):
+                if not isRemoved(index):
+                    found = index
+                    break
+            if found is not None:
+                nodes[phase] = found
+                removed.append((found, self.tokens[found][3]))
+                if found == self.rootIndex:
+                    # the root element has been emptied, appended elements are gone
+                    del appended[:]
+            else:
+                newKey = ('new', phase)
+                if newKey not in appended:
+                    appended.append(newKey)
+                nodes[phase] = newKey
+        return (nodes, removed, appended)
+
+    def render(self, contents, nodes, removed, appended, write):
+        """writes the document, contents maps phase element keys to their new child nodes"""
+        # the start tag of the last opened element is only closed when
+        # its first child is written, or by '/>' if it has none
+        state = {'pending': False}
+        def writeChild(chunk):
+            if state['pending']:
+                write(u">")
+                state['pending'] = False
+            write(chunk)
+        def writeStart(startTag):
+            writeChild(startTag)
+            state['pending'] = True
+        def writeEnd(tag):
+            if state['pending']:
+                write(u"/>")
+                state['pending'] = False
+            else:
+                write(u"</%s>"%(tag))
+        def writeElement(tag, startTag, key):
+            writeStart(startTag)
+            for chunk in contents.get(key, []):
+                writeChild(chunk)
+            writeEnd(tag)
+
+        phaseIndexes = set(node for node in nodes.values() if not isinstance(node, tuple))
+        index = 0
+        tokensCount = len(self.tokens)
+        while index < tokensCount:
+            token = self.tokens[index]
+            if token[0] == START and index in phaseIndexes and index != self.rootIndex:
+                writeElement(token[1], token[2], index)
+                index = token[3] + 1
+                continue
+            if token[0] == TEXT:
+                writeChild(token[1])
+            elif token[0] == START:
+                writeStart(token[2])
+                if index == self.rootIndex and index in phaseIndexes:
+                    # the emptied root element gets the appended phase elements
+                    # first, then the contents added to it
+                    for key in appended:
+                        writeElement(key[1], u"<%s"%(key[1]), key)
+                    for chunk in contents.get(index, []):
+                        writeChild(chunk)
+                    writeEnd(token[1])
+                    index = token[3] + 1
+                    continue
+            else:
+                if index == self.tokens[self.rootIndex][3]:
+                    for key in appended:
+                        writeElement(key[1], u"<%s"%(key[1]), key)
+                writeEnd(token[1])
+            index += 1
+
+class TargetsResolver(object):
+    """expands target and profile ids into ordered lists of target nodes
+
+        each profile is expanded once: its flattened target list is memoized, along with the
+        set of profiles it includes, so that profiles shared by several targets (or several
+        documents) are not walked again. A profile referencing one of its ancestors is an error.
+
+        as in the original recursive expansion, a profile already included in the expansion of
+        a requested target is skipped.
+    """
+    def __init__(self, fileName, getNode, isProfile, getReferences):
+        self.fileName = fileName
+        self.getNode = getNode
+        self.isProfile = isProfile
+        self.getReferences = getReferences
+        # profile id -> (target nodes, included profile ids, skipped profile ids)
+        self.expanded = {}
+        self.path = []
+
+    def getExistingNode(self, targetId):
+        node = self.getNode(targetId)
+        if(node is None):
+            raise NameError('There is no target with this id: %s#%s'%(self.fileName, targetId))
+        return node
+
+    def reportSkipped(self, profileId):
+        sys.stderr.write("profile %s#%s skipped because it is already inserted\n"%(self.fileName, profileId))
+
+    def expandProfile(self, profileId, profileNode):
+        if profileId in self.expanded:
+            return self.expanded[profileId]
+        self.path.append(profileId)
+        try:
+            targetNodes = []
+            included = set([profileId])
+            skipped = []
+            for refTargetId in self.getReferences(profileNode):
+                refTargetNode = self.getExistingNode(refTargetId)
+                if not self.isProfile(refTargetNode):
+                    targetNodes.append(refTargetNode)
+                elif refTargetId in self.path:
+                    cycle = self.path[self.path.index(refTargetId):] + [refTargetId]
+                    raise NameError('There is a cycle in profiles: %s#%s'%(self.fileName, ' -> '.join(cycle)))
+                elif refTargetId in included:
+                    skipped.append(refTargetId)
+                else:
+                    (refTargetNodes, refIncluded, refSkipped) = self.expandProfile(refTargetId, refTargetNode)
+                    if included.isdisjoint(refIncluded):
+                        targetNodes.extend(refTargetNodes)
+                        included.update(refIncluded)
+                        skipped.extend(refSkipped)
+                    else:
+                        # some profiles of refTargetId are already there, walk it again to skip them
+                        targetNodes.extend(self.expandAgain(refTargetId, refTargetNode, included, skipped))
+        finally:
+            self.path.pop()
+        self.expanded[profileId] = (targetNodes, frozenset(included), skipped)
+        return self.expanded[profileId]
+
+    def expandAgain(self, profileId, profileNode, included, skipped):
+        """expands an already checked profile, skipping profiles which are in included"""
+        if profileId in included:
+            skipped.append(profileId)
+            return []
+        included.add(profileId)
+        targetNodes = []
+        for refTargetId in self.getReferences(profileNode):
+            refTargetNode = self.getNode(refTargetId)
+            if self.isProfile(refTargetNode):
+                targetNodes.extend(self.expandAgain(refTargetId, refTargetNode, included, skipped))
+            else:
+                targetNodes.append(refTargetNode)
+        return targetNodes
+
+    def resolve(self, targetId):
+        """returns the target nodes of a target or profile id"""
+        targetNode = self.getExistingNode(targetId)
+        if not self.isProfile(targetNode):
+            return [targetNode]
+        (targetNodes, included, skipped) = self.expandProfile(targetId, targetNode)
+        for profileId in skipped:
+            self.reportSkipped(profileId)
+        return targetNodes
+
+def appendTarget(contents, nodes, targets, targetNode, phases):
+    """adds the content of targetNode to the contents of the phase elements"""
+    useFor = targetNode.get('usefor')
+    if(not useFor):
+        useFor = phases
+    targetContent = None
+    for phase in phases:
+        if(phase in useFor):
+            if targetContent is None:
+                targetContent = targets.getContent(targetNode)
+            chunks = contents.setdefault(nodes[phase], [])
+            chunks.append(serializeComment(u'generated from target %s#%s (%s)'%(targets.fileName, targetNode.get('id', u''), targetNode.get('label', u''))))
+            if targetContent:
+                chunks.append(targetContent)
+
+def renderInfoXml(template, targets, targetIds, phases):
+    """returns the info.xml document built from template, with targetIds contents in phases elements"""
+    (nodes, removed, appended) = template.findPhaseNodes(phases)
+    contents = {}
+    resolver = targets.getResolver()
+    for targetId in targetIds:
+        for targetNode in resolver.resolve(targetId):
+            appendTarget(contents, nodes, targets, targetNode, phases)
+    output = []
+    template.render(contents, nodes, removed, appended, output.append)
+    return u''.join(output)
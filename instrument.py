@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""timing of the phases of the tools, and of the steps of the build and deploy scripts
+
+when DEVTOOLS_TRACE is set to a file name, a json line is appended to that file
+for each step (a command run with `instrument.py run`, or a tool run through
+runMain) and for each phase of the tools, with its wall time, cpu time, bytes
+and exit code. Records of a same build share the DEVTOOLS_RUN id, and
+`instrument.py summary` prints them as a table.
+
+when DEVTOOLS_PROFILE is set to a directory, tools run through runMain are
+profiled with cProfile, and their stats are dumped in <tool>-<pid>.prof files.
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+TRACE_ENV = 'DEVTOOLS_TRACE'
+RUN_ENV = 'DEVTOOLS_RUN'
+PROFILE_ENV = 'DEVTOOLS_PROFILE'
+
+# phase name -> [wall time, cpu time, calls, bytes]
+phases = {}
+phasesOrder = []
+
+# name of the tool run by runMain, written in trace records
+toolName = None
+
+def getCpuTime():
+    times = os.times()
+    return times[0] + times[1]
+
+def getChildrenCpuTime():
+    times = os.times()
+    return times[2] + times[3]
+
+def getPhase(name):
+    if name not in phases:
+        phases[name] = [0.0, 0.0, 0, 0]
+        phasesOrder.append(name)
+    return phases[name]
+
+@contextmanager
+def phase(name):
+    """accumulates wall and cpu time spent in the with block under name"""
+    wallStart = time.time()
+    cpuStart = getCpuTime()
+    try:
+        yield
+    finally:
+        measures = getPhase(name)
+        measures[0] += time.time() - wallStart
+        measures[1] += getCpuTime() - cpuStart
+        measures[2] += 1
+
+def addBytes(name, count):
+    """accounts count bytes (read, copied or written) to the phase name"""
+    getPhase(name)[3] += count
+
+def getPhases():
+    """returns [(name, wall time, cpu time, calls, bytes)] in order of first use"""
+    return [tuple([name] + phases[name]) for name in phasesOrder]
+
+def resetPhases():
+    phases.clear()
+    del phasesOrder[:]
+
+def getToolName():
+    if toolName:
+        return toolName
+    return os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+
+def writeTrace(record, traceFileName=None):
+    """appends record as a json line to the trace file, if there is one"""
+    if traceFileName is None:
+        traceFileName = os.environ.get(TRACE_ENV)
+    if not traceFileName:
+        return
+    import json
+    record = dict(record)
+    record.setdefault('tool', getToolName())
+    record.setdefault('run', os.environ.get(RUN_ENV) or str(os.getpid()))
+    record.setdefault('pid', os.getpid())
+    # a single write in append mode, so that lines of concurrent processes are not mixed
+    traceFd = os.open(traceFileName, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        os.write(traceFd, json.dumps(record, sort_keys=True) + '\n')
+    finally:
+        os.close(traceFd)
+
+def recordStep(name, start, wall, cpu, exitCode, byteCount=None, cached=False, traceFileName=None):
+    record = {
+        'kind': 'step',
+        'name': name,
+        'start': start,
+        'wall': wall,
+        'cpu': cpu,
+        'exitCode': exitCode
+    }
+    if byteCount is not None:
+        record['bytes'] = byteCount
+    if cached:
+        record['cached'] = True
+    writeTrace(record, traceFileName)
+
+def recordPhases(traceFileName=None):
+    for (name, wallTime, cpuTime, calls, byteCount) in getPhases():
+        record = {'kind': 'phase', 'name': name, 'wall': wallTime, 'cpu': cpuTime, 'calls': calls}
+        if byteCount:
+            record['bytes'] = byteCount
+        writeTrace(record, traceFileName)
+
+def getTreeSize(directory):
+    size = 0
+    for root, dirs, files in os.walk(directory):
+        for fileName in files:
+            try:
+                size += os.lstat(os.path.join(root, fileName)).st_size
+            except OSError:
+                pass
+    return size
+
+def runCommand(name, command, measuredDir=None, traceFileName=None, **popenArgs):
+    """runs command with subprocess.call, records it as the step name, and returns its exit code
+        the size of measuredDir after the command is recorded as its bytes
+    """
+    import subprocess
+    start = time.time()
+    cpuStart = getChildrenCpuTime()
+    try:
+        exitCode = subprocess.call(command, **popenArgs)
+    except OSError:
+        # command not found: same exit code as a shell
+        exitCode = 127
+    byteCount = None
+    if measuredDir is not None:
+        byteCount = getTreeSize(measuredDir)
+    recordStep(name, start, time.time() - start, getChildrenCpuTime() - cpuStart, exitCode, byteCount, traceFileName=traceFileName)
+    return exitCode
+
+def runMain(main, name=None):
+    """runs main() of a tool, profiled when DEVTOOLS_PROFILE is set,
+        then records the tool and its phases in the trace
+        returns what main() returned
+    """
+    global toolName
+    toolName = name or getToolName()
+    profileDir = os.environ.get(PROFILE_ENV)
+    profiler = None
+    if profileDir:
+        import cProfile
+        profiler = cProfile.Profile()
+    start = time.time()
+    cpuStart = getCpuTime()
+    exitCode = 1
+    try:
+        if profiler is None:
+            value = main()
+        else:
+            value = profiler.runcall(main)
+        exitCode = 0
+    except SystemExit as e:
+        if (e.code is None) or isinstance(e.code, int):
+            exitCode = e.code or 0
+        raise
+    finally:
+        if profiler is not None:
+            if not os.path.isdir(profileDir):
+                os.makedirs(profileDir)
+            profiler.dump_stats(os.path.join(profileDir, '%s-%s.prof'%(toolName, os.getpid())))
+        recordPhases()
+        recordStep(toolName, start, time.time() - start, getCpuTime() - cpuStart, exitCode)
+    return value
+
+def loadTrace(traceFileName):
+    import json
+    records = []
+    traceFile = open(traceFileName)
+    try:
+        for line in traceFile:
+            if line.strip():
+                records.append(json.loads(line))
+    finally:
+        traceFile.close()
+    return records
+
+def formatBytes(count):
+    for unit in ['B', 'kB', 'MB']:
+        if count < 1024:
+            return '%d%s'%(count, unit)
+        count /= 1024.0
+    return '%.1fGB'%(count)
+
+def printSummary(records):
+    """prints wall time, cpu time, bytes and exit codes of records, grouped by tool and step (or phase)"""
+    rows = {}
+    rowsOrder = []
+    for record in records:
+        if record.get('kind') == 'phase':
+            key = '%s:%s'%(record['tool'], record['name'])
+        elif record['name'] == record['tool']:
+            key = record['name']
+        else:
+            key = '%s %s'%(record['tool'], record['name'])
+        if key not in rows:
+            rows[key] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'bytes': None, 'cached': 0, 'failures': []}
+            rowsOrder.append(key)
+        row = rows[key]
+        row['calls'] += record.get('calls', 1)
+        row['wall'] += record['wall']
+        row['cpu'] += record['cpu']
+        if 'bytes' in record:
+            row['bytes'] = (row['bytes'] or 0) + record['bytes']
+        if record.get('cached'):
+            row['cached'] += 1
+        if record.get('exitCode'):
+            row['failures'].append(record['exitCode'])
+    header = "%-40s %6s %9s %9s %9s" % ('step', 'calls', 'wall (s)', 'cpu (s)', 'bytes')
+    print(header)
+    print('-' * len(header))
+    for key in rowsOrder:
+        row = rows[key]
+        line = "%-40s %6d %9.3f %9.3f %9s" % (key, row['calls'], row['wall'], row['cpu'],
+            '-' if row['bytes'] is None else formatBytes(row['bytes']))
+        if row['cached']:
+            line += " (%s cached)" % (row['cached'])
+        if row['failures']:
+            line += " (exit code %s)" % (', '.join(str(exitCode) for exitCode in row['failures']))
+        print(line)
+
+def parseOptions():
+    import argparse
+    argParser = argparse.ArgumentParser(
+        description = 'records steps of the build and deploy scripts in a json lines trace, and summarizes traces.'
+    )
+    subParsers = argParser.add_subparsers(dest = 'action')
+    runParser = subParsers.add_parser('run',
+        help = 'run a command, and record its times and exit code as a step (its exit code is returned)')
+    runParser.add_argument('-n', '--name',
+        help = 'step name (default is the command name)',
+        dest = 'name',
+        default = None)
+    runParser.add_argument('--tool',
+        help = 'name of the script running the step',
+        dest = 'tool',
+        default = None)
+    runParser.add_argument('--measure',
+        help = 'directory whose size, after the command, is recorded as the bytes of the step',
+        dest = 'measuredDir',
+        default = None)
+    runParser.add_argument('--trace',
+        help = 'trace file (default is $%s; nothing is recorded when there is none)'%(TRACE_ENV),
+        dest = 'traceFile',
+        default = None)
+    runParser.add_argument('command',
+        help = 'command to run, after --',
+        nargs = argparse.REMAINDER)
+    summaryParser = subParsers.add_parser('summary',
+        help = 'print a table of the steps of a trace')
+    summaryParser.add_argument('traceFile',
+        help = 'trace file (default is $%s)'%(TRACE_ENV),
+        nargs = '?',
+        default = os.environ.get(TRACE_ENV))
+    summaryParser.add_argument('-r', '--run',
+        help = 'id of the run to summarize (default is the last one of the trace)',
+        dest = 'run',
+        default = None)
+    summaryParser.add_argument('-a', '--all',
+        help = 'summarize all runs of the trace',
+        action = 'store_true',
+        dest = 'all',
+        default = False)
+    args = argParser.parse_args()
+    if args.action == 'run':
+        if args.command and (args.command[0] == '--'):
+            args.command = args.command[1:]
+        if not args.command:
+            runParser.error('a command is needed')
+    elif not args.traceFile:
+        summaryParser.error('a trace file is needed')
+    return args
+
+def main():
+    global toolName
+    args = parseOptions()
+    if args.action == 'run':
+        toolName = args.tool
+        exitCode = runCommand(args.name or os.path.basename(args.command[0]), args.command,
+            measuredDir = args.measuredDir,
+            traceFileName = args.traceFile)
+        sys.exit(exitCode)
+    records = loadTrace(args.traceFile)
+    if records and not args.all:
+        run = args.run or records[-1]['run']
+        records = [record for record in records if record['run'] == run]
+    printSummary(records)
+
+if __name__ == "__main__":
+    main()
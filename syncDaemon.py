@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""pushes changes of the project to rsync nodes, using inosync_conf.py settings
+
+files are hashed once at startup, then each batch of changes (see edelay) is
+checked against those hashes, and only files whose content changed (or which
+were deleted) are pushed, with a single rsync --files-from per node. Nodes are
+pushed in parallel, and ssh connections to remote nodes are kept open between
+batches.
+"""
+
+import os
+import sys
+import imp
+import logging
+import argparse
+import tempfile
+import shutil
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+import fsWatch
+from excludeMatcher import loadExcludeFile
+from utils import getFileSignature
+
+logging.basicConfig(
+    format='[%(lineno)d] %(levelname)s:%(message)s'
+)
+
+def parseOptions():
+    argParser = argparse.ArgumentParser(
+        description = 'pushes project changes to rsync nodes, as configured in inosync_conf.py.',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter
+    )
+    argParser.add_argument('-c', '--config',
+        help = 'inosync configuration file',
+        dest = 'configFile',
+        default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inosync_conf.py'))
+    argParser.add_argument('--once',
+        help = 'only do the initial sync, then exit',
+        action = 'store_true',
+        dest = 'once',
+        default = False)
+    argParser.add_argument('--noInitialSync',
+        help = 'do not sync the whole project at startup',
+        action = 'store_true',
+        dest = 'noInitialSync',
+        default = False)
+    argParser.add_argument('-n', '--dryRun',
+        help = 'run rsync with --dry-run',
+        action = 'store_true',
+        dest = 'dryRun',
+        default = False)
+    argParser.add_argument('--logLevel',
+        help = 'logging level',
+        dest = 'logLevel',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        default = 'INFO')
+    args = argParser.parse_args()
+    return args
+
+def loadConfig(configFile):
+    """loads an inosync configuration file, and checks mandatory settings"""
+    config = imp.load_source('inosync_conf', configFile)
+    for setting in ['wpath', 'rnodes']:
+        if not hasattr(config, setting):
+            raise NameError("%s is missing in %s"%(setting, configFile))
+    return config
+
+class HashTree(object):
+    """signatures ([mtime, size, md5], or ['symlink', target]) of the files of a directory"""
+    def __init__(self, root, excludeMatcher):
+        self.root = os.path.abspath(root)
+        self.excludeMatcher = excludeMatcher
+        # path relative to root -> signature
+        self.signatures = {}
+
+    def getRelPath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+
+    def getSignature(self, relPath):
+        path = os.path.join(self.root, relPath)
+        if os.path.islink(path):
+            return ['symlink', os.readlink(path)]
+        return getFileSignature(path, self.signatures.get(relPath))
+
+    def walk(self, relDir=''):
+        """yields relative paths of the files of relDir which are not excluded"""
+        for root, dirs, files in os.walk(os.path.join(self.root, relDir)):
+            relRoot = self.getRelPath(root)
+            prefix = '' if relRoot == '.' else relRoot + '/'
+            dirs[:] = [subDir for subDir in dirs if not self.excludeMatcher.matches(prefix + subDir, True)]
+            for subDir in dirs:
+                # symlinked directories are synced as links
+                if os.path.islink(os.path.join(root, subDir)):
+                    yield prefix + subDir
+            for fileName in files:
+                if not self.excludeMatcher.matches(prefix + fileName, False):
+                    yield prefix + fileName
+
+    def scan(self):
+        for relPath in self.walk():
+            self.signatures[relPath] = self.getSignature(relPath)
+        logging.info("%s files hashed in %s", len(self.signatures), self.root)
+
+    def checkFile(self, relPath, changes):
+        signature = self.getSignature(relPath)
+        previous = self.signatures.get(relPath)
+        if signature is None:
+            return self.removePath(relPath, changes)
+        if (previous is None) or (previous[-1] != signature[-1]):
+            changes.add(relPath)
+        self.signatures[relPath] = signature
+
+    def removePath(self, relPath, changes):
+        prefix = relPath + '/'
+        for knownPath in [knownPath for knownPath in self.signatures if (knownPath == relPath) or knownPath.startswith(prefix)]:
+            del self.signatures[knownPath]
+            changes.add(knownPath)
+
+    def update(self, paths):
+        """checks paths (absolute, or relative to the current directory) against known signatures
+            returns the relative paths of the files whose content changed, or which were removed
+        """
+        changes = set()
+        for path in paths:
+            relPath = self.getRelPath(path)
+            if relPath.startswith('../') or (relPath == '.'):
+                continue
+            absPath = os.path.join(self.root, relPath)
+            isDir = os.path.isdir(absPath) and not os.path.islink(absPath)
+            if self.excludeMatcher.isExcluded(relPath, isDir):
+                continue
+            if isDir:
+                for filePath in self.walk(relPath):
+                    self.checkFile(filePath, changes)
+            elif os.path.lexists(absPath):
+                self.checkFile(relPath, changes)
+            else:
+                self.removePath(relPath, changes)
+        return changes
+
+def isRemoteNode(node):
+    """tells if an rsync destination is on another host ([user@]host:path or rsync://)"""
+    if node.startswith('rsync://'):
+        return True
+    colon = node.find(':')
+    slash = node.find('/')
+    return (colon > 0) and ((slash < 0) or (colon < slash))
+
+class Pusher(object):
+    """runs rsync from a source directory to every node"""
+    def __init__(self, source, nodes, rsync='rsync', speed=0, excludeFile=None, dryRun=False):
+        self.source = os.path.join(os.path.abspath(source), '')
+        self.nodes = list(nodes)
+        self.rsync = rsync
+        self.speed = speed
+        self.excludeFile = excludeFile
+        self.dryRun = dryRun
+        # node -> relative paths which could not be pushed yet
+        self.pending = dict((node, set()) for node in self.nodes)
+        self.controlDir = None
+        if [node for node in self.nodes if isRemoteNode(node) and not node.startswith('rsync://')]:
+            # ssh master connections are shared by all rsync runs of a node
+            self.controlDir = tempfile.mkdtemp(prefix='devTools-ssh-')
+        self.pool = ThreadPool(max(len(self.nodes), 1))
+
+    def getSshCommand(self):
+        return "ssh -o ControlMaster=auto -o ControlPersist=600 -o ControlPath=%s"%(os.path.join(self.controlDir, '%r@%h:%p'))
+
+    def getCommand(self, node):
+        command = [self.rsync, '-a']
+        if self.speed:
+            command.append('--bwlimit=%s'%(self.speed))
+        if self.excludeFile and os.path.isfile(self.excludeFile):
+            command.append('--exclude-from=%s'%(self.excludeFile))
+        if self.dryRun:
+            command.append('--dry-run')
+        if self.controlDir and isRemoteNode(node) and not node.startswith('rsync://'):
+            command += ['-e', self.getSshCommand()]
+        return command
+
+    def runRsync(self, node, command):
+        logging.debug("running %s", ' '.join(command))
+        try:
+            returnCode = subprocess.call(command)
+        except OSError as e:
+            logging.error("could not run %s: %s", command[0], e)
+            # command not found: same exit code as a shell
+            return 127
+        if returnCode:
+            logging.error("rsync to %s failed with exit code %s", node, returnCode)
+        return returnCode
+
+    def syncAll(self):
+        """syncs the whole source to every node, deleting files which are not in source"""
+        def syncNode(node):
+            returnCode = self.runRsync(node, self.getCommand(node) + ['--delete', self.source, node])
+            if not returnCode:
+                self.pending[node].clear()
+            return returnCode
+        return dict(zip(self.nodes, self.pool.map(syncNode, self.nodes)))
+
+    def push(self, relPaths):
+        """pushes relPaths (changed or removed files) to every node, with a single rsync per node
+            paths which could not be pushed to a node are pushed again with the next batch
+        """
+        def pushNode(node):
+            toPush = self.pending[node] | set(relPaths)
+            (listFd, listFileName) = tempfile.mkstemp(prefix='devTools-sync-')
+            try:
+                listFile = os.fdopen(listFd, 'w')
+                listFile.write('\0'.join(sorted(toPush)))
+                listFile.close()
+                returnCode = self.runRsync(node, self.getCommand(node) + [
+                    '--from0', '--files-from=%s'%(listFileName),
+                    # removed files are given too, they are deleted on the node
+                    '--delete-missing-args',
+                    self.source, node])
+            finally:
+                os.unlink(listFileName)
+            if returnCode:
+                self.pending[node] = toPush
+            else:
+                self.pending[node] = set()
+            return returnCode
+        return dict(zip(self.nodes, self.pool.map(pushNode, self.nodes)))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        if self.controlDir:
+            for node in self.nodes:
+                if isRemoteNode(node) and not node.startswith('rsync://'):
+                    host = node.split(':', 1)[0]
+                    subprocess.call(['ssh', '-o', 'ControlPath=%s'%(os.path.join(self.controlDir, '%r@%h:%p')), '-O', 'exit', host],
+                        stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+            shutil.rmtree(self.controlDir, True)
+
+def syncDaemon(config, once=False, initialSync=True, dryRun=False):
+    excludeFile = getattr(config, 'excludeFile', None)
+    excludeMatcher = loadExcludeFile(excludeFile)
+    tree = HashTree(config.wpath, excludeMatcher)
+    tree.scan()
+    pusher = Pusher(config.wpath, config.rnodes,
+        rsync = getattr(config, 'rsync', 'rsync'),
+        speed = getattr(config, 'rspeed', 0),
+        excludeFile = excludeFile,
+        dryRun = dryRun)
+    if not pusher.nodes:
+        logging.warning("no rnodes configured, nothing to sync")
+    try:
+        if initialSync:
+            pusher.syncAll()
+        if once:
+            return
+        def isSynced(path):
+            relPath = tree.getRelPath(path)
+            return not excludeMatcher.isExcluded(relPath, os.path.isdir(path))
+        watcher = fsWatch.getWatcher(config.wpath, isSynced, getattr(config, 'edelay', 1), acceptDir=isSynced)
+        logging.info("watching %s (%s, %ss delay)", tree.root, watcher.__class__.__name__, watcher.delay)
+        try:
+            while True:
+                changes = tree.update(watcher.waitChanges())
+                if changes:
+                    logging.info("pushing %s changed files", len(changes))
+                    pusher.push(changes)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+    finally:
+        pusher.close()
+
+def main():
+    args = parseOptions()
+    logging.getLogger().setLevel(getattr(logging, args.logLevel))
+    try:
+        config = loadConfig(args.configFile)
+    except (IOError, NameError) as e:
+        logging.error(e)
+        sys.exit(1)
+    syncDaemon(config, once=args.once, initialSync=not args.noInitialSync, dryRun=args.dryRun)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""compiled string.Template cache for the files of a templates directory
+
+a registry reads and compiles each template file once, and only reads it
+again when its mtime or size changed, so that a process generating many
+families or workflows does not read and compile the same templates each time.
+"""
+
+import os
+from string import Template
+
+defaultTemplateDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+class TemplateRegistry(object):
+
+    def __init__(self, templateDir=defaultTemplateDir):
+        self.templateDir = templateDir
+        # template name -> (mtime, size, compiled template)
+        self.templates = {}
+
+    def getTemplatePath(self, name):
+        return os.path.join(self.templateDir, name)
+
+    def loadAll(self):
+        """compiles every file of the templates directory, and returns their names"""
+        names = []
+        for root, dirs, files in os.walk(self.templateDir):
+            dirs.sort()
+            for fileName in sorted(files):
+                name = os.path.relpath(os.path.join(root, fileName), self.templateDir)
+                self.get(name)
+                names.append(name)
+        return names
+
+    def get(self, name):
+        """returns the compiled template of name (a path relative to the templates directory)"""
+        templatePath = self.getTemplatePath(name)
+        templateStat = os.stat(templatePath)
+        cached = self.templates.get(name)
+        if cached and (cached[0] == templateStat.st_mtime) and (cached[1] == templateStat.st_size):
+            return cached[2]
+        templateFile = open(templatePath)
+        try:
+            template = Template(templateFile.read())
+        finally:
+            templateFile.close()
+        self.templates[name] = (templateStat.st_mtime, templateStat.st_size, template)
+        return template
+
+    def substitute(self, name, values):
+        """returns the template of name where known values are substituted"""
+        return self.get(name).safe_substitute(values)
+
+    def clear(self):
+        self.templates.clear()
+
+# templates directory (absolute path) -> TemplateRegistry
+registries = {}
+
+def getRegistry(templateDir=None):
+    """returns the shared registry of templateDir, with all its templates loaded"""
+    if templateDir is None:
+        templateDir = defaultTemplateDir
+    templateDir = os.path.abspath(templateDir)
+    if templateDir not in registries:
+        registry = TemplateRegistry(templateDir)
+        registry.loadAll()
+        registries[templateDir] = registry
+    return registries[templateDir]
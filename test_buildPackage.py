@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""tests of buildPackage, building a module with stub autoconf and make commands
+
+    python -m unittest test_buildPackage
+"""
+
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from buildPackage import buildPackage, checkStagingDir
+
+# stub of autoconf: writes a ./configure doing nothing
+STUB_AUTOCONF = """#!/bin/sh
+printf '#!/bin/sh\\nexit 0\\n' > configure
+chmod +x configure
+"""
+
+# stub of make: make webinst builds mod-<content of VERSION>-1.webinst, and counts its runs
+STUB_MAKE = """#!/bin/sh
+if [ "$1" = "webinst" ]; then
+    echo run >> "$STUB_MAKE_LOG"
+    echo "mod $(cat VERSION)" > "mod-$(cat VERSION)-1.webinst"
+fi
+exit 0
+"""
+
+class BuildPackageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='test_buildPackage-')
+        binDir = os.path.join(self.directory, 'bin')
+        os.mkdir(binDir)
+        for (name, content) in [('autoconf', STUB_AUTOCONF), ('make', STUB_MAKE)]:
+            self.writeFile(os.path.join(binDir, name), content)
+            os.chmod(os.path.join(binDir, name), stat.S_IRWXU)
+        self.sourceDir = os.path.join(self.directory, 'source')
+        os.mkdir(self.sourceDir)
+        self.writeFile(os.path.join(self.sourceDir, 'configure.ac'), 'AC_INIT\n')
+        self.stagingDir = os.path.join(self.directory, 'staging')
+        self.makeLogFileName = os.path.join(self.directory, 'make.log')
+        self.savedEnviron = dict(os.environ)
+        os.environ['PATH'] = binDir + os.pathsep + os.environ.get('PATH', '')
+        os.environ['STUB_MAKE_LOG'] = self.makeLogFileName
+        self.savedStdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.savedStdout
+        os.environ.clear()
+        os.environ.update(self.savedEnviron)
+        shutil.rmtree(self.directory)
+
+    def writeFile(self, fileName, content):
+        with open(fileName, 'w') as writtenFile:
+            writtenFile.write(content)
+
+    def build(self, version):
+        """builds the module with VERSION set to version, and returns the files of a new output dir"""
+        self.writeFile(os.path.join(self.sourceDir, 'VERSION'), version + '\n')
+        outputDir = tempfile.mkdtemp(dir=self.directory, prefix='output-')
+        self.assertTrue(buildPackage(self.sourceDir, outputDir, self.stagingDir, quiet=2))
+        return sorted(os.listdir(outputDir))
+
+    def getMakeRuns(self):
+        with open(self.makeLogFileName) as makeLog:
+            return len(makeLog.readlines())
+
+    def testVersionBumpLeavesNoStaleWebinst(self):
+        self.assertEqual(self.build('1.0'), ['mod-1.0-1.webinst'])
+        self.assertEqual(self.build('1.1'), ['mod-1.1-1.webinst'])
+        self.assertEqual(sorted(name for name in os.listdir(self.stagingDir) if name.endswith('.webinst')), ['mod-1.1-1.webinst'])
+
+    def testUnchangedSourcesSkipMakeWebinst(self):
+        self.assertEqual(self.build('1.0'), ['mod-1.0-1.webinst'])
+        self.assertEqual(self.build('1.0'), ['mod-1.0-1.webinst'])
+        self.assertEqual(self.getMakeRuns(), 1)
+
+    def testStagingDirIsPrivate(self):
+        self.build('1.0')
+        self.assertEqual(stat.S_IMODE(os.stat(self.stagingDir).st_mode), 0700)
+
+    def testSharedStagingDirIsRefused(self):
+        os.mkdir(self.stagingDir)
+        os.chmod(self.stagingDir, 0777)
+        self.assertRaises(NameError, checkStagingDir, self.stagingDir)
+        self.assertRaises(NameError, buildPackage, self.sourceDir, self.directory, self.stagingDir, quiet=2)
+
+if __name__ == "__main__":
+    unittest.main()
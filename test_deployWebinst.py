@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""tests of deployWebinst, running deployments with a stub wiff script
+
+    python -m unittest test_deployWebinst
+"""
+
+import os
+import sys
+import stat
+import shutil
+import tarfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from deployWebinst import Webinst, Deployer, deployWebinsts
+
+# stub of wiff: appends its arguments to $STUB_WIFF_LOG, lists the modules of
+# $STUB_WIFF_INSTALLED, and fails to install or upgrade webinsts named fail-*
+STUB_WIFF = """#!/bin/sh
+echo "$*" >> "$STUB_WIFF_LOG"
+case "$4" in
+    list)
+        cat "$STUB_WIFF_INSTALLED"
+        ;;
+    install|upgrade)
+        case "$(basename "$6")" in
+            fail-*) exit 3 ;;
+        esac
+        ;;
+esac
+exit 0
+"""
+
+INFO_XML = """<?xml version="1.0"?>
+<module name="%(name)s" version="1.0.0" release="1">
+  <requires>%(requires)s</requires>
+</module>
+"""
+
+class DeployWebinstsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='test_deployWebinst-')
+        self.logFileName = os.path.join(self.directory, 'wiff.log')
+        installedFileName = os.path.join(self.directory, 'installed.txt')
+        with open(installedFileName, 'w') as installedFile:
+            installedFile.write("upgraded 0.9.0-1\n")
+        self.wiff = os.path.join(self.directory, 'wiff')
+        with open(self.wiff, 'w') as wiffFile:
+            wiffFile.write(STUB_WIFF)
+        os.chmod(self.wiff, stat.S_IRWXU)
+        self.savedEnviron = dict(os.environ)
+        os.environ['STUB_WIFF_LOG'] = self.logFileName
+        os.environ['STUB_WIFF_INSTALLED'] = installedFileName
+        # deployments are reported on stdout
+        self.savedStreams = (sys.stdout, sys.stderr)
+        (sys.stdout, sys.stderr) = (StringIO(), StringIO())
+
+    def tearDown(self):
+        (sys.stdout, sys.stderr) = self.savedStreams
+        os.environ.clear()
+        os.environ.update(self.savedEnviron)
+        shutil.rmtree(self.directory)
+
+    def makeWebinst(self, name, requires=(), fileName=None):
+        path = os.path.join(self.directory, fileName or (name + '-1.0.0-1.webinst'))
+        infoXmlFileName = os.path.join(self.directory, 'info.xml')
+        with open(infoXmlFileName, 'w') as infoXmlFile:
+            infoXmlFile.write(INFO_XML%{
+                'name': name,
+                'requires': ''.join('<module name="%s"/>'%(required) for required in requires)
+            })
+        webinst = tarfile.open(path, 'w:gz')
+        try:
+            webinst.add(infoXmlFileName, 'info.xml')
+        finally:
+            webinst.close()
+        os.unlink(infoXmlFileName)
+        return Webinst(path)
+
+    def getWiffCalls(self):
+        with open(self.logFileName) as logFile:
+            return [line.split() for line in logFile.read().splitlines()]
+
+    def deploy(self, webinsts, jobs=1):
+        deployer = Deployer(self.wiff, 'test')
+        return deployWebinsts(webinsts, deployer.deploy, jobs)
+
+    def testRequiredModulesAreDeployedFirst(self):
+        for jobs in (1, 4):
+            if os.path.exists(self.logFileName):
+                os.unlink(self.logFileName)
+            webinsts = [
+                self.makeWebinst('app', ['core', 'upgraded']),
+                self.makeWebinst('core', ['base']),
+                self.makeWebinst('base'),
+                self.makeWebinst('upgraded', ['base'])
+            ]
+            results = self.deploy(webinsts, jobs)
+            self.assertEqual(results, dict((webinst, True) for webinst in webinsts))
+            deployed = [os.path.basename(call[5]).split('-')[0] for call in self.getWiffCalls() if call[3] != 'list']
+            self.assertEqual(sorted(deployed), ['app', 'base', 'core', 'upgraded'])
+            for (module, required) in [('app', 'core'), ('app', 'upgraded'), ('core', 'base'), ('upgraded', 'base')]:
+                self.assertLess(deployed.index(required), deployed.index(module))
+
+    def testInstallOrUpgrade(self):
+        self.deploy([self.makeWebinst('upgraded'), self.makeWebinst('new')])
+        operations = dict((os.path.basename(call[5]).split('-')[0], call[3]) for call in self.getWiffCalls() if call[3] != 'list')
+        self.assertEqual(operations, {'upgraded': 'upgrade', 'new': 'install'})
+
+    def testFailedRequirementSkipsDependents(self):
+        failing = self.makeWebinst('failing', fileName='fail-failing-1.0.0-1.webinst')
+        dependent = self.makeWebinst('dependent', ['failing'])
+        indirect = self.makeWebinst('indirect', ['dependent'])
+        independent = self.makeWebinst('independent')
+        results = self.deploy([indirect, dependent, failing, independent])
+        self.assertEqual(results, {failing: False, dependent: None, indirect: None, independent: True})
+        deployed = [os.path.basename(call[5]) for call in self.getWiffCalls() if call[3] != 'list']
+        self.assertEqual(sorted(deployed), sorted([os.path.basename(failing.path), os.path.basename(independent.path)]))
+
+    def testInventoryIsListedOnce(self):
+        webinsts = [self.makeWebinst('module%s'%(index)) for index in range(5)]
+        self.deploy(webinsts, jobs=3)
+        listCalls = [call for call in self.getWiffCalls() if call[3] == 'list']
+        self.assertEqual(listCalls, [['context', 'test', 'module', 'list', 'installed']])
+
+    def testUnexpectedErrorIsAFailure(self):
+        (broken, dependent, other) = webinsts = [self.makeWebinst('broken'), self.makeWebinst('dependent', ['broken']), self.makeWebinst('other')]
+        deployer = Deployer(self.wiff, 'test')
+        def deploy(webinst):
+            if webinst is broken:
+                raise ValueError('unexpected')
+            return deployer.deploy(webinst)
+        results = deployWebinsts(webinsts, deploy, jobs=2)
+        self.assertEqual(results, {broken: False, dependent: None, other: True})
+        self.assertIn('%s: unexpected error'%(broken.path), sys.stderr.getvalue())
+
+    def testCycleIsRejected(self):
+        webinsts = [self.makeWebinst('first', ['second']), self.makeWebinst('second', ['first'])]
+        self.assertRaises(NameError, self.deploy, webinsts)
+
+if __name__ == "__main__":
+    unittest.main()
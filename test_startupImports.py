@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""checks that importing a tool does not load modules only some of its commands need
+(see the startup run of benchmark.py, which also times the imports)
+
+    python -m unittest test_startupImports
+"""
+
+import unittest
+
+from benchmark import STARTUP_TOOLS, measureImportTime
+
+# modules which are slow to import, or only needed by some options: they are imported where they are used
+LAZY_MODULES = [
+    'cProfile',
+    'difflib',
+    'fsWatch',
+    'hashlib',
+    'multiprocessing',
+    'pstats',
+    'pyinotify',
+    'socket',
+    'sqlite3',
+    'subprocess',
+    'tarfile',
+    'tempfile',
+    'xml.dom.minidom'
+]
+
+class StartupImportsTest(unittest.TestCase):
+    # failures also show the modules
+    longMessage = True
+
+    def testLazyModulesAreNotImported(self):
+        for tool in STARTUP_TOOLS:
+            # in a new interpreter, so that modules imported by other tests do not count
+            loaded = set(measureImportTime(tool, 1)['loaded'])
+            self.assertEqual([module for module in LAZY_MODULES if module in loaded], [],
+                "importing %s loads modules it should import lazily"%(tool))
+
+if __name__ == "__main__":
+    unittest.main()
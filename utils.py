@@ -2,6 +2,8 @@
 # -*- coding: UTF-8 -*-
 
 import os.path
+import sys
+import errno
 import shutil
 
 def makedirs(newdir):
@@ -23,38 +25,394 @@ def makedirs(newdir):
         if tail:
             os.mkdir(newdir)
 
-def copytree(src, dst, symlinks=False, ignore=None):
-    names = os.listdir(src)
-    if ignore is not None:
-        ignored_names = ignore(src, names)
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+class DirEntry(object):
+    """minimal os.DirEntry, used when scandir is not available"""
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+    def is_dir(self):
+        return os.path.isdir(self.path)
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+def listEntries(directory):
+    """returns the entries of directory, sorted by name
+        with scandir, file types come from the directory listing and are not stat'ed again
+    """
+    if scandir is not None:
+        entries = list(scandir(directory))
     else:
-        ignored_names = set()
+        entries = [DirEntry(directory, name) for name in os.listdir(directory)]
+    entries.sort(key=lambda entry: entry.name)
+    return entries
 
-    makedirs(dst)
+# ioctl request cloning a file on copy-on-write filesystems (linux/fs.h)
+FICLONE = 0x40049409
+
+COPY_MODES = ['copy', 'hardlink', 'reflink']
+
+def reflinkFile(srcname, dstname):
+    """clones srcname into dstname, sharing their blocks until one of them is written"""
+    import fcntl
+    srcFile = open(srcname, 'rb')
+    try:
+        dstFile = open(dstname, 'wb')
+        try:
+            fcntl.ioctl(dstFile.fileno(), FICLONE, srcFile.fileno())
+        finally:
+            dstFile.close()
+    except:
+        if os.path.exists(dstname):
+            os.unlink(dstname)
+        raise
+    finally:
+        srcFile.close()
+    shutil.copystat(srcname, dstname)
+
+# errors of os.link and of the clone ioctl meaning the two paths cannot share their data:
+# the file is copied instead
+LINK_UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+class FileCopier(object):
+    """copies files in mode (see COPY_MODES), falling back to a plain copy of a file
+        when it cannot be linked or cloned (another device, or a filesystem not supporting it)
+        the same copier may be called by several threads
+    """
+    def __init__(self, mode='copy'):
+        if mode not in COPY_MODES:
+            raise NameError("unknown copy mode %s (use one of %s)"%(mode, ', '.join(COPY_MODES)))
+        self.mode = mode
+
+    def link(self, srcname, dstname):
+        """links or clones srcname to dstname, and returns False if the file has to be copied"""
+        try:
+            if self.mode == 'hardlink':
+                os.link(srcname, dstname)
+            else:
+                reflinkFile(srcname, dstname)
+        except ImportError:
+            # no fcntl
+            return False
+        except (IOError, OSError), why:
+            if why.errno in LINK_UNSUPPORTED_ERRORS:
+                return False
+            raise
+        return True
+
+    def __call__(self, job):
+        (srcname, dstname) = job
+        try:
+            # a link can not replace a file, and a file linked to its source must not be written to
+            if self.mode != 'copy':
+                if os.path.lexists(dstname):
+                    os.unlink(dstname)
+            elif os.path.exists(dstname) and os.path.samefile(srcname, dstname):
+                os.unlink(dstname)
+            if (self.mode != 'copy') and self.link(srcname, dstname):
+                return None
+            shutil.copy2(srcname, dstname)
+        except (IOError, os.error, shutil.Error), why:
+            return (srcname, dstname, str(why))
+        return None
+
+def mapInThreads(function, items, jobs):
+    """returns [function(item) for item in items], computed by up to jobs threads"""
+    if (jobs <= 1) or (len(items) <= 1):
+        return [function(item) for item in items]
+    import threading
+    results = [None] * len(items)
+    indexes = iter(range(len(items)))
+    lock = threading.Lock()
+    raised = []
+    def work():
+        while not raised:
+            with lock:
+                index = next(indexes, None)
+            if index is None:
+                return
+            try:
+                results[index] = function(items[index])
+            except:
+                raised.append(sys.exc_info())
+    threads = [threading.Thread(target=work) for threadIndex in range(min(jobs, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if raised:
+        raise raised[0][0], raised[0][1], raised[0][2]
+    return results
+
+def copytree(src, dst, symlinks=False, ignore=None, mode='copy', jobs=4):
+    """copies src into dst, which may already exist (as shutil.copytree, but dst may exist)
+
+        - directories are walked with scandir when it is available, and created as they are found
+        - files are copied by jobs threads; mode 'hardlink' links them instead, and 'reflink'
+          clones them on copy-on-write filesystems (both fall back to copies when not possible).
+          Hardlinked files must not be modified in place, since their source would change too.
+        - errors are collected, and raised at the end in a single shutil.Error
+    """
     errors = []
-    for name in names:
-        if name in ignored_names:
+    fileJobs = []
+    # directories are stamped once their content is copied, deepest first
+    copiedDirs = []
+    makedirs(dst)
+    toCopy = [(src, dst)]
+    while toCopy:
+        (srcDir, dstDir) = toCopy.pop()
+        try:
+            entries = listEntries(srcDir)
+        except OSError, why:
+            errors.append((srcDir, dstDir, str(why)))
             continue
-        srcname = os.path.join(src, name)
-        dstname = os.path.join(dst, name)
-        try:
-            if symlinks and os.path.islink(srcname):
-                linkto = os.readlink(srcname)
-                os.symlink(linkto, dstname)
-            elif os.path.isdir(srcname):
-                copytree(srcname, dstname, symlinks, ignore)
-            else:
-                shutil.copy2(srcname, dstname)
-            # XXX What about devices, sockets etc.?
-        except (IOError, os.error), why:
-            errors.append((srcname, dstname, str(why)))
-        # catch the Error from the recursive copytree so that we can
-        # continue with other files
-        except shutil.Error, err:
-            errors.extend(err.args[0])
-    try:
-        shutil.copystat(src, dst)
-    except OSError, why:
-        errors.extend((src, dst, str(why)))
+        copiedDirs.append((srcDir, dstDir))
+        if ignore is not None:
+            ignored_names = ignore(srcDir, [entry.name for entry in entries])
+        else:
+            ignored_names = set()
+        subDirs = []
+        for entry in entries:
+            if entry.name in ignored_names:
+                continue
+            srcname = entry.path
+            dstname = os.path.join(dstDir, entry.name)
+            try:
+                if symlinks and entry.is_symlink():
+                    linkto = os.readlink(srcname)
+                    os.symlink(linkto, dstname)
+                elif entry.is_dir():
+                    if not os.path.isdir(dstname):
+                        os.mkdir(dstname)
+                    subDirs.append((srcname, dstname))
+                else:
+                    fileJobs.append((srcname, dstname))
+                # XXX What about devices, sockets etc.?
+            except (IOError, os.error), why:
+                errors.append((srcname, dstname, str(why)))
+        toCopy.extend(reversed(subDirs))
+
+    copier = FileCopier(mode)
+    errors.extend(result for result in mapInThreads(copier, fileJobs, jobs) if result)
+
+    for (srcDir, dstDir) in reversed(copiedDirs):
+        try:
+            shutil.copystat(srcDir, dstDir)
+        except OSError, why:
+            errors.append((srcDir, dstDir, str(why)))
     if errors:
-        raise shutil.Error(errors)
\ No newline at end of file
+        raise shutil.Error(errors)
+
+def checkOverwrittenFiles(fileNames):
+    """raises NameError, after listing them, if some of fileNames already exist"""
+    overwrittenFiles = 0
+    for fileName in fileNames:
+        if(os.path.exists(fileName)):
+            overwrittenFiles += 1
+            print "existingt file %s would be overwritten. please use --force to allow this"%(fileName)
+    if(overwrittenFiles > 0):
+        raise NameError("overwriting %s files"%(overwrittenFiles))
+
+def splitDiffLines(content):
+    """returns the lines of content, with their end of line, marking a last line without one the way diff does"""
+    lines = [line + '\n' for line in content.split('\n')]
+    if lines[-1] == '\n':
+        lines.pop()
+    else:
+        lines[-1] = lines[-1][:-1] + '\n\\ No newline at end of file\n'
+    return lines
+
+def getDiff(fileName, newContent):
+    """returns the unified diff turning the content of fileName into newContent, or '' if they are the same
+        a missing file is compared as an empty one
+    """
+    import difflib
+    if isinstance(newContent, unicode):
+        newContent = newContent.encode('utf-8')
+    oldContent = ''
+    fromFileName = '/dev/null'
+    if os.path.exists(fileName):
+        oldFile = open(fileName, 'rb')
+        try:
+            oldContent = oldFile.read()
+        finally:
+            oldFile.close()
+        fromFileName = fileName
+    if oldContent == newContent:
+        return ''
+    return ''.join(difflib.unified_diff(splitDiffLines(oldContent), splitDiffLines(newContent), fromFileName, fileName))
+
+def printDiff(fileName, newContent):
+    """prints the unified diff turning the content of fileName into newContent, and returns True if they differ"""
+    diff = getDiff(fileName, newContent)
+    sys.stdout.write(diff)
+    return bool(diff)
+
+def loadManifestRows(manifestFile):
+    """returns the rows of a manifest, as dicts
+        - a .json manifest is a list of objects
+        - other manifests are csv files with a header line, delimited by ';' or ','
+    """
+    import csv
+    import json
+    if manifestFile.lower().endswith('.json'):
+        rows = json.load(open(manifestFile))
+        if (not isinstance(rows, list)) or [row for row in rows if not isinstance(row, dict)]:
+            raise NameError("%s is not a json list of objects"%(manifestFile))
+        return rows
+    manifest = open(manifestFile, 'rb')
+    try:
+        try:
+            dialect = csv.Sniffer().sniff(manifest.readline(), ';,')
+        except csv.Error:
+            # a single column
+            dialect = csv.excel
+        manifest.seek(0)
+        return [dict((key.strip(), (value or '').strip()) for (key, value) in row.items() if key)
+            for row in csv.DictReader(manifest, dialect=dialect)]
+    finally:
+        manifest.close()
+
+def loadJsonFile(fileName, default=None):
+    """returns the content of a json file, or default if it is missing or unreadable"""
+    import json
+    try:
+        jsonFile = open(fileName, 'r')
+        try:
+            return json.load(jsonFile)
+        finally:
+            jsonFile.close()
+    except (IOError, ValueError):
+        return default
+
+umask = None
+
+def getUmask():
+    """returns the umask of the process (read once, since it can only be read by changing it)"""
+    global umask
+    if umask is None:
+        umask = os.umask(0022)
+        os.umask(umask)
+    return umask
+
+def setReplacedFileMode(tmpFileName, fileName):
+    """gives tmpFileName the mode of fileName, which it is going to replace,
+        or the mode of a file created by open() if there is no fileName (mkstemp creates files readable by their owner only)
+    """
+    if os.path.exists(fileName):
+        shutil.copymode(fileName, tmpFileName)
+    else:
+        os.chmod(tmpFileName, 0666 & ~getUmask())
+
+def writeJsonFile(fileName, content):
+    """writes content as json, through a temp file renamed into place
+        so that a reader never sees a partially written file
+    """
+    import json
+    import tempfile
+    directory = os.path.dirname(fileName)
+    if directory:
+        makedirs(directory)
+    tmpFd, tmpFileName = tempfile.mkstemp(dir=directory or '.', prefix='.tmp-')
+    try:
+        tmpFile = os.fdopen(tmpFd, 'w')
+        json.dump(content, tmpFile, sort_keys=True)
+        tmpFile.close()
+        setReplacedFileMode(tmpFileName, fileName)
+        os.rename(tmpFileName, fileName)
+    except:
+        os.unlink(tmpFileName)
+        raise
+
+def getFileSignature(fileName, previousSignature=None):
+    """returns [mtime, size, md5] of fileName, or None if it does not exist
+        the md5 of previousSignature is reused when mtime and size did not change
+    """
+    try:
+        fileStat = os.stat(fileName)
+    except OSError:
+        return None
+    if previousSignature and (previousSignature[0] == fileStat.st_mtime) and (previousSignature[1] == fileStat.st_size):
+        return [fileStat.st_mtime, fileStat.st_size, previousSignature[2]]
+    import hashlib
+    md5 = hashlib.md5()
+    hashedFile = open(fileName, 'rb')
+    try:
+        for chunk in iter(lambda: hashedFile.read(65536), ''):
+            md5.update(chunk)
+    finally:
+        hashedFile.close()
+    return [fileStat.st_mtime, fileStat.st_size, md5.hexdigest()]
+
+def getFileStamps(fileNames):
+    """returns [mtime, size] of each of fileNames, None for the ones which do not exist"""
+    stamps = []
+    for fileName in fileNames:
+        try:
+            fileStat = os.stat(fileName)
+            stamps.append([fileStat.st_mtime, fileStat.st_size])
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+class FileCache(object):
+    """values computed from files, kept until one of these files changes (its mtime or size)
+        in a long-lived process (see devTools.py), files which did not change are not parsed again
+    """
+    def __init__(self):
+        # key -> (stamps of the files, value)
+        self.entries = {}
+
+    def getKey(self, fileNames, kind):
+        return (kind, ) + tuple(os.path.abspath(fileName) for fileName in fileNames)
+
+    def get(self, fileNames, compute, kind=None):
+        """returns the value computed by compute() from fileNames, computing it again only if they changed
+            kind tells apart values computed differently from the same files
+        """
+        key = self.getKey(fileNames, kind)
+        stamps = getFileStamps(fileNames)
+        entry = self.entries.get(key)
+        if (entry is not None) and (entry[0] == stamps):
+            return entry[1]
+        value = compute()
+        self.entries[key] = (stamps, value)
+        return value
+
+    def discard(self, fileNames, kind=None):
+        self.entries.pop(self.getKey(fileNames, kind), None)
+
+    def clear(self):
+        self.entries.clear()
+
+def createTempFileFor(fileName):
+    """returns (file, path) of a new temp file, created next to fileName
+        so that it can later be renamed over it (see commitTempFile)
+    """
+    import tempfile
+    tmpFd, tmpFileName = tempfile.mkstemp(dir=os.path.dirname(fileName) or '.', prefix='.%s.'%(os.path.basename(fileName)))
+    return (os.fdopen(tmpFd, 'wb'), tmpFileName)
+
+def commitTempFile(tmpFile, tmpFileName, fileName):
+    """flushes tmpFile to disk and atomically renames it to fileName"""
+    try:
+        tmpFile.flush()
+        os.fsync(tmpFile.fileno())
+        tmpFile.close()
+        setReplacedFileMode(tmpFileName, fileName)
+        os.rename(tmpFileName, fileName)
+    except:
+        discardTempFile(tmpFile, tmpFileName)
+        raise
+
+def discardTempFile(tmpFile, tmpFileName):
+    tmpFile.close()
+    if os.path.exists(tmpFileName):
+        os.unlink(tmpFileName)